@@ -0,0 +1,45 @@
+#!/usr/bin/python
+#
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import time
+
+sys.path.append('hooks/')
+
+from charmhelpers.core.hookenv import action_set
+from charmhelpers.core.unitdata import kv
+
+from heat_recycle import RECYCLES_KEY
+
+
+def engine_recycles():
+    """Report the heat-engine recycles recorded on this unit.
+
+    Sets count and recycles, one line per recycle, oldest first."""
+    recycles = kv().get(RECYCLES_KEY, [])
+    lines = []
+    for event in recycles:
+        lines.append('{} {}: {}MB before (largest process {}MB), {}MB '
+                     'after'.format(
+                         time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                       time.gmtime(event['time'])),
+                         event['reason'], event['rss_before'],
+                         event['max_rss_before'], event['rss_after']))
+    action_set({'count': len(recycles), 'recycles': '\n'.join(lines)})
+
+
+if __name__ == '__main__':
+    engine_recycles()
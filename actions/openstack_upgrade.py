@@ -24,11 +24,12 @@ from charmhelpers.contrib.openstack.utils import (
 
 from heat_relations import (
     config_changed,
-    CONFIGS,
+    get_configs,
 )
 
 from heat_utils import (
     do_openstack_upgrade,
+    restart_pending_services,
 )
 
 
@@ -45,8 +46,10 @@ def openstack_upgrade():
 
     if (do_action_openstack_upgrade('heat-common',
                                     do_openstack_upgrade,
-                                    CONFIGS)):
+                                    get_configs())):
         config_changed()
+        # Hooks restart the queued services on exit; actions do it here.
+        restart_pending_services()
 
 if __name__ == '__main__':
     openstack_upgrade()
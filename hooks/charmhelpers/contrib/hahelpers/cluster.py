@@ -29,10 +29,12 @@ import subprocess
 import os
 
 from socket import gethostname as get_unit_hostname
+from xml.etree import ElementTree
 
 import six
 
 from charmhelpers.core.hookenv import (
+    cached,
     log,
     relation_ids,
     related_units as relation_list,
@@ -71,6 +73,89 @@ class CRMDCNotFound(Exception):
     pass
 
 
+class ClusterState(object):
+    """Leadership and pacemaker state for the current hook.
+
+    Juju leadership, the ha relation and the pacemaker status are each
+    looked up once, on first use; pacemaker is read from a single crm_mon
+    XML dump covering both resource placement and the DC.
+    """
+
+    def __init__(self):
+        self._juju_leader = None
+        self._clustered = None
+        self._peers = {}
+        self._crm = None
+
+    @property
+    def juju_leader(self):
+        """Result of is-leader; raises NotImplementedError if unsupported."""
+        if self._juju_leader is None:
+            self._juju_leader = juju_is_leader()
+        return self._juju_leader
+
+    @property
+    def clustered(self):
+        if self._clustered is None:
+            self._clustered = False
+            for r_id in (relation_ids('ha') or []):
+                for unit in (relation_list(r_id) or []):
+                    if relation_get('clustered', rid=r_id, unit=unit):
+                        self._clustered = True
+                        return True
+        return self._clustered
+
+    def peers(self, peer_relation='cluster'):
+        if peer_relation not in self._peers:
+            peers = []
+            for r_id in (relation_ids(peer_relation) or []):
+                for unit in (relation_list(r_id) or []):
+                    peers.append(unit)
+            self._peers[peer_relation] = peers
+        return list(self._peers[peer_relation])
+
+    @property
+    def crm(self):
+        """Returns {'dc': name or None, 'resources': {id: set(nodes)}}, or
+        None if crm_mon is unavailable."""
+        if self._crm is None:
+            self._crm = self._crm_mon() or {}
+        return self._crm or None
+
+    def refresh_crm(self):
+        self._crm = None
+
+    @staticmethod
+    def _crm_mon():
+        try:
+            output = subprocess.check_output(['crm_mon', '-1', '--as-xml'],
+                                             stderr=subprocess.STDOUT)
+            root = ElementTree.fromstring(output)
+        except (OSError, subprocess.CalledProcessError,
+                ElementTree.ParseError) as e:
+            log('Unable to read crm_mon status: %s' % e, level=DEBUG)
+            return None
+
+        dc = None
+        current_dc = root.find('summary/current_dc')
+        if current_dc is not None and current_dc.get('present') == 'true':
+            dc = current_dc.get('name')
+
+        resources = {}
+        for element in root.iter():
+            if element.tag not in ('resource', 'group', 'clone'):
+                continue
+            nodes = set(node.get('name') for node in element.iter('node'))
+            resources.setdefault(element.get('id'), set()).update(nodes)
+        return {'dc': dc, 'resources': resources}
+
+
+@cached
+def cluster_state():
+    """Returns the ClusterState for this hook."""
+    return ClusterState()
+
+
 def is_elected_leader(resource):
     """
     Returns True if the charm executing this is the elected cluster leader.
@@ -85,7 +170,7 @@ def is_elected_leader(resource):
         other words, the oldest surviving unit.
     """
     try:
-        return juju_is_leader()
+        return cluster_state().juju_leader
     except NotImplementedError:
         log('Juju leadership election feature not enabled'
             ', using fallback support',
@@ -104,20 +189,24 @@ def is_elected_leader(resource):
 
 
 def is_clustered():
-    for r_id in (relation_ids('ha') or []):
-        for unit in (relation_list(r_id) or []):
-            clustered = relation_get('clustered',
-                                     rid=r_id,
-                                     unit=unit)
-            if clustered:
-                return True
-    return False
+    return cluster_state().clustered
 
 
 def is_crm_dc():
     """
     Determine leadership by querying the pacemaker Designated Controller
     """
+    state = cluster_state()
+    crm = state.crm
+    if crm is not None:
+        current_dc = crm['dc']
+        if current_dc == get_unit_hostname():
+            return True
+        elif current_dc is None:
+            state.refresh_crm()
+            raise CRMDCNotFound('Current DC: NONE')
+        return False
+
     cmd = ['crm', 'status']
     try:
         status = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
@@ -144,13 +233,30 @@ def is_crm_dc():
 def is_crm_leader(resource, retry=False):
     """
     Returns True if the charm calling this is the elected corosync leader,
-    as returned by calling the external "crm" command.
+    as determined from pacemaker (crm_mon, or the "crm" command if that is
+    unavailable).
 
     We allow this operation to be retried to avoid the possibility of getting a
-    false negative. See LP #1396246 for more info.
+    false negative. See LP #1396246 for more info. The cached pacemaker state
+    is dropped before each retry.
     """
     if resource == DC_RESOURCE_NAME:
         return is_crm_dc()
+
+    state = cluster_state()
+    crm = state.crm
+    if crm is not None:
+        if resource not in crm['resources']:
+            return False
+        nodes = crm['resources'][resource]
+        if get_unit_hostname() in nodes:
+            return True
+        if not nodes:
+            state.refresh_crm()
+            raise CRMResourceNotFound("CRM resource %s not found" %
+                                      (resource))
+        return False
+
     cmd = ['crm', 'resource', 'show', resource]
     try:
         status = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
@@ -175,11 +281,7 @@ def is_leader(resource):
 
 
 def peer_units(peer_relation="cluster"):
-    peers = []
-    for r_id in (relation_ids(peer_relation) or []):
-        for unit in (relation_list(r_id) or []):
-            peers.append(unit)
-    return peers
+    return cluster_state().peers(peer_relation)
 
 
 def peer_ips(peer_relation='cluster', addr_key='private-address'):
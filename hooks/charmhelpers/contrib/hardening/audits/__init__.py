@@ -12,6 +12,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+import json
+import os
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+from charmhelpers.core import unitdata
+from charmhelpers.core.hookenv import (
+    log,
+    DEBUG,
+    INFO,
+)
+
+# Memoized stacks are still run in full at least this often (seconds), so
+# that resources only discovered by building the audits (e.g. new suid
+# files) are eventually picked up.
+MEMO_MAX_AGE = 6 * 60 * 60
+MEMO_KEY = 'hardening:memo:%s'
+TIMINGS_KEY = 'hardening:timings:%s'
+AUDIT_THREADS = 4
+
+# Held while an audit changes the system, so that mutations are never run
+# concurrently even though compliance checks may be.
+COMPLY_LOCK = threading.RLock()
+
 
 class BaseAudit(object):  # NO-QA
     """Base class for hardening checks.
@@ -20,10 +47,36 @@ class BaseAudit(object):  # NO-QA
     is in compliance for the specified check. If it is not in compliance, the
     check method will return a value which will be supplied to the.
     """
+    # Whether resources() name directory trees rather than single paths.
+    recursive = False
+    # Whether ensure_compliance() only reads state outside of comply(), so
+    # that it can run in a worker thread alongside unrelated audits.
+    parallel_check = False
+    # Cleared by ensure_compliance() when it finds the system out of
+    # compliance, whether or not it then fixed it. Only compliant runs are
+    # memoized by run_audits().
+    compliant = True
+
     def __init__(self, *args, **kwargs):
         self.unless = kwargs.get('unless', None)
         super(BaseAudit, self).__init__()
 
+    def resources(self):
+        """Returns the paths whose state determines the audit's outcome.
+
+        If none of these paths have changed since the audit last ran, the
+        audit does not need to run again. Audits returning None are always
+        run.
+        """
+        return None
+
+    def after_run(self):
+        """Called by run_audits() in the calling thread once every audit of
+        the run has executed, so that audits checked in worker threads can
+        save state to unitdata.
+        """
+        pass
+
     def ensure_compliance(self):
         """Checks to see if the current hardening check is in compliance or
         not.
@@ -52,3 +105,251 @@ class BaseAudit(object):  # NO-QA
             return not self.unless()
 
         return not self.unless
+
+
+def fingerprint(paths, recursive=False):
+    """Returns a digest of the stat state of paths.
+
+    :param paths: list of paths to fingerprint.
+    :param recursive: if True, include everything below each path.
+    :returns: hex digest string.
+    """
+    digest = hashlib.sha256()
+
+    def _add(path):
+        try:
+            st = os.lstat(path)
+        except OSError:
+            digest.update(('%s:missing\n' % path).encode('UTF-8'))
+            return
+        digest.update(('%s:%s:%s:%s:%s:%s:%s:%s\n' % (
+            path, st.st_ino, st.st_mode, st.st_uid, st.st_gid, st.st_size,
+            st.st_mtime, st.st_ctime)).encode('UTF-8'))
+
+    for path in sorted(paths):
+        _add(path)
+        if recursive and os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(dirs + files):
+                    _add(os.path.join(root, name))
+
+    return digest.hexdigest()
+
+
+def _audit_resources(audit):
+    resources = audit.resources()
+    if resources is None:
+        return None
+    return sorted(set(resources))
+
+
+def _settings_fingerprint(stack):
+    from charmhelpers.contrib.hardening import utils
+    settings = json.dumps(utils.get_settings(stack), sort_keys=True,
+                          default=str)
+    return hashlib.sha256(settings.encode('UTF-8')).hexdigest()
+
+
+def stack_unchanged(stack):
+    """Determines whether a hardening stack can be skipped entirely.
+
+    This is the case when the stack's settings are unchanged since its last
+    complete run, every audit in that run was memoizable and compliant, and
+    none of their resources have changed since.
+
+    :param stack: name of the stack e.g. 'os'.
+    :returns: boolean
+    """
+    memo = unitdata.kv().get(MEMO_KEY % stack)
+    if not memo or not memo.get('complete'):
+        return False
+    if time.time() - memo['time'] > MEMO_MAX_AGE:
+        return False
+    if memo['settings'] != _settings_fingerprint(stack):
+        return False
+    for state in memo['audits'].values():
+        if fingerprint(state['resources'], state['recursive']) != state['fp']:
+            return False
+
+    log("Hardening stack '%s' unchanged, skipping %s audits" %
+        (stack, len(memo['audits'])), level=INFO)
+    return True
+
+
+def _overlaps(a, b):
+    return a == b or a.startswith(b.rstrip('/') + '/') or \
+        b.startswith(a.rstrip('/') + '/')
+
+
+def _group_audits(audits):
+    """Groups audits which touch overlapping resources.
+
+    :param audits: list of BaseAudit instances.
+    :returns: tuple of (groups, exclusive) where groups is a list of lists of
+              indexes into audits, each list in the original order, and
+              exclusive lists the audits with unknown resources.
+    """
+    parent = list(range(len(audits)))
+
+    def _find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    exclusive = []
+    seen = []
+    for i, audit in enumerate(audits):
+        resources = _audit_resources(audit)
+        if resources is None:
+            exclusive.append(i)
+            continue
+        for path in resources:
+            for j, other in seen:
+                if _overlaps(path, other):
+                    parent[_find(i)] = _find(j)
+            seen.append((i, path))
+
+    groups = {}
+    for i in range(len(audits)):
+        if i not in exclusive:
+            groups.setdefault(_find(i), []).append(i)
+    return sorted(groups.values()), exclusive
+
+
+def execute_audits(audits):
+    """Runs audits, checking independent ones concurrently.
+
+    Audits with unknown resources keep their place in the original order:
+    they split the list into segments run one after the other. Within a
+    segment, audits whose resources overlap are run in order within one
+    group. When a segment has at least two groups made up only of
+    parallel_check audits, those run in a thread pool and the rest (e.g.
+    templated files, which keep checksums in unitdata) in the calling
+    thread, so only groups touching disjoint resources can run out of order
+    relative to each other. Otherwise the segment runs in order. Mutations
+    are serialised by COMPLY_LOCK.
+
+    :param audits: list of BaseAudit instances.
+    :returns: list of seconds spent on each audit.
+    """
+    elapsed = [0.0] * len(audits)
+
+    def _run(indexes):
+        for i in indexes:
+            audit = audits[i]
+            started = time.time()
+            if audit.parallel_check:
+                audit.ensure_compliance()
+            else:
+                with COMPLY_LOCK:
+                    audit.ensure_compliance()
+            elapsed[i] = time.time() - started
+
+    def _run_segment(indexes):
+        groups, _ = _group_audits([audits[i] for i in indexes])
+        groups = [[indexes[i] for i in group] for group in groups]
+        threaded = [g for g in groups
+                    if all(audits[i].parallel_check for i in g)]
+        serial = [g for g in groups if g not in threaded]
+        if len(threaded) < 2:
+            _run(indexes)
+            return
+        pool = ThreadPool(AUDIT_THREADS)
+        try:
+            result = pool.map_async(_run, threaded)
+            for group in serial:
+                _run(group)
+            result.get()
+        finally:
+            pool.close()
+            pool.join()
+
+    _, exclusive = _group_audits(audits)
+    segment = []
+    for i in range(len(audits)):
+        if i in exclusive:
+            _run_segment(segment)
+            segment = []
+            _run([i])
+        else:
+            segment.append(i)
+    _run_segment(segment)
+    return elapsed
+
+
+def run_audits(stack, audits):
+    """Runs a stack's audits, skipping those whose resources are unchanged.
+
+    The stat state of each audit's resources is recorded after a compliant
+    run, so on the next run only audits which were not compliant, or whose
+    resources drifted (or whose stack settings changed), are executed again.
+    The time spent on each executed audit is recorded too.
+
+    :param stack: name of the stack e.g. 'os'.
+    :param audits: list of BaseAudit instances.
+    """
+    db = unitdata.kv()
+    settings = _settings_fingerprint(stack)
+    memo = db.get(MEMO_KEY % stack) or {}
+    if memo.get('settings') != settings:
+        memo = {}
+    previous = memo.get('audits', {})
+
+    audit_state = {}
+    complete = True
+    pending = []
+    keys = set()
+    skipped = 0
+    for audit in audits:
+        name = audit.__class__.__name__
+        resources = _audit_resources(audit)
+        if resources is None:
+            complete = False
+            key = name
+        else:
+            key = '%s:%s' % (name, ','.join(resources))
+            while key in keys:
+                key += '+'
+            keys.add(key)
+            state = previous.get(key)
+            if (state is not None and
+                    fingerprint(resources, audit.recursive) == state['fp']):
+                log("Skipping unchanged '%s' check" % (name), level=DEBUG)
+                audit_state[key] = state
+                skipped += 1
+                continue
+
+        log("Running '%s' check" % (name), level=DEBUG)
+        audit.compliant = True
+        pending.append((audit, key, resources))
+
+    elapsed = execute_audits([audit for audit, _, _ in pending])
+    for audit, _, _ in pending:
+        audit.after_run()
+
+    timings = {}
+    for (audit, key, resources), seconds in zip(pending, elapsed):
+        timings[key] = round(seconds, 3)
+        if not audit.compliant:
+            # Checked again next time, until it is found compliant.
+            complete = False
+        elif resources is not None:
+            audit_state[key] = {
+                'resources': resources,
+                'recursive': audit.recursive,
+                'fp': fingerprint(resources, audit.recursive),
+            }
+
+    db.set(MEMO_KEY % stack, {'settings': settings,
+                              'time': time.time(),
+                              'complete': complete,
+                              'audits': audit_state})
+    db.set(TIMINGS_KEY % stack, timings)
+    db.flush()
+    log("Hardening stack '%s': %s audits executed, %s skipped" %
+        (stack, len(pending), skipped), level=INFO)
+    slowest = sorted(timings.items(), key=lambda t: t[1], reverse=True)[:3]
+    for key, seconds in slowest:
+        log("Hardening audit '%s' took %.3fs" % (key, seconds), level=DEBUG)
@@ -12,19 +12,51 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import re
+import os
 import subprocess
 
 from six import string_types
 
+from charmhelpers.core import unitdata
 from charmhelpers.core.hookenv import (
+    atexit,
     log,
+    DEBUG,
     INFO,
     ERROR,
 )
 
 from charmhelpers.contrib.hardening.audits import BaseAudit
 
+MODS_ENABLED = '/etc/apache2/mods-enabled'
+MODULES_KEY = 'hardening:apache-modules'
+
+# Set when modules have been disabled and apache still needs to pick the
+# change up; cleared by any reload done before the hook exits.
+_reload = {'pending': False}
+
+
+def apache_reloaded():
+    """Records that apache has been reloaded during this hook.
+
+    Charms that reload apache themselves should call this so that a reload
+    requested by the audits is folded into theirs rather than repeated.
+    """
+    _reload['pending'] = False
+
+
+def _graceful_reload():
+    if not _reload['pending']:
+        log("Apache already reloaded this hook", level=DEBUG)
+        return
+
+    _reload['pending'] = False
+    try:
+        subprocess.check_output(['apache2ctl', 'graceful'])
+    except subprocess.CalledProcessError as e:
+        log('Error occurred reloading apache. '
+            'Output is: %s' % e.output, level=ERROR)
+
 
 class DisabledModuleAudit(BaseAudit):
     """Audits Apache2 modules.
@@ -40,6 +72,9 @@ class DisabledModuleAudit(BaseAudit):
         else:
             self.modules = modules
 
+    def resources(self):
+        return [MODS_ENABLED]
+
     def ensure_compliance(self):
         """Ensures that the modules are not loaded."""
         if not self.modules:
@@ -57,29 +92,48 @@ class DisabledModuleAudit(BaseAudit):
             if len(non_compliant_modules) == 0:
                 return
 
-            for module in non_compliant_modules:
-                self._disable_module(module)
+            self.compliant = False
+            self._disable_modules(non_compliant_modules)
             self._restart_apache()
         except subprocess.CalledProcessError as e:
+            self.compliant = False
             log('Error occurred auditing apache module compliance. '
                 'This may have been already reported. '
                 'Output is: %s' % e.output, level=ERROR)
 
     @staticmethod
     def _get_loaded_modules():
-        """Returns the modules which are enabled in Apache."""
-        output = subprocess.check_output(['apache2ctl', '-M'])
-        modules = []
-        for line in output.strip().split():
-            # Each line of the enabled module output looks like:
-            #  module_name (static|shared)
-            # Plus a header line at the top of the output which is stripped
-            # out by the regex.
-            matcher = re.search(r'^ (\S*)', line)
-            if matcher:
-                modules.append(matcher.group(1))
+        """Returns the modules which are enabled in Apache.
+
+        The inventory is read from the mods-enabled directory and cached
+        against its mtime, since a2enmod/a2dismod always add or remove a
+        link there.
+        """
+        try:
+            mtime = os.stat(MODS_ENABLED).st_mtime
+        except OSError:
+            return []
+
+        db = unitdata.kv()
+        cached = db.get(MODULES_KEY)
+        if cached and cached['mtime'] == mtime:
+            return cached['modules']
+
+        modules = sorted(f[:-len('.load')] for f in os.listdir(MODS_ENABLED)
+                         if f.endswith('.load'))
+        db.set(MODULES_KEY, {'mtime': mtime, 'modules': modules})
         return modules
 
+    @classmethod
+    def _disable_modules(cls, modules):
+        """Disables the specified modules in Apache with a single a2dismod,
+        falling back to one call per module if that fails."""
+        try:
+            subprocess.check_call(['a2dismod'] + list(modules))
+        except subprocess.CalledProcessError:
+            for module in modules:
+                cls._disable_module(module)
+
     @staticmethod
     def _disable_module(module):
         """Disables the specified module in Apache."""
@@ -94,5 +148,8 @@ class DisabledModuleAudit(BaseAudit):
 
     @staticmethod
     def _restart_apache():
-        """Restarts the apache process"""
-        subprocess.check_output(['service', 'apache2', 'restart'])
+        """Schedules a single graceful reload of apache for the end of the
+        hook, unless the charm reloads apache itself before then."""
+        if not _reload['pending']:
+            _reload['pending'] = True
+            atexit(_graceful_reload)
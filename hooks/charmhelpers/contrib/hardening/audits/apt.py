@@ -29,15 +29,20 @@ from charmhelpers.contrib.hardening.audits import BaseAudit
 
 
 class AptConfig(BaseAudit):
+    recursive = True
 
     def __init__(self, config, **kwargs):
         self.config = config
 
+    def resources(self):
+        return ['/etc/apt/apt.conf', '/etc/apt/apt.conf.d']
+
     def verify_config(self):
         apt_pkg.init()
         for cfg in self.config:
             value = apt_pkg.config.get(cfg['key'], cfg.get('default', ''))
             if value and value != cfg['expected']:
+                self.compliant = False
                 log("APT config '%s' has unexpected value '%s' "
                     "(expected='%s')" %
                     (cfg['key'], value, cfg['expected']), level=WARNING)
@@ -56,6 +61,9 @@ class RestrictedPackages(BaseAudit):
         else:
             self.pkgs = pkgs
 
+    def resources(self):
+        return ['/var/lib/dpkg/status']
+
     def ensure_compliance(self):
         cache = apt_cache()
 
@@ -97,6 +105,7 @@ class RestrictedPackages(BaseAudit):
             return
         else:
             log("Purging package '%s'" % pkg.name, level=DEBUG)
+            self.compliant = False
             apt_purge(pkg.name)
 
     def is_virtual_package(self, pkg):
@@ -38,13 +38,20 @@ from charmhelpers.core.hookenv import (
 )
 from charmhelpers.core import unitdata
 from charmhelpers.core.host import file_hash
-from charmhelpers.contrib.hardening.audits import BaseAudit
+from charmhelpers.contrib.hardening.audits import BaseAudit, COMPLY_LOCK
 from charmhelpers.contrib.hardening.templating import (
     get_template_path,
     render_and_write,
 )
 from charmhelpers.contrib.hardening import utils
 
+# Compiled content patterns, and the patterns found in each audited file
+# keyed by (path, size, mtime, patterns), shared by all FileContentAudits.
+# The matches are kept in unitdata between hooks.
+_PATTERNS = {}
+_CONTENT_MATCHES = {}
+CONTENT_MATCHES_KEY = 'hardening:content-matches'
+
 
 class BaseFileAudit(BaseAudit):
     """Base class for file audits.
@@ -83,9 +90,14 @@ class BaseFileAudit(BaseAudit):
                         % (p), level=INFO)
                     continue
 
+            self.compliant = False
             if self._take_action():
                 log("Applying compliance criteria to '%s'" % (p), level=INFO)
-                self.comply(p)
+                with COMPLY_LOCK:
+                    self.comply(p)
+
+    def resources(self):
+        return self.paths
 
     def is_compliant(self, path):
         """Audits the path to see if it is compliance.
@@ -119,6 +131,8 @@ class FilePermissionAudit(BaseFileAudit):
     will own the file(s) specified and that the permissions specified are
     applied properly to the file.
     """
+    parallel_check = True
+
     def __init__(self, paths, user, group=None, mode=0o600, **kwargs):
         self.user = user
         self.group = group
@@ -237,6 +251,9 @@ class DirectoryPermissionAudit(FilePermissionAudit):
 
 class ReadOnly(BaseFileAudit):
     """Audits that files and folders are read only."""
+    recursive = True
+    parallel_check = True
+
     def __init__(self, paths, *args, **kwargs):
         super(ReadOnly, self).__init__(paths=paths, *args, **kwargs)
 
@@ -273,6 +290,9 @@ class NoReadWriteForOther(BaseFileAudit):
     """Ensures that the files found under the base path are readable or
     writable by anyone other than the owner or the group.
     """
+    recursive = True
+    parallel_check = True
+
     def __init__(self, paths):
         super(NoReadWriteForOther, self).__init__(paths)
 
@@ -305,6 +325,8 @@ class NoReadWriteForOther(BaseFileAudit):
 
 class NoSUIDSGIDAudit(BaseFileAudit):
     """Audits that specified files do not have SUID/SGID bits set."""
+    parallel_check = True
+
     def __init__(self, paths, *args, **kwargs):
         super(NoSUIDSGIDAudit, self).__init__(paths=paths, *args, **kwargs)
 
@@ -362,6 +384,10 @@ class TemplatedFile(BaseFileAudit):
 
         return False
 
+    def resources(self):
+        return list(self.paths) + [get_template_path(self.template_dir, p)
+                                   for p in self.paths]
+
     def run_service_actions(self):
         """Run any actions on services requested."""
         if not self.service_actions:
@@ -486,6 +512,8 @@ class TemplatedFile(BaseFileAudit):
 
 class DeletedFile(BaseFileAudit):
     """Audit to ensure that a file is deleted."""
+    parallel_check = True
+
     def __init__(self, paths):
         super(DeletedFile, self).__init__(paths)
 
@@ -498,12 +526,20 @@ class DeletedFile(BaseFileAudit):
 
 class FileContentAudit(BaseFileAudit):
     """Audit the contents of a file."""
+    parallel_check = True
+
     def __init__(self, paths, cases, **kwargs):
         # Cases we expect to pass
         self.pass_cases = cases.get('pass', [])
         # Cases we expect to fail
         self.fail_cases = cases.get('fail', [])
         super(FileContentAudit, self).__init__(paths, **kwargs)
+        # unitdata is only used from the calling thread, the checks may run
+        # in worker threads.
+        _load_content_matches(self.paths)
+
+    def after_run(self):
+        _save_content_matches(self.paths)
 
     def is_compliant(self, path):
         """
@@ -517,23 +553,18 @@ class FileContentAudit(BaseFileAudit):
                   found to be compliant.
         """
         log("Auditing contents of file '%s'" % (path), level=DEBUG)
-        with open(path, 'r') as fd:
-            contents = fd.read()
+        found = _find_patterns(path, self.pass_cases + self.fail_cases)
 
         matches = 0
         for pattern in self.pass_cases:
-            key = re.compile(pattern, flags=re.MULTILINE)
-            results = re.search(key, contents)
-            if results:
+            if pattern in found:
                 matches += 1
             else:
                 log("Pattern '%s' was expected to pass but instead it failed"
                     % (pattern), level=WARNING)
 
         for pattern in self.fail_cases:
-            key = re.compile(pattern, flags=re.MULTILINE)
-            results = re.search(key, contents)
-            if not results:
+            if pattern not in found:
                 matches += 1
             else:
                 log("Pattern '%s' was expected to fail but instead it passed"
@@ -548,3 +579,82 @@ class FileContentAudit(BaseFileAudit):
         NotImplememtedError.
         """
         log("Not applying any compliance criteria, only checks.", level=INFO)
+
+
+def _compile(pattern):
+    """Returns the compiled (multiline) regex for pattern."""
+    if pattern not in _PATTERNS:
+        _PATTERNS[pattern] = re.compile(pattern, flags=re.MULTILINE)
+    return _PATTERNS[pattern]
+
+
+def _load_content_matches(paths):
+    """Loads the matches stored for paths into _CONTENT_MATCHES."""
+    stored = unitdata.kv().get(CONTENT_MATCHES_KEY) or {}
+    for path in paths:
+        entry = stored.get(path)
+        if not entry:
+            continue
+        for patterns, found in entry['matches']:
+            key = (path, entry['size'], entry['mtime'], tuple(patterns))
+            _CONTENT_MATCHES.setdefault(key, set(found))
+
+
+def _save_content_matches(paths):
+    """Stores the matches found for the current state of paths."""
+    db = unitdata.kv()
+    stored = db.get(CONTENT_MATCHES_KEY) or {}
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            stored.pop(path, None)
+            continue
+        matches = [[list(key[3]), sorted(found)]
+                   for key, found in _CONTENT_MATCHES.items()
+                   if key[:3] == (path, st.st_size, st.st_mtime)]
+        if matches:
+            stored[path] = {'size': st.st_size, 'mtime': st.st_mtime,
+                            'matches': sorted(matches)}
+    db.set(CONTENT_MATCHES_KEY, stored)
+
+
+def _find_patterns(path, patterns):
+    """Returns the set of patterns which match the contents of a file.
+
+    The file is read a line at a time and each line is first checked against
+    a single combined pattern, so lines matching none of the patterns are
+    skipped cheaply. Reading stops as soon as every pattern has matched.
+    Cases are matched line by line, so patterns must not span lines.
+
+    :param path: path of the file to scan.
+    :param patterns: list of regular expression strings.
+    :returns: set of the patterns found.
+    """
+    patterns = tuple(sorted(set(patterns)))
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime, patterns)
+    if key in _CONTENT_MATCHES:
+        return _CONTENT_MATCHES[key]
+
+    pending = dict((p, _compile(p)) for p in patterns)
+    try:
+        combined = _compile('|'.join('(?:%s)' % p for p in patterns))
+    except re.error:
+        # e.g. numbered backreferences, which do not survive combining.
+        combined = None
+
+    found = set()
+    with open(path, 'r') as fd:
+        for line in fd:
+            if not pending:
+                break
+            if combined is not None and not combined.search(line):
+                continue
+            for pattern, regex in list(pending.items()):
+                if regex.search(line):
+                    found.add(pattern)
+                    del pending[pattern]
+
+    _CONTENT_MATCHES[key] = found
+    return found
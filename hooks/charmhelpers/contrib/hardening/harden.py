@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import importlib
 import six
 
 from collections import OrderedDict
@@ -22,10 +23,24 @@ from charmhelpers.core.hookenv import (
     DEBUG,
     WARNING,
 )
-from charmhelpers.contrib.hardening.host.checks import run_os_checks
-from charmhelpers.contrib.hardening.ssh.checks import run_ssh_checks
-from charmhelpers.contrib.hardening.mysql.checks import run_mysql_checks
-from charmhelpers.contrib.hardening.apache.checks import run_apache_checks
+from charmhelpers.contrib.hardening.audits import stack_unchanged
+
+# The check modules pull in every audit and template for their stack, so
+# they are only imported once a hook actually enables them.
+RUN_CATALOG = OrderedDict([
+    ('os', ('charmhelpers.contrib.hardening.host.checks', 'run_os_checks')),
+    ('ssh', ('charmhelpers.contrib.hardening.ssh.checks', 'run_ssh_checks')),
+    ('mysql', ('charmhelpers.contrib.hardening.mysql.checks',
+               'run_mysql_checks')),
+    ('apache', ('charmhelpers.contrib.hardening.apache.checks',
+                'run_apache_checks')),
+])
+
+
+def _load_hardener(module):
+    """Import and return the run_*_checks entry point for a stack module."""
+    path, func = RUN_CATALOG[module]
+    return getattr(importlib.import_module(path), func)
 
 
 def harden(overrides=None):
@@ -51,19 +66,17 @@ def harden(overrides=None):
         log("Hardening function '%s'" % (f.__name__), level=DEBUG)
 
         def _harden_inner2(*args, **kwargs):
-            RUN_CATALOG = OrderedDict([('os', run_os_checks),
-                                       ('ssh', run_ssh_checks),
-                                       ('mysql', run_mysql_checks),
-                                       ('apache', run_apache_checks)])
-
             enabled = overrides or (config("harden") or "").split()
             if enabled:
+                enabled = list(enabled)
                 modules_to_run = []
                 # modules will always be performed in the following order
-                for module, func in six.iteritems(RUN_CATALOG):
+                for module in six.iterkeys(RUN_CATALOG):
                     if module in enabled:
                         enabled.remove(module)
-                        modules_to_run.append(func)
+                        if stack_unchanged(module):
+                            continue
+                        modules_to_run.append(_load_hardener(module))
 
                 if enabled:
                     log("Unknown hardening modules '%s' - ignoring" %
@@ -12,15 +12,29 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import subprocess
+import os
+import stat
+import time
 
+from multiprocessing.pool import ThreadPool
+
+from charmhelpers.core import unitdata
 from charmhelpers.core.hookenv import (
     log,
+    DEBUG,
     INFO,
 )
 from charmhelpers.contrib.hardening.audits.file import NoSUIDSGIDAudit
 from charmhelpers.contrib.hardening import utils
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
 
 BLACKLIST = ['/usr/bin/rcp', '/usr/bin/rlogin', '/usr/bin/rsh',
              '/usr/libexec/openssh/ssh-keysign',
@@ -71,6 +85,35 @@ WHITELIST = ['/bin/mount', '/bin/ping', '/bin/su', '/bin/umount',
              '/usr/lib/libvte9/gnome-pty-helper',
              '/usr/lib/libvte-2.90-9/gnome-pty-helper']
 
+# Filesystems which never need to be searched for suid/sgid files, either
+# because they are kernel pseudo filesystems or because they are remote.
+PRUNE_FSTYPES = set([
+    'proc', 'sysfs', 'devtmpfs', 'devpts', 'cgroup', 'cgroup2', 'debugfs',
+    'securityfs', 'pstore', 'tracefs', 'configfs', 'fusectl', 'mqueue',
+    'hugetlbfs', 'binfmt_misc', 'autofs', 'bpf', 'nsfs', 'rpc_pipefs',
+    'efivarfs', 'nfs', 'nfs4', 'cifs', 'smbfs', 'ceph', 'glusterfs',
+    'fuse.glusterfs', 'fuse.sshfs', 'fuse.ceph', 'afs', 'lustre', '9p',
+])
+
+SUID_SGID_INDEX_KEY = 'hardening:suid-sgid-index'
+SUID_SGID_DIR_PREFIX = 'hardening:suid-sgid-dir:'
+# Directory mtimes do not change when the mode of an existing file does, so
+# the whole tree is still rescanned at least this often (seconds).
+FULL_SCAN_INTERVAL = 24 * 60 * 60
+SCAN_THREADS = 4
+
+
+class UnknownSUIDSGIDAudit(NoSUIDSGIDAudit):
+    """NoSUIDSGIDAudit for the unknown suid/sgid files found by a scan.
+
+    New suid/sgid files can appear anywhere, not just in the paths found
+    last time, so the audit names no resources: run_audits() then never
+    skips the stack, and the (incremental) scan runs in every hook.
+    """
+
+    def resources(self):
+        return None
+
 
 def get_audits():
     """Get OS hardening suid/sgid audits.
@@ -110,20 +153,196 @@ def get_audits():
         # bit set and then remove the whitelisted paths.
         root_path = settings['environment']['root_path']
         unknown_paths = find_paths_with_suid_sgid(root_path) - set(whitelist)
-        checks.append(NoSUIDSGIDAudit(unknown_paths, unless=dry_run))
+        checks.append(UnknownSUIDSGIDAudit(unknown_paths, unless=dry_run))
 
     return checks
 
 
+def _pruned_mounts(mounts='/proc/mounts'):
+    """Return the mount points whose filesystems should not be scanned."""
+    pruned = set(['/proc'])
+    try:
+        with open(mounts) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 2 and fields[2] in PRUNE_FSTYPES:
+                    pruned.add(fields[1].replace('\\040', ' '))
+    except IOError:
+        pass
+    return pruned
+
+
+def _is_suid_sgid(mode):
+    return stat.S_ISREG(mode) and mode & (stat.S_ISUID | stat.S_ISGID)
+
+
+def _list_dir(path):
+    """List a directory returning its subdirectories and the stat results
+    of its suid/sgid files, by name."""
+    subdirs = []
+    suid = {}
+    if scandir is not None:
+        try:
+            entries = list(scandir(path))
+        except OSError:
+            return subdirs, suid
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.is_file(follow_symlinks=False):
+                    st = entry.stat(follow_symlinks=False)
+                    if _is_suid_sgid(st.st_mode):
+                        suid[entry.name] = st
+            except OSError:
+                continue
+        return subdirs, suid
+
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return subdirs, suid
+    for name in names:
+        try:
+            st = os.lstat(os.path.join(path, name))
+        except OSError:
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            subdirs.append(name)
+        elif _is_suid_sgid(st.st_mode):
+            suid[name] = st
+    return subdirs, suid
+
+
+def _file_state(st):
+    return [st.st_dev, st.st_ino, st.st_mode]
+
+
+def _known_files_unchanged(path, record):
+    """Whether the suid/sgid files indexed in a directory still have the
+    same device, inode and mode."""
+    for name, state in record['suid'].items():
+        try:
+            st = os.lstat(os.path.join(path, name))
+        except OSError:
+            return False
+        if _file_state(st) != state:
+            return False
+    return True
+
+
+def _scan_dir(path, index):
+    """Return the index record of a directory, or None if it is not one.
+
+    A record holds the directory's device, inode, mode and mtime, its
+    subdirectories and the device, inode and mode of its suid/sgid files.
+    The indexed record is reused, without listing the directory, when the
+    directory and its known suid/sgid files are unchanged.
+    """
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(st.st_mode):
+        return None
+
+    state = _file_state(st) + [st.st_mtime]
+    record = index.get(path)
+    if (record is not None and record['stat'] == state and
+            _known_files_unchanged(path, record)):
+        return record
+
+    subdirs, suid = _list_dir(path)
+    return {'stat': state,
+            'dirs': sorted(subdirs),
+            'suid': dict((name, _file_state(f_st))
+                         for name, f_st in suid.items())}
+
+
+def _scan_tree(top, index, pruned):
+    """Scan the tree rooted at top, reusing unchanged directories from index.
+
+    :returns: dict of {directory: index record}
+    """
+    records = {}
+    stack = [top]
+    while stack:
+        path = stack.pop()
+        if path in pruned:
+            continue
+        record = _scan_dir(path, index)
+        if record is None:
+            continue
+        records[path] = record
+        stack.extend(os.path.join(path, name) for name in record['dirs'])
+    return records
+
+
+def _load_index(root_path):
+    """Return the stored directory records, those of them usable for this
+    scan of root_path, and when the tree was last fully scanned."""
+    db = unitdata.kv()
+    stored = db.getrange(SUID_SGID_DIR_PREFIX, strip=True)
+    saved = db.get(SUID_SGID_INDEX_KEY)
+    if not saved or saved.get('root') != root_path:
+        return stored, {}, time.time()
+    if time.time() - saved['scanned'] > FULL_SCAN_INTERVAL:
+        log("suid/sgid index is stale, rescanning all paths", level=DEBUG)
+        return stored, {}, time.time()
+    return stored, stored, saved['scanned']
+
+
 def find_paths_with_suid_sgid(root_path):
     """Finds all paths/files which have an suid/sgid bit enabled.
 
     Starting with the root_path, this will recursively find all paths which
-    have an suid or sgid bit set.
+    have an suid or sgid bit set.  Pseudo and network filesystems are not
+    searched, top-level directories are scanned in parallel and an index of
+    directory state is kept between runs so that only directories which
+    changed since the last run are listed again.
+
+    The index is stored in unitdata with one key per directory, and only
+    the directories which changed are written back.
     """
-    cmd = ['find', root_path, '-perm', '-4000', '-o', '-perm', '-2000',
-           '-type', 'f', '!', '-path', '/proc/*', '-print']
+    root_path = os.path.normpath(root_path)
+    stored, index, scanned = _load_index(root_path)
+
+    pruned = _pruned_mounts()
+    records = {}
+    subtrees = []
+    root_record = _scan_dir(root_path, index)
+    if root_record and root_path not in pruned:
+        records[root_path] = root_record
+        subtrees = [os.path.join(root_path, name)
+                    for name in root_record['dirs']]
+
+    # Each top-level directory is walked in its own thread; the work is
+    # almost entirely stat() calls which release the GIL.
+    pool = ThreadPool(SCAN_THREADS)
+    try:
+        results = pool.map(lambda top: _scan_tree(top, index, pruned),
+                           subtrees)
+    finally:
+        pool.close()
+        pool.join()
+
+    for tree_records in results:
+        records.update(tree_records)
+
+    found = set()
+    for path, record in records.items():
+        found.update(os.path.join(path, name) for name in record['suid'])
 
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, _ = p.communicate()
-    return set(out.split('\n'))
+    # unitdata is only used from this thread.
+    db = unitdata.kv()
+    changed = [p for p in records if stored.get(p) != records[p]]
+    removed = [p for p in stored if p not in records]
+    for path in changed:
+        db.set(SUID_SGID_DIR_PREFIX + path, records[path])
+    if removed:
+        db.unsetrange(removed, prefix=SUID_SGID_DIR_PREFIX)
+    db.set(SUID_SGID_INDEX_KEY, {'root': root_path, 'scanned': scanned})
+    db.flush()
+    log("suid/sgid scan: %s directories, %s changed since last scan" %
+        (len(records), len(changed) + len(removed)), level=DEBUG)
+    return found
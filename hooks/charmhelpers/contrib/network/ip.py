@@ -12,16 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import bisect
 import glob
 import re
 import subprocess
 import six
 import socket
+import time
 
 from functools import partial
 
 from charmhelpers.fetch import apt_install, apt_update
 from charmhelpers.core.hookenv import (
+    cached,
     config,
     log,
     network_get_primary_address,
@@ -29,6 +32,7 @@ from charmhelpers.core.hookenv import (
     WARNING,
 )
 
+from charmhelpers.core import unitdata
 from charmhelpers.core.host import (
     lsb_release,
     CompareHostReleases,
@@ -54,6 +58,12 @@ except ImportError:
         apt_install('python3-netaddr', fatal=True)
     import netaddr
 
+DNS_CACHE_KEY = 'network:dns:%s:%s'
+# Used for answers without a DNS TTL (resolved through the system resolver).
+DNS_DEFAULT_TTL = 300
+# Upper bound on how long a failed lookup is remembered.
+DNS_NEGATIVE_TTL = 60
+
 
 def _validate_cidr(network):
     try:
@@ -86,6 +96,110 @@ def _get_ipv6_network_from_address(address):
                                         netmask))
 
 
+class AddressTable(object):
+    """Snapshot of the host's interfaces and addresses.
+
+    Enumerating interfaces through netifaces is repeated by most of the
+    helpers in this module, so the table is built once per hook (see
+    address_table()) and indexed by prefix for CIDR lookups.
+    """
+
+    def __init__(self):
+        self.interfaces = netifaces.interfaces()
+        self.ifaddresses = dict((iface, netifaces.ifaddresses(iface))
+                                for iface in self.interfaces)
+        # Every address, sorted by (version, first address of its network),
+        # for looking up the addresses contained in a network.
+        self._networks = []
+        # Bindable networks keyed by (version, prefixlen) and then by the
+        # network address, for looking up the network holding an address.
+        self._prefixes = {}
+        self._ipv6_flags = None
+
+        for order, iface in enumerate(self.interfaces):
+            addresses = self.ifaddresses[iface]
+            for n, addr in enumerate(addresses.get(netifaces.AF_INET, [])):
+                if 'netmask' not in addr:
+                    continue
+                network = netaddr.IPNetwork("%s/%s" % (addr['addr'],
+                                                       addr['netmask']))
+                self._add((order, n), iface, addr, network, bindable=n == 0)
+
+            for n, addr in enumerate(addresses.get(netifaces.AF_INET6, [])):
+                network = _get_ipv6_network_from_address(addr)
+                if network:
+                    self._add((order, n), iface, addr, network)
+
+        self._networks.sort(key=lambda e: e[:2])
+        self._keys = [e[:2] for e in self._networks]
+        self._prefixlens = sorted(self._prefixes, reverse=True)
+
+    def _add(self, order, iface, addr, network, bindable=True):
+        self._networks.append((network.version, network.first, order,
+                               network, iface, addr))
+        if bindable:
+            by_net = self._prefixes.setdefault(
+                (network.version, network.prefixlen), {})
+            by_net.setdefault(network.first, (order, network, iface, addr))
+
+    def address_in_network(self, network):
+        """Returns this host's first address whose subnet lies within
+        network (a netaddr.IPNetwork), or None."""
+        start = bisect.bisect_left(self._keys, (network.version,
+                                                network.first))
+        end = bisect.bisect_right(self._keys, (network.version,
+                                               network.last))
+        found = [e for e in self._networks[start:end]
+                 if e[3].last <= network.last]
+        if not found:
+            return None
+        return str(min(found, key=lambda e: e[2])[3].ip)
+
+    def network_for_address(self, address):
+        """Returns (iface, network, addr) for the first interface address
+        whose network contains address (a netaddr.IPAddress), or None."""
+        found = []
+        bits = 32 if address.version == 4 else 128
+        for version, prefixlen in self._prefixlens:
+            if version != address.version:
+                continue
+            host_bits = bits - prefixlen
+            first = int(address) >> host_bits << host_bits
+            entry = self._prefixes[(version, prefixlen)].get(first)
+            if entry:
+                found.append(entry)
+        if not found:
+            return None
+        _, network, iface, addr = min(found, key=lambda e: e[0])
+        return iface, network, addr
+
+    @property
+    def ipv6_flags(self):
+        """Maps each IPv6 address to its interface and the scope and state
+        flags reported by `ip addr` (global, link, dynamic, temporary,
+        deprecated...)."""
+        if self._ipv6_flags is None:
+            self._ipv6_flags = {}
+            out = subprocess.check_output(['ip', '-o', '-6', 'addr', 'show'])
+            for line in out.decode('UTF-8').split('\n'):
+                m = re.match(r"\d+:\s+(\S+)\s+inet6 (\S+)/[0-9]+ (.*)",
+                             line)
+                if m:
+                    flags = m.group(3).split('\\')[0].split()
+                    self._ipv6_flags[m.group(2)] = (m.group(1), set(flags))
+        return self._ipv6_flags
+
+
+@cached
+def address_table():
+    """Returns the AddressTable for this hook.
+
+    Call hookenv.flush('address_table') after changing addresses on the
+    host to have it rebuilt.
+    """
+    return AddressTable()
+
+
 def get_address_in_network(network, fallback=None, fatal=False):
     """Get an IPv4 or IPv6 address within the network from the host.
 
@@ -107,21 +221,10 @@ def get_address_in_network(network, fallback=None, fatal=False):
     networks = network.split() or [network]
     for network in networks:
         _validate_cidr(network)
-        network = netaddr.IPNetwork(network)
-        for iface in netifaces.interfaces():
-            addresses = netifaces.ifaddresses(iface)
-            if network.version == 4 and netifaces.AF_INET in addresses:
-                for addr in addresses[netifaces.AF_INET]:
-                    cidr = netaddr.IPNetwork("%s/%s" % (addr['addr'],
-                                                        addr['netmask']))
-                    if cidr in network:
-                        return str(cidr.ip)
-
-            if network.version == 6 and netifaces.AF_INET6 in addresses:
-                for addr in addresses[netifaces.AF_INET6]:
-                    cidr = _get_ipv6_network_from_address(addr)
-                    if cidr and cidr in network:
-                        return str(cidr.ip)
+        address = address_table().address_in_network(
+            netaddr.IPNetwork(network))
+        if address:
+            return address
 
     if fallback is not None:
         return fallback
@@ -182,34 +285,16 @@ def _get_for_address(address, key):
     :returns str: Requested attribute or None if address is not bindable.
     """
     address = netaddr.IPAddress(address)
-    for iface in netifaces.interfaces():
-        addresses = netifaces.ifaddresses(iface)
-        if address.version == 4 and netifaces.AF_INET in addresses:
-            addr = addresses[netifaces.AF_INET][0]['addr']
-            netmask = addresses[netifaces.AF_INET][0]['netmask']
-            network = netaddr.IPNetwork("%s/%s" % (addr, netmask))
-            cidr = network.cidr
-            if address in cidr:
-                if key == 'iface':
-                    return iface
-                else:
-                    return addresses[netifaces.AF_INET][0][key]
-
-        if address.version == 6 and netifaces.AF_INET6 in addresses:
-            for addr in addresses[netifaces.AF_INET6]:
-                network = _get_ipv6_network_from_address(addr)
-                if not network:
-                    continue
+    found = address_table().network_for_address(address)
+    if not found:
+        return None
 
-                cidr = network.cidr
-                if address in cidr:
-                    if key == 'iface':
-                        return iface
-                    elif key == 'netmask' and cidr:
-                        return str(cidr).split('/')[1]
-                    else:
-                        return addr[key]
-    return None
+    iface, network, addr = found
+    if key == 'iface':
+        return iface
+    elif key == 'netmask' and network.version == 6:
+        return str(network.prefixlen)
+    return addr[key]
 
 
 get_iface_for_address = partial(_get_for_address, key='iface')
@@ -275,7 +360,8 @@ def get_iface_addr(iface='eth0', inet_type='AF_INET', inc_aliases=False,
     except AttributeError:
         raise Exception("Unknown inet type '%s'" % str(inet_type))
 
-    interfaces = netifaces.interfaces()
+    table = address_table()
+    interfaces = table.interfaces
     if inc_aliases:
         ifaces = []
         for _iface in interfaces:
@@ -298,7 +384,7 @@ def get_iface_addr(iface='eth0', inet_type='AF_INET', inc_aliases=False,
 
     addresses = []
     for netiface in ifaces:
-        net_info = netifaces.ifaddresses(netiface)
+        net_info = table.ifaddresses[netiface]
         if inet_num in net_info:
             for entry in net_info[inet_num]:
                 if 'addr' in entry and entry['addr'] not in exc_list:
@@ -316,8 +402,9 @@ get_ipv4_addr = partial(get_iface_addr, inet_type='AF_INET')
 
 def get_iface_from_addr(addr):
     """Work out on which interface the provided address is configured."""
-    for iface in netifaces.interfaces():
-        addresses = netifaces.ifaddresses(iface)
+    table = address_table()
+    for iface in table.interfaces:
+        addresses = table.ifaddresses[iface]
         for inet_type in addresses:
             for _addr in addresses[inet_type]:
                 _addr = _addr['addr']
@@ -389,24 +476,16 @@ def get_ipv6_addr(iface=None, inc_aliases=False, fatal=True, exc_list=None,
 
         if global_addrs:
             # Make sure any found global addresses are not temporary
-            cmd = ['ip', 'addr', 'show', iface]
-            out = subprocess.check_output(cmd).decode('UTF-8')
-            if dynamic_only:
-                key = re.compile("inet6 (.+)/[0-9]+ scope global.* dynamic.*")
-            else:
-                key = re.compile("inet6 (.+)/[0-9]+ scope global.*")
-
+            flags = address_table().ipv6_flags
             addrs = []
-            for line in out.split('\n'):
-                line = line.strip()
-                m = re.match(key, line)
-                if m and 'temporary' not in line:
-                    # Return the first valid address we find
-                    for addr in global_addrs:
-                        if m.group(1) == addr:
-                            if not dynamic_only or \
-                                    m.group(1).endswith(eui_64_mac):
-                                addrs.append(addr)
+            for addr in global_addrs:
+                _, addr_flags = flags.get(addr, (None, set()))
+                if 'global' not in addr_flags or 'temporary' in addr_flags:
+                    continue
+                if dynamic_only and 'dynamic' not in addr_flags:
+                    continue
+                if not dynamic_only or addr.endswith(eui_64_mac):
+                    addrs.append(addr)
 
             if addrs:
                 return addrs
@@ -451,15 +530,51 @@ def is_ip(address):
         return False
 
 
-def ns_query(address):
+def _dns_cache_get(rtype, name):
+    """Returns (True, answer) for an unexpired cache entry, otherwise
+    (False, None). A cached answer of None records a failed lookup."""
+    entry = unitdata.kv().get(DNS_CACHE_KEY % (rtype, name))
+    if entry and entry['expires'] > time.time():
+        return True, entry['answer']
+    return False, None
+
+
+def _dns_cache_set(rtype, name, answer, ttl):
+    if answer is None:
+        ttl = min(ttl, DNS_NEGATIVE_TTL)
+    unitdata.kv().set(DNS_CACHE_KEY % (rtype, name),
+                      {'answer': answer, 'expires': time.time() + ttl})
+
+
+def _import_dns():
     try:
         import dns.resolver
+        import dns.reversename
     except ImportError:
         if six.PY2:
             apt_install('python-dnspython', fatal=True)
         else:
             apt_install('python3-dnspython', fatal=True)
         import dns.resolver
+        import dns.reversename
+    return dns
+
+
+def _ns_lookup(address, rtype):
+    """Queries DNS without the cache, returning (answer, ttl)."""
+    dns = _import_dns()
+    try:
+        answers = dns.resolver.query(address, rtype)
+    except dns.resolver.NXDOMAIN:
+        return None, DNS_NEGATIVE_TTL
+
+    if answers:
+        return str(answers[0]), answers.rrset.ttl
+    return None, DNS_NEGATIVE_TTL
+
+
+def ns_query(address):
+    dns = _import_dns()
 
     if isinstance(address, dns.name.Name):
         rtype = 'PTR'
@@ -468,58 +583,71 @@ def ns_query(address):
     else:
         return None
 
-    try:
-        answers = dns.resolver.query(address, rtype)
-    except dns.resolver.NXDOMAIN:
-        return None
+    hit, answer = _dns_cache_get(rtype, str(address))
+    if not hit:
+        answer, ttl = _ns_lookup(address, rtype)
+        _dns_cache_set(rtype, str(address), answer, ttl)
+    return answer
 
-    if answers:
-        return str(answers[0])
-    return None
+
+def _lookup_host_ip(hostname):
+    ip_addr, ttl = _ns_lookup(hostname, 'A')
+    if not ip_addr:
+        try:
+            ip_addr, ttl = socket.gethostbyname(hostname), DNS_DEFAULT_TTL
+        except Exception:
+            return None, DNS_NEGATIVE_TTL
+    return ip_addr, ttl
 
 
 def get_host_ip(hostname, fallback=None):
     """
     Resolves the IP for a given hostname, or returns
     the input if it is already an IP.
+
+    Answers are cached in unitdata for their DNS TTL, failures for
+    DNS_NEGATIVE_TTL.
     """
     if is_ip(hostname):
         return hostname
 
-    ip_addr = ns_query(hostname)
+    hit, ip_addr = _dns_cache_get('host', hostname)
+    if not hit:
+        ip_addr, ttl = _lookup_host_ip(hostname)
+        _dns_cache_set('host', hostname, ip_addr, ttl)
+
     if not ip_addr:
-        try:
-            ip_addr = socket.gethostbyname(hostname)
-        except:
-            log("Failed to resolve hostname '%s'" % (hostname),
-                level=WARNING)
-            return fallback
+        log("Failed to resolve hostname '%s'" % (hostname),
+            level=WARNING)
+        return fallback
     return ip_addr
 
 
+def _lookup_hostname(address):
+    dns = _import_dns()
+    rev = dns.reversename.from_address(address)
+    result, ttl = _ns_lookup(rev, 'PTR')
+    if not result:
+        try:
+            result, ttl = socket.gethostbyaddr(address)[0], DNS_DEFAULT_TTL
+        except Exception:
+            return None, DNS_NEGATIVE_TTL
+    return result, ttl
+
+
 def get_hostname(address, fqdn=True):
     """
     Resolves hostname for given IP, or returns the input
     if it is already a hostname.
     """
     if is_ip(address):
-        try:
-            import dns.reversename
-        except ImportError:
-            if six.PY2:
-                apt_install("python-dnspython", fatal=True)
-            else:
-                apt_install("python3-dnspython", fatal=True)
-            import dns.reversename
-
-        rev = dns.reversename.from_address(address)
-        result = ns_query(rev)
+        hit, result = _dns_cache_get('hostname', address)
+        if not hit:
+            result, ttl = _lookup_hostname(address)
+            _dns_cache_set('hostname', address, result, ttl)
 
         if not result:
-            try:
-                result = socket.gethostbyaddr(address)[0]
-            except:
-                return None
+            return None
     else:
         result = address
 
@@ -83,12 +83,12 @@ from charmhelpers.core.host import (
     restart_on_change_helper,
 )
 from charmhelpers.fetch import (
-    apt_cache,
     install_remote,
     import_key as fetch_import_key,
     add_source as fetch_add_source,
     SourceConfigError,
     GPGKeyError,
+    get_installed_version,
     get_upstream_version
 )
 
@@ -420,13 +420,9 @@ def get_os_codename_package(package, fatal=True):
                 # Second item in list is Version
                 return line.split()[1]
 
-    import apt_pkg as apt
-
-    cache = apt_cache()
-
     try:
-        pkg = cache[package]
-    except:
+        installed = get_installed_version(package)
+    except KeyError:
         if not fatal:
             return None
         # the package is unknown to the current apt cache.
@@ -434,15 +430,15 @@ def get_os_codename_package(package, fatal=True):
             'candidate: %s' % package
         error_out(e)
 
-    if not pkg.current_ver:
+    if not installed['version']:
         if not fatal:
             return None
         # package is known, but no version is currently installed.
         e = 'Could not determine version of uninstalled package: %s' % package
         error_out(e)
 
-    vers = apt.upstream_version(pkg.current_ver.ver_str)
-    if 'swift' in pkg.name:
+    vers = installed['upstream']
+    if 'swift' in package:
         # Fully x.y.z match for swift versions
         match = re.match('^(\d+)\.(\d+)\.(\d+)', vers)
     else:
@@ -463,7 +459,7 @@ def get_os_codename_package(package, fatal=True):
     else:
         # < Liberty co-ordinated project versions
         try:
-            if 'swift' in pkg.name:
+            if 'swift' in package:
                 return get_swift_codename(vers)
             else:
                 return OPENSTACK_CODENAMES[vers]
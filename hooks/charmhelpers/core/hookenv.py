@@ -23,6 +23,7 @@ import copy
 from distutils.version import LooseVersion
 from functools import wraps
 import glob
+import hashlib
 import os
 import json
 import yaml
@@ -387,12 +388,47 @@ def relation_get(attribute=None, unit=None, rid=None):
         raise
 
 
+RELATION_SET_KEY = 'hookenv:relation-set:%s'
+RELATION_SET_FILE_KEY = 'hookenv:relation-set-file:%s'
+
+
+def _relation_set_accepts_file():
+    """Whether relation-set supports --file, probed once per Juju version."""
+    from charmhelpers.core import unitdata
+    version = os.environ.get('JUJU_VERSION')
+    if not version:
+        # machine-N links to the versioned tools directory.
+        tools = glob.glob('/var/lib/juju/tools/machine-*')
+        version = os.path.realpath(tools[0]) if tools else None
+
+    db = unitdata.kv()
+    if version:
+        accepts_file = db.get(RELATION_SET_FILE_KEY % version)
+        if accepts_file is not None:
+            return accepts_file
+
+    accepts_file = "--file" in subprocess.check_output(
+        ['relation-set', "--help"], universal_newlines=True)
+    if version:
+        db.set(RELATION_SET_FILE_KEY % version, accepts_file)
+    return accepts_file
+
+
+def _settings_fingerprint(settings):
+    return hashlib.sha256(
+        json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+
 def relation_set(relation_id=None, relation_settings=None, **kwargs):
-    """Set relation information for the current unit"""
+    """Set relation information for the current unit
+
+    The call is skipped if this unit already set the same values for the
+    same keys on the relation. Fingerprints are kept in unitdata, so they
+    only persist when the hook completes.
+    """
+    from charmhelpers.core import unitdata
     relation_settings = relation_settings if relation_settings else {}
     relation_cmd_line = ['relation-set']
-    accepts_file = "--file" in subprocess.check_output(
-        relation_cmd_line + ["--help"], universal_newlines=True)
     if relation_id is not None:
         relation_cmd_line.extend(('-r', relation_id))
     settings = relation_settings.copy()
@@ -402,7 +438,20 @@ def relation_set(relation_id=None, relation_settings=None, **kwargs):
         # sites pass in things like dicts or numbers.
         if value is not None:
             settings[key] = "{}".format(value)
-    if accepts_file:
+
+    rid = relation_id or os.environ.get('JUJU_RELATION_ID')
+    db = unitdata.kv()
+    keyset = json.dumps(sorted(settings))
+    fingerprint = _settings_fingerprint(settings)
+    fingerprints = {}
+    if rid:
+        fingerprints = db.get(RELATION_SET_KEY % rid, {})
+        if fingerprints.get(keyset) == fingerprint:
+            log('Relation settings for %s unchanged, skipping '
+                'relation-set' % rid, level=DEBUG)
+            return
+
+    if _relation_set_accepts_file():
         # --file was introduced in Juju 1.23.2. Use it by default if
         # available, since otherwise we'll break if the relation data is
         # too big. Ideally we should tell relation-set to read the data from
@@ -422,6 +471,22 @@ def relation_set(relation_id=None, relation_settings=None, **kwargs):
     # Flush cache of any relation-gets for local unit
     flush(local_unit())
 
+    if rid:
+        # Earlier fingerprints covering any of these keys are now stale.
+        fingerprints = dict(
+            (k, v) for k, v in fingerprints.items()
+            if not set(json.loads(k)) & set(settings))
+        fingerprints[keyset] = fingerprint
+        db.set(RELATION_SET_KEY % rid, fingerprints)
+
+
+def relation_set_forget(relation_id):
+    """Drops the relation_set fingerprints kept for relation_id, e.g. once
+    the relation is broken."""
+    from charmhelpers.core import unitdata
+    if relation_id:
+        unitdata.kv().unset(RELATION_SET_KEY % relation_id)
+
 
 def relation_clear(r_id=None):
     ''' Clears any relation data already set on relation r_id '''
@@ -764,6 +829,8 @@ class Hooks(object):
         _run_atstart()
         hook_name = os.path.basename(args[0])
         if hook_name in self._hooks:
+            if hook_name.endswith('-relation-broken'):
+                relation_set_forget(relation_id())
             try:
                 self._hooks[hook_name]()
             except SystemExit as x:
@@ -179,6 +179,10 @@ class Storage(object):
         self.cursor = self.conn.cursor()
         self.revision = None
         self._closed = False
+        # Write-back cache, only populated within write_back().  Maps keys
+        # to serialized values, or None for keys known to be absent.
+        self._cache = None
+        self._dirty = set()
         self._init()
 
     def close(self):
@@ -190,13 +194,17 @@ class Storage(object):
         self._closed = True
 
     def get(self, key, default=None, record=False):
-        self.cursor.execute('select data from kv where key=?', [key])
-        result = self.cursor.fetchone()
-        if not result:
+        if self._cache is not None:
+            data = self._cached(key)
+        else:
+            self.cursor.execute('select data from kv where key=?', [key])
+            result = self.cursor.fetchone()
+            data = result[0] if result else None
+        if data is None:
             return default
         if record:
-            return Record(json.loads(result[0]))
-        return json.loads(result[0])
+            return Record(json.loads(data))
+        return json.loads(data)
 
     def getrange(self, key_prefix, strip=False):
         """
@@ -208,6 +216,7 @@ class Storage(object):
             names in the returned dict
         :return dict: A (possibly empty) dict of key-value mappings
         """
+        self._write_pending()
         self.cursor.execute("select key, data from kv where key like ?",
                             ['%s%%' % key_prefix])
         result = self.cursor.fetchall()
@@ -234,6 +243,11 @@ class Storage(object):
         """
         Remove a key from the database entirely.
         """
+        if self._cache is not None:
+            if self._cached(key) is not None:
+                self._cache[key] = None
+                self._dirty.add(key)
+            return
         self.cursor.execute('delete from kv where key=?', [key])
         if self.revision and self.cursor.rowcount:
             self.cursor.execute(
@@ -249,6 +263,16 @@ class Storage(object):
         :param str prefix: Optional prefix to apply to all keys in ``keys``
             before removing.
         """
+        self._write_pending()
+        if self._cache is not None:
+            # Range deletes go straight to the (uncommitted) transaction,
+            # so forget anything we have cached for the affected keys.
+            if keys is not None:
+                for key in keys:
+                    self._cache.pop('%s%s' % (prefix, key), None)
+            else:
+                for key in [k for k in self._cache if k.startswith(prefix)]:
+                    del self._cache[key]
         if keys is not None:
             keys = ['%s%s' % (prefix, key) for key in keys]
             self.cursor.execute('delete from kv where key in (%s)' % ','.join(['?'] * len(keys)), keys)
@@ -273,13 +297,23 @@ class Storage(object):
         """
         serialized = json.dumps(value)
 
+        if self._cache is not None:
+            if self._cached(key) != serialized:
+                self._cache[key] = serialized
+                self._dirty.add(key)
+            return value
+
+        self._store(key, serialized)
+        return value
+
+    def _store(self, key, serialized):
         self.cursor.execute('select data from kv where key=?', [key])
         exists = self.cursor.fetchone()
 
         # Skip mutations to the same value
         if exists:
             if exists[0] == serialized:
-                return value
+                return
 
         if not exists:
             self.cursor.execute(
@@ -293,7 +327,7 @@ class Storage(object):
 
         # Save
         if not self.revision:
-            return value
+            return
 
         self.cursor.execute(
             'select 1 from kv_revisions where key=? and revision=?',
@@ -314,7 +348,30 @@ class Storage(object):
                 and   revision = ?''',
                 [serialized, key, self.revision])
 
-        return value
+    def _cached(self, key):
+        """Return the serialized value for key, loading it into the
+        write-back cache on first access."""
+        if key not in self._cache:
+            self.cursor.execute('select data from kv where key=?', [key])
+            result = self.cursor.fetchone()
+            self._cache[key] = result[0] if result else None
+        return self._cache[key]
+
+    def _write_pending(self):
+        """Push buffered writes into the current (uncommitted) transaction.
+        """
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        cache, self._cache = self._cache, None
+        try:
+            for key in sorted(dirty):
+                if cache[key] is None:
+                    self.unset(key)
+                else:
+                    self._store(key, cache[key])
+        finally:
+            self._cache = cache
 
     def delta(self, mapping, prefix):
         """
@@ -357,6 +414,7 @@ class Storage(object):
         self.revision = self.cursor.lastrowid
         try:
             yield self.revision
+            self._write_pending()
             self.revision = None
         except:
             self.flush(False)
@@ -365,12 +423,55 @@ class Storage(object):
         else:
             self.flush()
 
+    @contextlib.contextmanager
+    def write_back(self):
+        """Serve reads from memory and buffer writes until the scope exits.
+
+        Calls to :meth:`flush` within the scope are deferred, so the store is
+        committed once on successful exit rather than once per caller.  Use
+        :meth:`checkpoint` to force a commit part way through.  On failure
+        the buffered writes are discarded and the transaction rolled back.
+        """
+        if self._cache is not None:
+            # Already buffering, the outermost scope owns the commit.
+            yield self
+            return
+        self._cache = {}
+        self._dirty = set()
+        try:
+            yield self
+        except SystemExit as x:
+            if x.code is None or x.code == 0:
+                self.checkpoint()
+            else:
+                self.flush(False)
+            raise
+        except:
+            self.flush(False)
+            raise
+        else:
+            self.checkpoint()
+        finally:
+            self._cache = None
+            self._dirty = set()
+
+    def checkpoint(self):
+        """Commit any buffered writes now."""
+        self._write_pending()
+        self.conn.commit()
+
     def flush(self, save=True):
         if save:
+            if self._cache is not None:
+                # Deferred until write_back() exits or checkpoint().
+                return
             self.conn.commit()
         elif self._closed:
             return
         else:
+            if self._cache is not None:
+                self._cache.clear()
+                self._dirty = set()
             self.conn.rollback()
 
     def _init(self):
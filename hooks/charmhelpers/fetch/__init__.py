@@ -94,6 +94,8 @@ if __platform__ == "ubuntu":
     apt_cache = fetch.apt_cache
     apt_install = fetch.apt_install
     apt_update = fetch.apt_update
+    apt_update_if_changed = fetch.apt_update_if_changed
+    plan_packages = fetch.plan_packages
     apt_upgrade = fetch.apt_upgrade
     apt_purge = fetch.apt_purge
     apt_mark = fetch.apt_mark
@@ -101,6 +103,7 @@ if __platform__ == "ubuntu":
     apt_unhold = fetch.apt_unhold
     import_key = fetch.import_key
     get_upstream_version = fetch.get_upstream_version
+    get_installed_version = fetch.get_installed_version
 elif __platform__ == "centos":
     yum_search = fetch.yum_search
 
@@ -13,8 +13,13 @@
 # limitations under the License.
 
 from collections import OrderedDict
+import errno
+import fcntl
+import glob
+import hashlib
 import os
 import platform
+import random
 import re
 import six
 import time
@@ -29,6 +34,7 @@ from charmhelpers.core.hookenv import (
     DEBUG,
     WARNING,
 )
+from charmhelpers.core import unitdata
 from charmhelpers.fetch import SourceConfigError, GPGKeyError
 
 PROPOSED_POCKET = (
@@ -161,8 +167,24 @@ CLOUD_ARCHIVE_POCKETS = {
 
 
 APT_NO_LOCK = 100  # The return code for "couldn't acquire lock" in APT.
-CMD_RETRY_DELAY = 10  # Wait 10 seconds between command retries.
+CMD_RETRY_BASE_DELAY = 1  # First retry waits up to 1 second, then doubles.
+CMD_RETRY_DELAY = 10  # Never wait more than 10 seconds between retries.
 CMD_RETRY_COUNT = 3  # Retry a failing fatal command X times.
+DPKG_LOCKS = ('/var/lib/dpkg/lock-frontend', '/var/lib/dpkg/lock')
+DPKG_LOCK_TIMEOUT = 300  # Give up waiting for the dpkg lock after 5 minutes.
+DPKG_LOCK_POLL = 0.5  # Check the dpkg lock every half second.
+
+# Files whose state determines whether 'apt-get update' has anything to do.
+APT_SOURCES = (
+    '/etc/apt/sources.list',
+    '/etc/apt/sources.list.d/*',
+    '/etc/apt/trusted.gpg',
+    '/etc/apt/trusted.gpg.d/*',
+    '/var/lib/apt/lists/*',
+)
+APT_UPDATE_KEY = 'fetch:apt-update-fingerprint'
+DPKG_STATUS = '/var/lib/dpkg/status'
+INSTALLED_VERSIONS_KEY = 'fetch:installed-versions'
 
 
 def filter_installed_packages(packages):
@@ -180,6 +202,37 @@ def filter_installed_packages(packages):
     return _pkgs
 
 
+def plan_packages(packages):
+    """Work out the minimal set of packages apt needs to act on.
+
+    The apt cache is loaded once and each package's installed version is
+    compared against its current candidate.
+
+    :param packages: list of package names
+    :returns: tuple of (missing, upgradable) package name lists
+    """
+    from apt import apt_pkg
+    cache = apt_cache()
+    depcache = apt_pkg.DepCache(cache)
+    missing = []
+    upgradable = []
+    for package in packages:
+        try:
+            p = cache[package]
+        except KeyError:
+            log('Package {} has no installation candidate.'.format(package),
+                level='WARNING')
+            missing.append(package)
+            continue
+        if not p.current_ver:
+            missing.append(package)
+            continue
+        candidate = depcache.get_candidate_ver(p)
+        if candidate and candidate.ver_str != p.current_ver.ver_str:
+            upgradable.append(package)
+    return missing, upgradable
+
+
 def apt_cache(in_memory=True, progress=None):
     """Build and return an apt cache."""
     from apt import apt_pkg
@@ -228,6 +281,37 @@ def apt_update(fatal=False):
     _run_apt_command(cmd, fatal)
 
 
+def _apt_sources_fingerprint():
+    """Return a digest of the apt sources, keys and downloaded indexes."""
+    digest = hashlib.sha256()
+    for pattern in APT_SOURCES:
+        for path in sorted(glob.glob(pattern)):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            digest.update('{}:{}:{}\n'.format(
+                path, st.st_mtime, st.st_size).encode('UTF-8'))
+    return digest.hexdigest()
+
+
+def apt_update_if_changed(fatal=False):
+    """Update the local apt cache only if the sources have changed.
+
+    The state of the sources lists, trusted keys and downloaded indexes is
+    recorded after each successful update; when it still matches, running
+    'apt-get update' again would be a no-op and is skipped.
+    """
+    db = unitdata.kv()
+    if db.get(APT_UPDATE_KEY) == _apt_sources_fingerprint():
+        log('apt sources unchanged since last update, skipping',
+            level=DEBUG)
+        return
+    if _run_apt_command(['apt-get', 'update'], fatal) == 0:
+        db.set(APT_UPDATE_KEY, _apt_sources_fingerprint())
+        db.flush()
+
+
 def apt_purge(packages, fatal=False):
     """Purge one or more packages."""
     cmd = ['apt-get', '--assume-yes', 'purge']
@@ -501,8 +585,60 @@ def _verify_is_ubuntu_rel(release, os_release):
             'version ({})'.format(release, os_release, ubuntu_rel))
 
 
+def _wait_for_dpkg_lock(timeout=DPKG_LOCK_TIMEOUT):
+    """Block until no other process holds the dpkg locks.
+
+    The locks are only probed, not held, so the apt command run afterwards
+    can take them itself.
+
+    :param: timeout: int: Seconds to wait before giving up and letting the
+        command run (and fail) anyway.
+    :returns: float: Seconds spent waiting.
+    """
+    start = time.time()
+    deadline = start + timeout
+    for path in DPKG_LOCKS:
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except OSError:
+            # No lock file, or not privileged enough to take it.
+            continue
+        try:
+            while True:
+                try:
+                    fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError as e:
+                    if e.errno not in (errno.EACCES, errno.EAGAIN):
+                        raise
+                    if time.time() >= deadline:
+                        log('Timed out waiting for {}'.format(path),
+                            level=WARNING)
+                        break
+                    time.sleep(DPKG_LOCK_POLL)
+                else:
+                    fcntl.lockf(fd, fcntl.LOCK_UN)
+                    break
+        finally:
+            os.close(fd)
+    waited = time.time() - start
+    if waited >= DPKG_LOCK_POLL:
+        log('Waited {:.1f} seconds for the dpkg lock'.format(waited))
+    return waited
+
+
+def _retry_delay(retry_count):
+    """Return a jittered, exponentially increasing retry delay in seconds.
+
+    :param: retry_count: int: The number of the retry about to happen,
+        starting at 1.
+    """
+    delay = min(CMD_RETRY_DELAY,
+                CMD_RETRY_BASE_DELAY * 2 ** (retry_count - 1))
+    return random.uniform(delay / 2.0, delay)
+
+
 def _run_with_retries(cmd, max_retries=CMD_RETRY_COUNT, retry_exitcodes=(1,),
-                      retry_message="", cmd_env=None):
+                      retry_message="", cmd_env=None, wait_for_lock=False):
     """Run a command and retry until success or max_retries is reached.
 
     :param: cmd: str: The apt command to run.
@@ -512,6 +648,9 @@ def _run_with_retries(cmd, max_retries=CMD_RETRY_COUNT, retry_exitcodes=(1,),
         Defaults to retry on exit code 1.
     :param: retry_message: str: Optional log prefix emitted during retries.
     :param: cmd_env: dict: Environment variables to add to the command run.
+    :param: wait_for_lock: bool: Block on the dpkg lock before each attempt
+        and retry APT_NO_LOCK failures as soon as the lock is free. All the
+        attempts share one DPKG_LOCK_TIMEOUT.
     """
 
     env = None
@@ -523,13 +662,15 @@ def _run_with_retries(cmd, max_retries=CMD_RETRY_COUNT, retry_exitcodes=(1,),
 
     if not retry_message:
         retry_message = "Failed executing '{}'".format(" ".join(cmd))
-    retry_message += ". Will retry in {} seconds".format(CMD_RETRY_DELAY)
 
     retry_count = 0
     result = None
 
     retry_results = (None,) + retry_exitcodes
+    lock_deadline = time.time() + DPKG_LOCK_TIMEOUT
     while result in retry_results:
+        if wait_for_lock:
+            _wait_for_dpkg_lock(max(0, lock_deadline - time.time()))
         try:
             # result = subprocess.check_call(cmd, env=env)
             result = subprocess.check_call(cmd, **kwargs)
@@ -538,8 +679,14 @@ def _run_with_retries(cmd, max_retries=CMD_RETRY_COUNT, retry_exitcodes=(1,),
             if retry_count > max_retries:
                 raise
             result = e.returncode
-            log(retry_message)
-            time.sleep(CMD_RETRY_DELAY)
+            if wait_for_lock and result == APT_NO_LOCK:
+                # Lost the race for the lock, go straight back to waiting.
+                log(retry_message)
+                continue
+            delay = _retry_delay(retry_count)
+            log("{}. Will retry in {:.1f} seconds".format(retry_message,
+                                                          delay))
+            time.sleep(delay)
 
 
 def _run_apt_command(cmd, fatal=False):
@@ -548,6 +695,7 @@ def _run_apt_command(cmd, fatal=False):
     :param: cmd: str: The apt command to run.
     :param: fatal: bool: Whether the command's output should be checked and
         retried.
+    :returns: int: the command's exit code
     """
     # Provide DEBIAN_FRONTEND=noninteractive if not present in the environment.
     cmd_env = {
@@ -556,11 +704,63 @@ def _run_apt_command(cmd, fatal=False):
     if fatal:
         _run_with_retries(
             cmd, cmd_env=cmd_env, retry_exitcodes=(1, APT_NO_LOCK,),
-            retry_message="Couldn't acquire DPKG lock")
+            retry_message="Couldn't acquire DPKG lock", wait_for_lock=True)
+        return 0
     else:
         env = os.environ.copy()
         env.update(cmd_env)
-        subprocess.call(cmd, env=env)
+        _wait_for_dpkg_lock()
+        return subprocess.call(cmd, env=env)
+
+
+def _dpkg_state():
+    """Return the (mtime, size) of the dpkg status database."""
+    try:
+        st = os.stat(DPKG_STATUS)
+    except OSError:
+        return None
+    return [st.st_mtime, st.st_size]
+
+
+def get_installed_version(package):
+    """Return the installed version of a package.
+
+    Versions are cached in unitdata for as long as the dpkg status database
+    is unchanged, so the apt cache is only loaded after packages have been
+    installed, upgraded or removed.
+
+    :param package: str: name of the package
+    :returns: dict: with 'version' and 'upstream' keys, which are None if
+        the package is known to apt but not installed
+    :raises KeyError: if the package is unknown to the apt cache
+    """
+    db = unitdata.kv()
+    state = _dpkg_state()
+    cached = db.get(INSTALLED_VERSIONS_KEY) or {}
+    if cached.get('dpkg-state') != state:
+        cached = {'dpkg-state': state, 'packages': {}}
+    packages = cached['packages']
+    if package not in packages:
+        import apt_pkg
+        cache = apt_cache()
+        try:
+            pkg = cache[package]
+        except KeyError:
+            packages[package] = None
+        else:
+            if pkg.current_ver:
+                version = pkg.current_ver.ver_str
+                packages[package] = {
+                    'version': version,
+                    'upstream': apt_pkg.upstream_version(version),
+                }
+            else:
+                packages[package] = {'version': None, 'upstream': None}
+        db.set(INSTALLED_VERSIONS_KEY, cached)
+        db.flush()
+    if packages[package] is None:
+        raise KeyError(package)
+    return packages[package]
 
 
 def get_upstream_version(package):
@@ -568,16 +768,8 @@ def get_upstream_version(package):
 
     @returns None (if not installed) or the upstream version
     """
-    import apt_pkg
-    cache = apt_cache()
     try:
-        pkg = cache[package]
-    except:
+        return get_installed_version(package)['upstream']
+    except KeyError:
         # the package is unknown to the current apt cache.
         return None
-
-    if not pkg.current_ver:
-        # package is known, but no version is currently installed.
-        return None
-
-    return apt_pkg.upstream_version(pkg.current_ver.ver_str)
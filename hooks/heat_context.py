@@ -12,21 +12,81 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import multiprocessing
 import os
+import re
+import subprocess
 
 from charmhelpers.contrib.openstack import context
-from charmhelpers.core.hookenv import config, leader_get
-from charmhelpers.core.host import pwgen
+from charmhelpers.core.hookenv import (
+    cached,
+    config,
+    leader_get,
+    log,
+    ERROR,
+    related_units,
+    relation_get,
+    relation_ids,
+)
+from charmhelpers.core.host import get_total_ram, pwgen
 from charmhelpers.contrib.hahelpers.cluster import (
     determine_apache_port,
     determine_api_port,
+    https,
 )
+from charmhelpers.contrib.network.ip import get_relation_ip, is_ipv6
+from charmhelpers.fetch import get_upstream_version
 
 HEAT_PATH = '/var/lib/heat/'
 API_PORTS = {
     'heat-api-cfn': 8000,
     'heat-api': 8004
 }
+# Global maxconn of the charmhelpers haproxy.cfg template.
+HAPROXY_MAXCONN = 20000
+
+
+APACHE_MODS_AVAILABLE = '/etc/apache2/mods-available'
+APACHE_MODS_ENABLED = '/etc/apache2/mods-enabled'
+APACHE_SSL_MODULES = ['ssl', 'proxy', 'proxy_http', 'headers',
+                      'socache_shmcb']
+# MPM sizing: apache's own default ThreadsPerChild and MaxRequestWorkers,
+# and the requests apache keeps in flight per core and per API worker.
+APACHE_THREADS_PER_CHILD = 25
+APACHE_MIN_REQUEST_WORKERS = 150
+APACHE_REQUESTS_PER_CORE = 25
+APACHE_REQUESTS_PER_API_WORKER = 25
+APACHE_KEEPALIVE_TIMEOUT = 10
+APACHE_MAX_KEEPALIVE_REQUESTS = 1000
+# Idle backend connections are dropped before the API side closes them
+# (heat's client_socket_timeout defaults to 900s), so apache never reuses
+# a connection the API already closed.
+APACHE_PROXY_TTL = 60
+SSL_SESSION_CACHE_SIZE = 1024000
+SSL_SESSION_CACHE_TIMEOUT = 600
+# memcached sizing: memory is 1/64th of the unit's RAM within these bounds
+# (in MB, 64 being memcached's default), threads track the API workers.
+MEMCACHED_RAM_DIVISOR = 64
+MEMCACHED_MIN_MEMORY = 64
+MEMCACHED_MAX_MEMORY = 1024
+MEMCACHED_MIN_CONNECTIONS = 1024
+MEMCACHED_MIN_THREADS = 4
+MEMCACHED_MAX_THREADS = 16
+# Connections each API worker keeps to each memcached server
+# (keystonemiddleware's default memcache_pool_maxsize).
+MEMCACHE_POOL_MAXSIZE = 10
+
+# With service-cpu-affinity=auto, units with at least this many cores give
+# 1/SERVICE_API_CPU_SHARE of them to the APIs, which mostly hand requests
+# to heat-engine over RPC, and the rest to heat-engine.
+SERVICE_MIN_CPUS_FOR_SPLIT = 4
+SERVICE_API_CPU_SHARE = 4
+SERVICE_CPU_AFFINITY_RE = re.compile(r'^(api|engine)=([0-9][0-9,-]*)$')
+# MemoryHigh throttles and reclaims at this share of MemoryMax.
+SERVICE_MEMORY_HIGH_PERCENT = 90
+# First systemd release with the cgroup-v2 MemoryHigh= and MemoryMax=
+# directives. Older ones, such as 229 on xenial, only know MemoryLimit=.
+SYSTEMD_MEMORY_MAX_VERSION = '231'
 
 
 def generate_ec2_tokens(protocol, host, port):
@@ -108,11 +168,89 @@ class HeatHAProxyContext(context.OSContextGenerator):
         return ctxt
 
 
+def apache_supports_http2():
+    """Whether the installed apache2 ships mod_http2.
+
+    The package version is no guide: xenial's 2.4.18 does not ship it.
+    """
+    return os.path.exists(os.path.join(APACHE_MODS_AVAILABLE, 'http2.load'))
+
+
+def systemd_supports_memory_max():
+    """Whether the installed systemd understands MemoryHigh= and
+    MemoryMax=."""
+    version = get_upstream_version('systemd')
+    if not version:
+        return False
+    import apt_pkg
+    return apt_pkg.version_compare(version, SYSTEMD_MEMORY_MAX_VERSION) >= 0
+
+
 class HeatApacheSSLContext(context.ApacheSSLContext):
 
     external_ports = API_PORTS.values()
     service_namespace = 'heat'
 
+    def enable_modules(self):
+        """Enables the modules used by the https frontend.
+
+        Only the modules not enabled yet are passed to a2enmod, so hooks
+        where nothing changes do not run it.
+        """
+        modules = list(APACHE_SSL_MODULES)
+        if apache_supports_http2():
+            modules.append('http2')
+        missing = [m for m in modules
+                   if not os.path.exists(os.path.join(APACHE_MODS_ENABLED,
+                                                      '%s.load' % m))]
+        if missing:
+            subprocess.check_call(['a2enmod'] + missing)
+
+
+class HeatApacheTuningContext(context.OSContextGenerator):
+    """Performance settings for the apache https frontend.
+
+    MPM threads are sized from the unit's cores and the number of API
+    workers apache proxies to. Client keep-alive and a shared TLS session
+    cache avoid a full TLS handshake per request from polling clients. Idle
+    backend connections are kept for reuse.
+    """
+
+    def __call__(self):
+        if not https():
+            return {}
+        cores = multiprocessing.cpu_count()
+        api_workers = api_worker_count() * len(API_PORTS)
+        threads = APACHE_THREADS_PER_CHILD
+        max_workers = config('apache-max-request-workers') or max(
+            APACHE_MIN_REQUEST_WORKERS,
+            cores * APACHE_REQUESTS_PER_CORE,
+            api_workers * APACHE_REQUESTS_PER_API_WORKER)
+        # MaxRequestWorkers must be a multiple of ThreadsPerChild.
+        server_limit = -(-int(max_workers) // threads)
+        return {
+            'mpm_server_limit': server_limit,
+            'mpm_threads_per_child': threads,
+            'mpm_max_request_workers': server_limit * threads,
+            'mpm_min_spare_threads': threads,
+            'mpm_max_spare_threads': max(3, server_limit // 4) * threads,
+            'keepalive_timeout': APACHE_KEEPALIVE_TIMEOUT,
+            'keepalive_max_requests': APACHE_MAX_KEEPALIVE_REQUESTS,
+            'ssl_session_cache_size': SSL_SESSION_CACHE_SIZE,
+            'ssl_session_cache_timeout': SSL_SESSION_CACHE_TIMEOUT,
+            'ssl_stapling': bool(config('ssl-ocsp-stapling')),
+            'proxy_pool_max': threads,
+            'proxy_pool_ttl': APACHE_PROXY_TTL,
+            'http2': apache_supports_http2(),
+        }
+
+
+class HeatRoleContext(context.OSContextGenerator):
+    """Whether the unit runs heat-engine, as selected by the role option."""
+
+    def __call__(self):
+        return {'engine_role': config('role') != 'api'}
+
 
 class InstanceUserContext(context.OSContextGenerator):
 
@@ -124,3 +262,128 @@ class InstanceUserContext(context.OSContextGenerator):
             instance_user = config('instance-user')
         ctxt['instance_user'] = instance_user
         return ctxt
+
+
+@cached
+def api_worker_count():
+    """Returns the workers each API service runs, computed once per hook."""
+    return context.WorkerConfigContext()()['workers']
+
+
+def memcache_server_url(address, port):
+    """Formats a memcached server the way python-memcached expects it."""
+    if is_ipv6(address):
+        return 'inet6:[{}]:{}'.format(address, port)
+    return '{}:{}'.format(address, port)
+
+
+class HeatMemcacheContext(context.MemcacheContext):
+    """Memcache context sized for this unit, optionally pooled with peers.
+
+    memcached memory is derived from the unit's RAM, and its connection
+    limit and threads from the API workers using it. With
+    memcache-peer-pool, memcached listens on the cluster address. Every
+    unit then lists the memcached servers of all peers, sorted the same
+    way everywhere, so a token validated on one unit is cached on the same
+    server for all of them.
+    """
+
+    def __call__(self):
+        ctxt = super(HeatMemcacheContext, self).__call__()
+        if not ctxt.get('use_memcache'):
+            return ctxt
+
+        addresses = []
+        if config('memcache-peer-pool'):
+            local = get_relation_ip('cluster')
+            addresses.append(local)
+            for rid in relation_ids('cluster'):
+                for unit in related_units(rid):
+                    address = relation_get('private-address', rid=rid,
+                                           unit=unit)
+                    if address and address not in addresses:
+                        addresses.append(address)
+            ctxt['memcache_server'] = local
+            ctxt['memcache_url'] = ','.join(
+                memcache_server_url(address, ctxt['memcache_port'])
+                for address in sorted(addresses))
+            ctxt['memcache_peer_pool'] = True
+
+        # Every API worker of every unit in the pool keeps its own client
+        # pool; twice that leaves room for workers replaced on restart.
+        workers = api_worker_count()
+        clients = workers * len(API_PORTS) * max(1, len(addresses))
+        memory = get_total_ram() // (1024 * 1024) // MEMCACHED_RAM_DIVISOR
+        ctxt.update({
+            'memcache_memory': min(MEMCACHED_MAX_MEMORY,
+                                   max(MEMCACHED_MIN_MEMORY, memory)),
+            'memcache_connections': max(MEMCACHED_MIN_CONNECTIONS,
+                                        2 * clients * MEMCACHE_POOL_MAXSIZE),
+            'memcache_threads': min(MEMCACHED_MAX_THREADS,
+                                    max(MEMCACHED_MIN_THREADS, workers // 2)),
+            'memcache_pool_maxsize': MEMCACHE_POOL_MAXSIZE,
+        })
+        return ctxt
+
+
+def cpu_range(first, last):
+    """Formats a range of CPUs the way systemd's CPUAffinity expects it."""
+    return str(first) if first == last else '%d-%d' % (first, last)
+
+
+def service_cpu_affinity():
+    """Returns the CPUs the heat APIs and heat-engine are pinned to.
+
+    :returns: dict mapping 'api' and 'engine' to a CPU list, empty when the
+              services are not pinned
+    """
+    setting = (config('service-cpu-affinity') or '').strip()
+    if not setting:
+        return {}
+    if setting == 'auto':
+        cores = multiprocessing.cpu_count()
+        if cores < SERVICE_MIN_CPUS_FOR_SPLIT:
+            return {}
+        api = cores // SERVICE_API_CPU_SHARE
+        return {'api': cpu_range(0, api - 1),
+                'engine': cpu_range(api, cores - 1)}
+    affinity = {}
+    for item in setting.split():
+        match = SERVICE_CPU_AFFINITY_RE.match(item)
+        if not match:
+            log('Invalid service-cpu-affinity, services are not pinned: '
+                '{}'.format(setting), level=ERROR)
+            return {}
+        affinity[match.group(1)] = match.group(2)
+    return affinity
+
+
+class HeatServiceOverridesContext(context.OSContextGenerator):
+    """Resource limits for one heat service.
+
+    Rendered as a systemd drop-in, or as an upstart override on trusty,
+    which only supports the file limit and nice level. systemd releases
+    without MemoryMax= get a MemoryLimit= of the same size and no
+    MemoryHigh=.
+    """
+
+    def __init__(self, service):
+        self.service = service
+
+    def __call__(self):
+        role = 'engine' if self.service == 'heat-engine' else 'api'
+        ctxt = {
+            'service': self.service,
+            'nofile': config('service-nofile-limit'),
+            'tasks_max': config('service-tasks-max'),
+            'cpu_affinity': service_cpu_affinity().get(role),
+            'nice': config('heat-engine-nice') if role == 'engine' else 0,
+        }
+        percent = config('service-memory-max')
+        if percent:
+            memory_max = get_total_ram() * percent // 100
+            ctxt['memory_max'] = memory_max
+            if systemd_supports_memory_max():
+                ctxt['memory_high'] = (
+                    memory_max * SERVICE_MEMORY_HIGH_PERCENT // 100)
+        return ctxt
@@ -0,0 +1,77 @@
+#
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Import timing for the hooks.
+
+Imported by heat_relations before anything else, so it must only use the
+standard library.
+"""
+
+import sys
+import time
+
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+
+class ImportTimer(object):
+    """Records how long each module imported while active took to load.
+
+    Only imports made directly by the timed code are recorded, each with
+    the time spent loading the modules it imports in turn. Modules which
+    were already loaded are not recorded.
+    """
+
+    def __init__(self):
+        self.times = {}
+        self._depth = 0
+        self._import = None
+
+    def start(self):
+        if self._import is None:
+            self._import = builtins.__import__
+            builtins.__import__ = self._timed_import
+
+    def stop(self):
+        if self._import is not None:
+            builtins.__import__ = self._import
+            self._import = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _timed_import(self, name, *args, **kwargs):
+        _import = self._import or builtins.__import__
+        if self._depth or name in sys.modules:
+            return _import(name, *args, **kwargs)
+        self._depth += 1
+        started = time.time()
+        try:
+            return _import(name, *args, **kwargs)
+        finally:
+            self._depth -= 1
+            self.times[name] = self.times.get(name, 0) + (time.time() -
+                                                          started)
+
+    def total(self):
+        """Returns the time spent in all recorded imports."""
+        return sum(self.times.values())
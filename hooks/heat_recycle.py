@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Recycles heat-engine when its processes grow too large or too old.
+
+Run hourly from the cron job rendered by
+heat_utils.configure_engine_recycling(), outside of any hook, so it only
+uses the unit's kv store and the init system. Each restart is recorded in
+the kv store with the engine RSS before and after it, for the
+engine-recycles action.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from charmhelpers.core.hookenv import charm_dir
+from charmhelpers.core.host import service_restart, service_running
+from charmhelpers.core.unitdata import kv
+
+ENGINE = 'heat-engine'
+RECYCLES_KEY = 'heat:engine-recycles'
+# Start of the current recycling interval.
+RECYCLED_AT_KEY = 'heat:engine-recycled-at'
+MAX_RECYCLES = 20
+# Seconds heat-engine is given to start its workers before its RSS is
+# measured again.
+SETTLE_TIME = 60
+# Holds the end of the leader's current database migration window, written
+# by heat_utils.record_migration_state(). It is a file rather than a kv key
+# so that it is seen while the hook running the migration is still going.
+MIGRATION_UNTIL_FILE = '.heat-db-migration-until'
+
+
+def engine_rss(proc='/proc'):
+    """Returns the RSS (in MB) of each heat-engine process, by pid."""
+    rss = {}
+    for pid in os.listdir(proc):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(os.path.join(proc, pid, 'cmdline')) as f:
+                cmdline = f.read().split('\0')
+            # The interpreter, then the heat-engine script.
+            if ENGINE not in [os.path.basename(a) for a in cmdline[:2]]:
+                continue
+            with open(os.path.join(proc, pid, 'status')) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        rss[int(pid)] = int(line.split()[1]) // 1024
+        except (IOError, OSError, ValueError, IndexError):
+            # The process exited while it was being read.
+            continue
+    return rss
+
+
+def recycle_reason(rss, rss_limit, interval, recycled_at, now):
+    """Returns why heat-engine should be recycled now, or None.
+
+    :param rss: RSS (in MB) of each heat-engine process, by pid
+    :param rss_limit: RSS (in MB) above which a process is recycled, 0 for
+                      no limit
+    :param interval: hours after which heat-engine is recycled, 0 for never
+    :param recycled_at: time of the last recycle
+    :param now: current time
+    """
+    if rss_limit and rss and max(rss.values()) > rss_limit:
+        return 'rss'
+    if interval and now - recycled_at >= interval * 3600:
+        return 'schedule'
+    return None
+
+
+def migration_until_path():
+    return os.path.join(charm_dir() or '', MIGRATION_UNTIL_FILE)
+
+
+def migration_until():
+    """Returns the end of the current database migration window, 0 if no
+    migration is running."""
+    try:
+        with open(migration_until_path()) as f:
+            return float(f.read())
+    except (IOError, ValueError):
+        return 0
+
+
+def held_reason(now):
+    """Returns why heat-engine must not be restarted now, or None."""
+    # Stopped by the operator, or by a role which runs no engine; a
+    # restart would start it again.
+    if not service_running(ENGINE):
+        return 'heat-engine is not running'
+    if now < migration_until():
+        return 'database migration in progress'
+    return None
+
+
+def recycle(rss_limit, interval, now=None):
+    """Restarts heat-engine if it is due and records the restart.
+
+    Nothing is done while heat-engine is stopped or the heat database is
+    being migrated.
+
+    :returns: the recorded event, or None if heat-engine was not restarted
+    """
+    now = now or time.time()
+    db = kv()
+    held = held_reason(now)
+    if held:
+        print('Not recycling heat-engine: {}'.format(held))
+        return None
+    recycled_at = db.get(RECYCLED_AT_KEY)
+    if recycled_at is None:
+        # First run, the interval starts now.
+        db.set(RECYCLED_AT_KEY, now)
+        db.flush()
+        recycled_at = now
+    rss = engine_rss()
+    reason = recycle_reason(rss, rss_limit, interval, recycled_at, now)
+    if not reason:
+        return None
+
+    service_restart(ENGINE)
+    time.sleep(SETTLE_TIME)
+    event = {
+        'time': now,
+        'reason': reason,
+        'rss_before': sum(rss.values()),
+        'max_rss_before': max(rss.values()) if rss else 0,
+        'rss_after': sum(engine_rss().values()),
+    }
+    recycles = db.get(RECYCLES_KEY, []) + [event]
+    db.set(RECYCLES_KEY, recycles[-MAX_RECYCLES:])
+    db.set(RECYCLED_AT_KEY, now)
+    db.flush()
+    return event
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rss-limit', type=int, default=0,
+                        help='RSS (in MB) above which a heat-engine process '
+                             'is recycled')
+    parser.add_argument('--interval', type=int, default=0,
+                        help='hours after which heat-engine is recycled')
+    args = parser.parse_args(argv)
+    event = recycle(args.rss_limit, args.interval)
+    if event:
+        print('Recycled heat-engine ({reason}): {rss_before}MB before, '
+              '{rss_after}MB after'.format(**event))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
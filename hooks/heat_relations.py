@@ -14,6 +14,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
+_IMPORT_STARTED = time.time()
+
+from heat_profile import ImportTimer
+
+# Times each module loaded at import and by the hooks, for the hook profile.
+IMPORTS = ImportTimer()
+IMPORTS.start()
+
 import os
 import shutil
 import subprocess
@@ -21,6 +30,7 @@ import sys
 
 from charmhelpers.core.hookenv import (
     Hooks,
+    hook_name,
     UnregisteredHookError,
     config,
     charm_dir,
@@ -35,29 +45,23 @@ from charmhelpers.core.hookenv import (
     leader_get,
     leader_set,
     is_leader,
+    DEBUG,
     WARNING,
 )
 
+from charmhelpers.core.unitdata import kv
+
 from charmhelpers.core.host import (
     restart_on_change,
     service_reload,
     pwgen,
 )
 
-from charmhelpers.fetch import (
-    apt_install,
-    apt_update
-)
-
 from charmhelpers.contrib.hahelpers.cluster import (
     is_elected_leader,
-    get_hacluster_config,
 )
 
 from charmhelpers.contrib.network.ip import (
-    get_iface_for_address,
-    get_netmask_for_address,
-    is_ipv6,
     get_relation_ip,
 )
 
@@ -69,26 +73,26 @@ from charmhelpers.contrib.openstack.utils import (
     os_application_version_set,
 )
 
-from charmhelpers.contrib.openstack.ha.utils import (
-    update_dns_ha_resource_params,
-)
-
-from charmhelpers.contrib.openstack.ip import (
-    canonical_url,
-    ADMIN,
-    INTERNAL,
-    PUBLIC,
-)
-
 from heat_utils import (
+    assess_charm_status,
+    configure_role,
     do_openstack_upgrade,
     restart_map,
-    determine_packages,
+    install_packages,
     migrate_database,
     register_configs,
+    record_migration_state,
+    restart_deferred_services,
+    restart_functions,
+    role,
+    serves_api,
     CLUSTER_RES,
     HEAT_CONF,
+    configure_engine_recycling,
+    configure_service_overrides,
+    configure_sysctl,
     REQUIRED_INTERFACES,
+    ROLE_KEY,
     setup_ipv6,
     VERSION_PACKAGE,
 )
@@ -98,22 +102,36 @@ from heat_context import (
 )
 
 from charmhelpers.contrib.openstack.context import ADDRESS_TYPES
-from charmhelpers.payload.execd import execd_preinstall
 from charmhelpers.contrib.hardening.harden import harden
 
 hooks = Hooks()
-CONFIGS = register_configs()
+# Built by get_configs() on first use.
+CONFIGS = None
+
+IMPORTS.stop()
+IMPORT_TIME = time.time() - _IMPORT_STARTED
+HOOK_PROFILE_KEY = 'heat:hook-profile'
+
+
+def get_configs():
+    """Returns the config renderer, registering the configs on first use."""
+    global CONFIGS
+    if CONFIGS is None:
+        CONFIGS = register_configs()
+    return CONFIGS
 
 
 @hooks.hook('install.real')
 @harden()
 def install():
+    from charmhelpers.payload.execd import execd_preinstall
+
     status_set('maintenance', 'Executing pre-install')
     execd_preinstall()
     configure_installation_source(config('openstack-origin'))
     status_set('maintenance', 'Installing apt packages')
-    apt_update()
-    apt_install(determine_packages(), fatal=True)
+    install_packages()
+    kv().set(ROLE_KEY, role())
 
     _files = os.path.join(charm_dir(), 'files')
     if os.path.isdir(_files):
@@ -122,18 +140,21 @@ def install():
             log('Installing %s to /usr/bin' % f)
             shutil.copy2(f, '/usr/bin')
 
-    for port in API_PORTS.values():
-        open_port(port)
+    if serves_api():
+        for port in API_PORTS.values():
+            open_port(port)
 
 
 @hooks.hook('config-changed')
-@restart_on_change(restart_map())
+@restart_on_change(restart_map(), restart_functions=restart_functions())
 @harden()
 def config_changed():
     if not config('action-managed-upgrade'):
         if openstack_upgrade_available('heat-common'):
             status_set('maintenance', 'Running openstack upgrade')
-            do_openstack_upgrade(CONFIGS)
+            do_openstack_upgrade(get_configs())
+
+    configure_role()
 
     if config('prefer-ipv6'):
         status_set('maintenance', 'configuring ipv6')
@@ -142,14 +163,19 @@ def config_changed():
                                           config('database-user'),
                                           relation_prefix='heat')
 
-    CONFIGS.write_all()
+    get_configs().write_all()
     configure_https()
+    configure_service_overrides()
+    configure_sysctl()
+    configure_engine_recycling()
 
     for rid in relation_ids('cluster'):
         cluster_joined(relation_id=rid)
     for r_id in relation_ids('ha'):
         ha_joined(relation_id=r_id)
 
+    restart_deferred_services()
+
 
 @hooks.hook('upgrade-charm')
 @harden()
@@ -164,12 +190,12 @@ def amqp_joined(relation_id=None):
 
 
 @hooks.hook('amqp-relation-changed')
-@restart_on_change(restart_map())
+@restart_on_change(restart_map(), restart_functions=restart_functions())
 def amqp_changed():
-    if 'amqp' not in CONFIGS.complete_contexts():
+    if 'amqp' not in get_configs().complete_contexts():
         log('amqp relation incomplete. Peer not ready?')
         return
-    CONFIGS.write(HEAT_CONF)
+    get_configs().write(HEAT_CONF)
 
 
 @hooks.hook('shared-db-relation-joined')
@@ -194,12 +220,12 @@ def db_joined():
 
 
 @hooks.hook('shared-db-relation-changed')
-@restart_on_change(restart_map())
+@restart_on_change(restart_map(), restart_functions=restart_functions())
 def db_changed():
-    if 'shared-db' not in CONFIGS.complete_contexts():
+    if 'shared-db' not in get_configs().complete_contexts():
         log('shared-db relation incomplete. Peer not ready?')
         return
-    CONFIGS.write(HEAT_CONF)
+    get_configs().write(HEAT_CONF)
 
     if is_elected_leader(CLUSTER_RES):
         allowed_units = relation_get('heat_allowed_units')
@@ -213,19 +239,23 @@ def db_changed():
 
 def configure_https():
     """Enables SSL API Apache config if appropriate."""
+    from charmhelpers.contrib.hardening.audits.apache import apache_reloaded
+
     # need to write all to ensure changes to the entire request pipeline
     # propagate (c-api, haprxy, apache)
-    CONFIGS.write_all()
-    if 'https' in CONFIGS.complete_contexts():
-        cmd = ['a2ensite', 'openstack_https_frontend']
-        subprocess.check_call(cmd)
-    else:
-        cmd = ['a2dissite', 'openstack_https_frontend']
-        subprocess.check_call(cmd)
+    get_configs().write_all()
+    if serves_api():
+        if 'https' in get_configs().complete_contexts():
+            cmd = ['a2ensite', 'openstack_https_frontend']
+            subprocess.check_call(cmd)
+        else:
+            cmd = ['a2dissite', 'openstack_https_frontend']
+            subprocess.check_call(cmd)
 
-    # TODO: improve this by checking if local CN certs are available
-    # first then checking reload status (see LP #1433114).
-    service_reload('apache2', restart_on_failure=True)
+        # TODO: improve this by checking if local CN certs are available
+        # first then checking reload status (see LP #1433114).
+        service_reload('apache2', restart_on_failure=True)
+        apache_reloaded()
 
     for rid in relation_ids('identity-service'):
         identity_joined(rid=rid)
@@ -233,9 +263,26 @@ def configure_https():
 
 @hooks.hook('identity-service-relation-joined')
 def identity_joined(rid=None):
-    public_url_base = canonical_url(CONFIGS, PUBLIC)
-    internal_url_base = canonical_url(CONFIGS, INTERNAL)
-    admin_url_base = canonical_url(CONFIGS, ADMIN)
+    # Engine units share the service credentials of the API units, which
+    # keystone only hands out along with the endpoints. They register the
+    # same endpoints, so they must resolve to the API units' hostnames.
+    if not serves_api() and not all(
+            config('os-{}-hostname'.format(t)) for t in ADDRESS_TYPES):
+        log('Not registering endpoints until os-*-hostname point to the '
+            'API units.', level=WARNING)
+        return
+
+    from charmhelpers.contrib.openstack.ip import (
+        canonical_url,
+        ADMIN,
+        INTERNAL,
+        PUBLIC,
+    )
+    configs = get_configs()
+
+    public_url_base = canonical_url(configs, PUBLIC)
+    internal_url_base = canonical_url(configs, INTERNAL)
+    admin_url_base = canonical_url(configs, ADMIN)
 
     api_url_template = '%s:8004/v1/$(tenant_id)s'
     public_api_endpoint = (api_url_template % public_url_base)
@@ -264,13 +311,13 @@ def identity_joined(rid=None):
 
 
 @hooks.hook('identity-service-relation-changed')
-@restart_on_change(restart_map())
+@restart_on_change(restart_map(), restart_functions=restart_functions())
 def identity_changed():
-    if 'identity-service' not in CONFIGS.complete_contexts():
+    if 'identity-service' not in get_configs().complete_contexts():
         log('identity-service relation incomplete. Peer not ready?')
         return
 
-    CONFIGS.write_all()
+    get_configs().write_all()
     configure_https()
 
 
@@ -278,7 +325,7 @@ def identity_changed():
             'identity-service-relation-broken',
             'shared-db-relation-broken')
 def relation_broken():
-    CONFIGS.write_all()
+    get_configs().write_all()
 
 
 @hooks.hook('leader-elected')
@@ -287,6 +334,12 @@ def leader_elected():
         leader_set({'heat-domain-admin-passwd': pwgen(32)})
 
 
+@hooks.hook('leader-settings-changed')
+def leader_settings_changed():
+    record_migration_state()
+    restart_deferred_services()
+
+
 @hooks.hook('cluster-relation-joined')
 def cluster_joined(relation_id=None):
     settings = {}
@@ -305,13 +358,30 @@ def cluster_joined(relation_id=None):
 
 @hooks.hook('cluster-relation-changed',
             'cluster-relation-departed')
-@restart_on_change(restart_map(), stopstart=True)
+@restart_on_change(restart_map(), stopstart=True,
+                   restart_functions=restart_functions())
 def cluster_changed():
-    CONFIGS.write_all()
+    get_configs().write_all()
+    configure_engine_recycling()
 
 
 @hooks.hook('ha-relation-joined')
 def ha_joined(relation_id=None):
+    if not serves_api():
+        log('Role {} runs no haproxy, nothing to cluster.'.format(role()),
+            level=WARNING)
+        return
+
+    from charmhelpers.contrib.hahelpers.cluster import get_hacluster_config
+    from charmhelpers.contrib.network.ip import (
+        get_iface_for_address,
+        get_netmask_for_address,
+        is_ipv6,
+    )
+    from charmhelpers.contrib.openstack.ha.utils import (
+        update_dns_ha_resource_params,
+    )
+
     cluster_config = get_hacluster_config()
 
     resources = {
@@ -396,15 +466,41 @@ def ha_changed():
 @harden()
 def update_status():
     log('Updating status.')
+    # Picks up restarts held back by a migration whose end was missed, or
+    # which timed out.
+    restart_deferred_services()
+
+
+def record_hook_profile(name, timings, imports):
+    """Store the latest timings (in seconds) recorded for a hook, along with
+    the time taken by each module it imported."""
+    db = kv()
+    profile = db.get(HOOK_PROFILE_KEY) or {}
+    profile[name] = dict((k, round(v, 3)) for k, v in timings.items())
+    profile[name]['imports'] = dict((k, round(v, 3))
+                                    for k, v in imports.items())
+    db.set(HOOK_PROFILE_KEY, profile)
+    log('Hook {} profile: {}'.format(name, profile[name]), level=DEBUG)
 
 
 def main():
-    try:
-        hooks.execute(sys.argv)
-    except UnregisteredHookError as e:
-        log('Unknown hook {} - skipping.'.format(e))
-    set_os_workload_status(CONFIGS, REQUIRED_INTERFACES)
-    os_application_version_set(VERSION_PACKAGE)
+    # Buffer unit state for the whole hook and commit it once on success.
+    with kv().write_back():
+        started = time.time()
+        with IMPORTS:
+            try:
+                hooks.execute(sys.argv)
+            except UnregisteredHookError as e:
+                log('Unknown hook {} - skipping.'.format(e))
+        executed = time.time()
+        set_os_workload_status(get_configs(), REQUIRED_INTERFACES,
+                               charm_func=assess_charm_status)
+        os_application_version_set(VERSION_PACKAGE)
+        record_hook_profile(hook_name(), {
+            'import': IMPORT_TIME,
+            'hook': executed - started,
+            'status': time.time() - executed,
+        }, IMPORTS.times)
 
 
 if __name__ == '__main__':
@@ -12,11 +12,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import glob
 import os
+import socket
+import time
+import yaml
 
 from collections import OrderedDict
-from subprocess import check_call
+from subprocess import (
+    call,
+    check_call,
+    check_output,
+    CalledProcessError,
+    Popen,
+)
 
+from charmhelpers.contrib.hahelpers.cluster import (
+    determine_api_port,
+    is_elected_leader,
+)
 from charmhelpers.contrib.openstack import context, templating
 
 from charmhelpers.contrib.openstack.utils import (
@@ -32,29 +46,60 @@ from charmhelpers.fetch import (
     add_source,
     apt_install,
     apt_update,
+    apt_update_if_changed,
     apt_upgrade,
+    filter_installed_packages,
+    plan_packages,
 )
 
 from charmhelpers.core.hookenv import (
+    atexit,
     log,
+    charm_dir,
+    close_port,
     config,
+    local_unit,
+    related_units,
+    relation_ids,
+    ERROR,
+    WARNING,
+    leader_get,
+    leader_set,
+    open_port,
 )
 
 from charmhelpers.core.host import (
+    init_is_systemd,
     lsb_release,
+    path_hash,
+    service_pause,
+    service_resume,
+    service_running,
     service_start,
     service_stop,
     CompareHostReleases,
 )
 
+from charmhelpers.core.sysctl import create as create_sysctl
+from charmhelpers.core.templating import render
+from charmhelpers.core.unitdata import kv
+
 from heat_context import (
     API_PORTS,
+    APACHE_REQUESTS_PER_API_WORKER,
+    HAPROXY_MAXCONN,
+    api_worker_count,
     HeatIdentityServiceContext,
     HeatSecurityContext,
     InstanceUserContext,
     HeatApacheSSLContext,
+    HeatApacheTuningContext,
+    HeatMemcacheContext,
     HeatHAProxyContext,
+    HeatRoleContext,
+    HeatServiceOverridesContext,
 )
+from heat_recycle import migration_until_path
 
 TEMPLATES = 'templates/'
 
@@ -83,6 +128,20 @@ BASE_SERVICES = [
     'heat-engine'
 ]
 
+# Heat services run by each value of the role option. Units running the
+# APIs also run the haproxy and apache frontends.
+ROLES = OrderedDict([
+    ('all', BASE_SERVICES),
+    ('api', ['heat-api', 'heat-api-cfn']),
+    ('engine', ['heat-engine']),
+])
+FRONTEND_SERVICES = ['haproxy', 'apache2']
+# The keystone token cache, run alongside the APIs when enabled.
+TOKEN_CACHE_SERVICE = 'memcached'
+# Every service a role may run; each package is named after its service.
+CHARM_SERVICES = BASE_SERVICES + FRONTEND_SERVICES + [TOKEN_CACHE_SERVICE]
+ROLE_KEY = 'heat:role'
+
 # Cluster resource used to determine leadership when hacluster'd
 CLUSTER_RES = 'grp_heat_vips'
 SVC = 'heat'
@@ -95,6 +154,44 @@ HTTPS_APACHE_24_CONF = os.path.join('/etc/apache2/sites-available',
                                     'openstack_https_frontend.conf')
 ADMIN_OPENRC = '/root/admin-openrc-v3'
 MEMCACHED_CONF = '/etc/memcached.conf'
+# Only rendered on units running the APIs.
+API_CONFIG_FILES = [HEAT_API_PASTE, HAPROXY_CONF, HTTPS_APACHE_CONF,
+                    HTTPS_APACHE_24_CONF, MEMCACHED_CONF]
+
+HEAT_MIGRATIONS = ('/usr/lib/python*/dist-packages/heat/db/sqlalchemy/'
+                   'migrate_repo/versions/[0-9]*_*.py')
+# Leader settings: start time of a running migration ('' when idle) and the
+# schema version it left the database at.
+DB_MIGRATION_KEY = 'heat-db-migration'
+DB_VERSION_KEY = 'heat-db-version'
+# A migration marker older than this is assumed to be left over from a
+# leader that died mid-migration.
+DB_MIGRATION_TIMEOUT = 3600
+DEFERRED_RESTARTS_KEY = 'heat:deferred-restarts'
+RESTART_FAILURES_KEY = 'heat:restart-failures'
+# Seconds restarted services get to be running, and the APIs listening.
+RESTART_READY_TIMEOUT = 120
+RESTART_POLL_INTERVAL = 2
+# Heat services queued by queue_restart for the end of the hook.
+_pending_restarts = []
+# Resource overrides of each heat service, by init system.
+SYSTEMD_OVERRIDE = '/etc/systemd/system/{}.service.d/heat-overrides.conf'
+UPSTART_OVERRIDE = '/etc/init/{}.override'
+ENGINE_RECYCLE_CRON = '/etc/cron.d/heat-engine-recycle'
+
+# Applied before the hardening settings (99-juju-hardening.conf) on boot.
+SYSCTL_CONF = '/etc/sysctl.d/50-heat.conf'
+SYSCTL_PROFILES = ['default', 'api-high-concurrency']
+SYSCTL_MIN_BACKLOG = 4096
+SYSCTL_FIN_TIMEOUT = 30
+# Ephemeral ports never go below the API and frontend ports, nor above the
+# kernel's default range when that is already large enough.
+SYSCTL_MIN_LOCAL_PORT = 10240
+SYSCTL_DEFAULT_LOCAL_PORT = 32768
+SYSCTL_MAX_LOCAL_PORT = 65535
+# Listening ports inside the ephemeral range, reserved when the range
+# reaches down to them.
+MEMCACHED_PORT = 11211
 
 CONFIG_FILES = OrderedDict([
     (HEAT_CONF, {
@@ -112,7 +209,8 @@ CONFIG_FILES = OrderedDict([
                      context.LogLevelContext(),
                      context.WorkerConfigContext(),
                      context.BindHostContext(),
-                     context.MemcacheContext(),
+                     HeatMemcacheContext(),
+                     HeatRoleContext(),
                      context.OSConfigFlagContext()],
     }),
     (HEAT_API_PASTE, {
@@ -125,11 +223,13 @@ CONFIG_FILES = OrderedDict([
         'services': ['haproxy'],
     }),
     (HTTPS_APACHE_CONF, {
-        'contexts': [HeatApacheSSLContext()],
+        'contexts': [HeatApacheSSLContext(),
+                     HeatApacheTuningContext()],
         'services': ['apache2'],
     }),
     (HTTPS_APACHE_24_CONF, {
-        'contexts': [HeatApacheSSLContext()],
+        'contexts': [HeatApacheSSLContext(),
+                     HeatApacheTuningContext()],
         'services': ['apache2'],
     }),
     (ADMIN_OPENRC, {
@@ -138,7 +238,7 @@ CONFIG_FILES = OrderedDict([
         'services': []
     }),
     (MEMCACHED_CONF, {
-        'hook_contexts': [context.MemcacheContext()],
+        'hook_contexts': [HeatMemcacheContext()],
         'services': ['memcached'],
     }),
 ])
@@ -149,10 +249,15 @@ def register_configs():
     configs = templating.OSConfigRenderer(templates_dir=TEMPLATES,
                                           openstack_release=release)
 
-    confs = [HEAT_CONF, HEAT_API_PASTE, HAPROXY_CONF, ADMIN_OPENRC]
+    confs = [HEAT_CONF, ADMIN_OPENRC]
+    if serves_api():
+        confs += [HEAT_API_PASTE, HAPROXY_CONF]
     for conf in confs:
         configs.register(conf, CONFIG_FILES[conf]['contexts'])
 
+    if not serves_api():
+        return configs
+
     if os.path.exists('/etc/apache2/conf-available'):
         configs.register(HTTPS_APACHE_24_CONF,
                          CONFIG_FILES[HTTPS_APACHE_24_CONF]['contexts'])
@@ -166,17 +271,127 @@ def register_configs():
     return configs
 
 
+def role():
+    """Returns the configured role, 'all' if it is not a known one."""
+    return config('role') if config('role') in ROLES else 'all'
+
+
+def role_services(name=None):
+    """Returns the heat services run by a role, the configured one by
+    default."""
+    return ROLES[name or role()]
+
+
+def serves_api(name=None):
+    """Returns whether a role, the configured one by default, runs the
+    APIs and their frontends."""
+    return 'heat-api' in role_services(name)
+
+
+def assess_role(configs):
+    """charm_func for set_os_workload_status checking the role option."""
+    if config('role') not in ROLES:
+        return 'blocked', 'Invalid role {}, expected one of {}'.format(
+            config('role'), ', '.join(ROLES))
+    if not serves_api() and not all(
+            config('os-{}-hostname'.format(t))
+            for t in context.ADDRESS_TYPES):
+        return 'blocked', ('Role engine needs os-{}-hostname set to the API '
+                           'units'.format('/'.join(context.ADDRESS_TYPES)))
+    return 'active', 'Unit is ready'
+
+
+def assess_restarts():
+    """Returns a blocked status if services restarted by the charm did not
+    come back, clearing the record once they have."""
+    db = kv()
+    recorded = db.get(RESTART_FAILURES_KEY, [])
+    failed = [s for s in recorded if not service_ready(s)]
+    if not failed:
+        if recorded:
+            db.unset(RESTART_FAILURES_KEY)
+        return 'active', 'Unit is ready'
+    db.set(RESTART_FAILURES_KEY, failed)
+    return 'blocked', 'Services not ready after restart: {}'.format(
+        ', '.join(failed))
+
+
+def assess_charm_status(configs):
+    """charm_func for set_os_workload_status: the role, then the last
+    restarts."""
+    state, message = assess_role(configs)
+    if state != 'active':
+        return state, message
+    return assess_restarts()
+
+
+def configure_role():
+    """Installs, starts and stops services after a change of role.
+
+    Every installed service the new role does not run is paused, so it
+    stays stopped across reboots, whichever role installed it. Services
+    the new role runs and the previous one did not are resumed. The API
+    ports are opened or closed when the role starts or stops serving the
+    APIs.
+    """
+    db = kv()
+    previous = db.get(ROLE_KEY) or 'all'
+    if previous == role():
+        return
+    log('Changing role from {} to {}'.format(previous, role()))
+    install_packages()
+    old = role_services(previous) + (FRONTEND_SERVICES
+                                     if serves_api(previous) else [])
+    new = role_services() + (FRONTEND_SERVICES if serves_api() else [])
+    keep = new + ([TOKEN_CACHE_SERVICE] if serves_api() else [])
+    missing = filter_installed_packages(CHARM_SERVICES)
+    for svc in CHARM_SERVICES:
+        if svc not in keep and svc not in missing:
+            service_pause(svc)
+    for svc in new:
+        if svc not in old:
+            service_resume(svc)
+    if serves_api(previous) != serves_api():
+        set_port = open_port if serves_api() else close_port
+        for port in sorted(API_PORTS.values()):
+            set_port(port)
+    db.set(ROLE_KEY, role())
+
+
 def api_port(service):
     return API_PORTS[service]
 
 
 def determine_packages():
     # currently all packages match service names
-    packages = BASE_PACKAGES + BASE_SERVICES
-    packages.extend(token_cache_pkgs(source=config('openstack-origin')))
+    packages = BASE_PACKAGES + role_services()
+    if serves_api():
+        packages.extend(token_cache_pkgs(source=config('openstack-origin')))
+    else:
+        packages = [p for p in packages if p not in FRONTEND_SERVICES]
     return list(set(packages))
 
 
+def install_packages(options=None):
+    """Install or upgrade the charm packages.
+
+    apt is skipped entirely when the sources have not changed since the
+    last update and every package is already installed at its candidate
+    version.
+
+    :param options: optional list of apt-get options
+    """
+    apt_update_if_changed()
+    missing, upgradable = plan_packages(determine_packages())
+    if not missing and not upgradable:
+        log('All packages installed at the wanted versions.')
+        return
+    kwargs = {'fatal': True}
+    if options is not None:
+        kwargs['options'] = options
+    apt_install(missing + upgradable, **kwargs)
+
+
 def do_openstack_upgrade(configs):
     """Perform an uprade of heat.
 
@@ -197,15 +412,18 @@ def do_openstack_upgrade(configs):
         '--option', 'Dpkg::Options::=--force-confnew',
         '--option', 'Dpkg::Options::=--force-confdef',
     ]
-    apt_update()
+    apt_update_if_changed()
     apt_upgrade(options=dpkg_opts, fatal=True, dist=True)
-    apt_install(packages=determine_packages(), options=dpkg_opts, fatal=True)
+    install_packages(options=dpkg_opts)
 
     # set CONFIGS to load templates from new release and regenerate config
     configs.set_release(openstack_release=new_os_rel)
     configs.write_all()
 
-    migrate_database()
+    # Followers hold their heat restarts back while the leader migrates,
+    # see deferred_restart.
+    if is_elected_leader(CLUSTER_RES):
+        migrate_database()
 
 
 def restart_map():
@@ -219,11 +437,16 @@ def restart_map():
     """
     _map = []
     for f, ctxt in CONFIG_FILES.iteritems():
+        if f in API_CONFIG_FILES and not serves_api():
+            continue
         svcs = []
         for svc in ctxt['services']:
-            svcs.append(svc)
+            if svc in role_services() or svc not in BASE_SERVICES:
+                svcs.append(svc)
         if svcs:
             _map.append((f, svcs))
+    for svc, path in service_override_files().items():
+        _map.append((path, [svc]))
     return OrderedDict(_map)
 
 
@@ -235,12 +458,365 @@ def services():
     return list(set(_services))
 
 
-def migrate_database():
-    """Runs heat-manage to initialize a new database or migrate existing"""
-    log('Migrating the heat database.')
-    [service_stop(s) for s in services()]
-    check_call(['heat-manage', 'db_sync'])
-    [service_start(s) for s in services()]
+def db_version():
+    """Returns the schema version of the heat database, or None if it
+    cannot be determined."""
+    try:
+        output = check_output(['heat-manage', 'db_version'])
+        return int(output.decode('UTF-8').split()[-1])
+    except (CalledProcessError, OSError, ValueError, IndexError):
+        return None
+
+
+def db_head_version():
+    """Returns the newest schema version shipped by the installed heat
+    packages, or None if it cannot be determined."""
+    versions = [int(os.path.basename(f).split('_')[0])
+                for f in glob.glob(HEAT_MIGRATIONS)]
+    return max(versions) if versions else None
+
+
+def migration_in_progress():
+    """Whether the leader is currently migrating the heat database."""
+    try:
+        started = leader_get(DB_MIGRATION_KEY)
+    except NotImplementedError:
+        return False
+    if not started:
+        return False
+    return time.time() - float(started) < DB_MIGRATION_TIMEOUT
+
+
+def record_migration_state(started=None):
+    """Keeps the end of the database migration window on disk for
+    heat_recycle, which runs from cron and cannot read leader settings.
+
+    The file is written straight away, outside of the hook's unitdata
+    transaction, so it is seen while the migration runs.
+
+    :param started: the leader's migration marker, read from leader
+                    settings if None.
+    """
+    if started is None:
+        try:
+            started = leader_get(DB_MIGRATION_KEY)
+        except NotImplementedError:
+            return
+    path = migration_until_path()
+    if started:
+        with open(path + '.new', 'w') as f:
+            f.write(str(float(started) + DB_MIGRATION_TIMEOUT))
+        os.rename(path + '.new', path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def _set_migration_state(started, version=None):
+    settings = {DB_MIGRATION_KEY: started}
+    if version is not None:
+        settings[DB_VERSION_KEY] = version
+    try:
+        leader_set(settings)
+    except NotImplementedError:
+        log('Leader settings unavailable, not publishing migration state')
+    record_migration_state(started)
+
+
+def migrate_database(mode=None):
+    """Runs heat-manage to initialize a new database or migrate existing
+
+    Only to be called on the leader. The migration is skipped when the
+    database is already at the schema version shipped by the installed
+    packages. While it runs the leader publishes a marker in leader
+    settings so that followers hold back their heat restarts (see
+    deferred_restart).
+
+    :param mode: 'offline' stops every service for the migration, 'online'
+                 only stops heat-engine. Defaults to the
+                 database-migration-mode config option.
+    :returns: bool: whether a migration was run.
+    """
+    mode = mode or config('database-migration-mode') or 'offline'
+    current, head = db_version(), db_head_version()
+    if current is not None and current == head:
+        log('Heat database already at version %s, skipping '
+            'migration.' % current)
+        return False
+
+    log('Migrating the heat database from version %s to %s (%s).' %
+        (current, head, mode))
+    stopped = services() if mode == 'offline' else [
+        s for s in ['heat-engine'] if s in role_services()]
+    _set_migration_state(str(time.time()))
+    try:
+        [service_stop(s) for s in stopped]
+        check_call(['heat-manage', 'db_sync'])
+        [service_start(s) for s in stopped]
+    finally:
+        _set_migration_state('', version=db_version())
+    return True
+
+
+def deferred_restart(service_name):
+    """restart_on_change function for the heat services, which holds
+    restarts back while the leader is migrating the database and otherwise
+    queues them for the end of the hook."""
+    if migration_in_progress():
+        log('Database migration in progress, deferring restart of %s' %
+            service_name)
+        db = kv()
+        pending = db.get(DEFERRED_RESTARTS_KEY, [])
+        if service_name not in pending:
+            db.set(DEFERRED_RESTARTS_KEY, pending + [service_name])
+        return
+    queue_restart(service_name)
+
+
+def restart_functions():
+    """Returns restart_on_change restart_functions for the heat services."""
+    return dict((s, deferred_restart) for s in BASE_SERVICES)
+
+
+def restart_deferred_services():
+    """Restarts any services held back by deferred_restart once the
+    database migration has finished."""
+    db = kv()
+    pending = db.get(DEFERRED_RESTARTS_KEY, [])
+    if not pending or migration_in_progress():
+        return
+    log('Restarting %s after database migration' % ', '.join(pending))
+    restart_services(pending)
+    db.unset(DEFERRED_RESTARTS_KEY)
+
+
+def queue_restart(service_name):
+    """Queues a restart for the end of the hook, so that the services a
+    hook changed restart together, see restart_pending_services."""
+    if not _pending_restarts:
+        atexit(restart_pending_services)
+    if service_name not in _pending_restarts:
+        _pending_restarts.append(service_name)
+
+
+def restart_pending_services():
+    """Restarts the services queued by queue_restart."""
+    pending = list(_pending_restarts)
+    del _pending_restarts[:]
+    if pending:
+        restart_services(pending)
+
+
+def service_ready(service_name):
+    """Returns whether a service is running and, for the APIs, accepting
+    connections on the port it listens on."""
+    if not service_running(service_name):
+        return False
+    if service_name not in API_PORTS:
+        return True
+    host = '::1' if config('prefer-ipv6') else '127.0.0.1'
+    port = determine_api_port(API_PORTS[service_name], singlenode_mode=True)
+    try:
+        socket.create_connection((host, port), timeout=1).close()
+    except socket.error:
+        return False
+    return True
+
+
+def wait_for_services(services, timeout=RESTART_READY_TIMEOUT):
+    """Polls services until they are all ready or timeout seconds have
+    passed, and returns the ones that are not ready."""
+    deadline = time.time() + timeout
+    pending = list(services)
+    while True:
+        pending = [s for s in pending if not service_ready(s)]
+        if not pending or time.time() >= deadline:
+            return pending
+        time.sleep(RESTART_POLL_INTERVAL)
+
+
+def restart_services(services):
+    """Restarts services together and waits until they are ready.
+
+    systemd restarts them with one systemctl call, upstart jobs are
+    restarted in parallel. Services still not ready after
+    RESTART_READY_TIMEOUT are recorded for assess_restarts.
+    """
+    log('Restarting {}'.format(', '.join(services)))
+    if init_is_systemd():
+        call(['systemctl', 'restart'] + services)
+    else:
+        for proc in [Popen(['service', svc, 'restart']) for svc in services]:
+            proc.wait()
+    failed = wait_for_services(services)
+    if failed:
+        log('{} not ready {}s after restart'.format(
+            ', '.join(failed), RESTART_READY_TIMEOUT), level=ERROR)
+    db = kv()
+    failed += [s for s in db.get(RESTART_FAILURES_KEY, [])
+               if s not in services]
+    if failed:
+        db.set(RESTART_FAILURES_KEY, failed)
+    else:
+        db.unset(RESTART_FAILURES_KEY)
+    return failed
+
+
+def service_override_files():
+    """Returns the resource override file of each heat service."""
+    path = SYSTEMD_OVERRIDE if init_is_systemd() else UPSTART_OVERRIDE
+    return OrderedDict((svc, path.format(svc)) for svc in role_services())
+
+
+def configure_service_overrides():
+    """Writes the resource overrides of the heat services.
+
+    systemd is only reloaded when a drop-in changed; restart_on_change then
+    restarts the services whose override changed.
+    """
+    systemd = init_is_systemd()
+    template = 'heat-overrides.conf' if systemd else 'heat.override'
+    changed = False
+    for svc, path in service_override_files().items():
+        checksum = path_hash(path)
+        render(template, path, HeatServiceOverridesContext(svc)(),
+               perms=0o644)
+        changed = changed or path_hash(path) != checksum
+    if changed and systemd:
+        check_call(['systemctl', 'daemon-reload'])
+
+
+def engine_recycle_minute():
+    """Returns the minute of the hour this unit recycles heat-engine at.
+
+    Peers get evenly spaced minutes in unit number order, so no two units
+    restart heat-engine at the same time.
+    """
+    units = set([local_unit()])
+    for rid in relation_ids('cluster'):
+        units.update(related_units(rid))
+    units = sorted(units, key=lambda unit: int(unit.split('/')[-1]))
+    return units.index(local_unit()) * 60 // len(units)
+
+
+def configure_engine_recycling():
+    """Writes or removes the cron job recycling heat-engine.
+
+    The job runs heat_recycle.py hourly; it is only installed on units
+    running heat-engine with engine-recycle-rss or engine-recycle-interval
+    set.
+    """
+    rss_limit = config('engine-recycle-rss') or 0
+    interval = config('engine-recycle-interval') or 0
+    if 'heat-engine' not in role_services() or not (rss_limit or interval):
+        if os.path.exists(ENGINE_RECYCLE_CRON):
+            os.remove(ENGINE_RECYCLE_CRON)
+        return
+    render('heat-engine-recycle', ENGINE_RECYCLE_CRON,
+           {'charm_dir': charm_dir(),
+            'minute': engine_recycle_minute(),
+            'rss_limit': rss_limit,
+            'interval': interval},
+           perms=0o644)
+
+
+def api_sysctl_settings():
+    """Returns kernel network settings for the api-high-concurrency profile.
+
+    The accept and SYN queues hold a full haproxy maxconn burst. The
+    ephemeral port range covers a backend connection per haproxy connection
+    plus the connections apache keeps open to the API workers. When the
+    range reaches down to memcached's port, that port is reserved.
+    """
+    backlog = max(SYSCTL_MIN_BACKLOG, HAPROXY_MAXCONN)
+    outbound = (HAPROXY_MAXCONN + api_worker_count() * len(API_PORTS) *
+                APACHE_REQUESTS_PER_API_WORKER)
+    low_port = max(SYSCTL_MIN_LOCAL_PORT,
+                   min(SYSCTL_DEFAULT_LOCAL_PORT,
+                       SYSCTL_MAX_LOCAL_PORT - outbound))
+    settings = {
+        'net.core.somaxconn': backlog,
+        'net.ipv4.tcp_max_syn_backlog': backlog,
+        'net.ipv4.ip_local_port_range': '%d %d' % (low_port,
+                                                   SYSCTL_MAX_LOCAL_PORT),
+        'net.ipv4.tcp_tw_reuse': 1,
+        'net.ipv4.tcp_fin_timeout': SYSCTL_FIN_TIMEOUT,
+    }
+    if low_port <= MEMCACHED_PORT:
+        settings['net.ipv4.ip_local_reserved_ports'] = MEMCACHED_PORT
+    return settings
+
+
+def sysctl_settings():
+    """Returns the sysctl settings selected by sysctl-profile.
+
+    Keys managed by the os hardening module are left to it. tcp_tw_reuse is
+    dropped too when hardening is on, as it has no effect without the TCP
+    timestamps hardening disables. Returns None if sysctl-profile is
+    invalid.
+    """
+    profile = config('sysctl-profile') or 'default'
+    if profile == 'default':
+        settings = {}
+    elif profile == 'api-high-concurrency':
+        settings = api_sysctl_settings()
+    else:
+        try:
+            settings = yaml.safe_load(profile)
+        except yaml.YAMLError:
+            settings = None
+        if not isinstance(settings, dict):
+            log('Invalid sysctl-profile, expected one of {} or a YAML '
+                'dictionary: {}'.format(', '.join(SYSCTL_PROFILES), profile),
+                level=ERROR)
+            return None
+
+    if 'os' in (config('harden') or '').split():
+        # Imported here as the hardening host checks pull in python-apt.
+        from charmhelpers.contrib.hardening.host.checks.sysctl import (
+            SYSCTL_DEFAULTS,
+        )
+        hardened = set(line.partition('=')[0]
+                       for line in SYSCTL_DEFAULTS.split())
+        hardened.add('net.ipv4.tcp_tw_reuse')
+        for key in sorted(hardened.intersection(settings)):
+            log('Leaving {} to os hardening'.format(key), level=WARNING)
+            del settings[key]
+    return dict((key, str(value)) for key, value in settings.items())
+
+
+def read_sysctl_conf(path):
+    """Returns the settings in a sysctl.d file, empty if there is none."""
+    settings = {}
+    if not os.path.exists(path):
+        return settings
+    with open(path) as f:
+        for line in f:
+            key, sep, value = line.partition('=')
+            if sep and not line.startswith(('#', ';')):
+                settings[key.strip()] = value.strip()
+    return settings
+
+
+def configure_sysctl():
+    """Applies the sysctl-profile settings when they have changed.
+
+    Switching back to the default profile removes SYSCTL_CONF; the kernel
+    keeps the values it was given until the next reboot.
+    """
+    settings = sysctl_settings()
+    if settings is None or settings == read_sysctl_conf(SYSCTL_CONF):
+        return
+    if not settings:
+        log('Removing {}, kernel defaults apply after reboot'.format(
+            SYSCTL_CONF))
+        os.remove(SYSCTL_CONF)
+        return
+    try:
+        create_sysctl(yaml.safe_dump(settings), SYSCTL_CONF)
+    except CalledProcessError as e:
+        # Some keys cannot be set from a container.
+        log('sysctl could not apply every setting: {}'.format(e),
+            level=WARNING)
 
 
 def setup_ipv6():
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Stand-in for the Juju hook tools and the system commands used by the charm.
+
+hook_bench.py puts one wrapper per tool on PATH, each running:
+
+    fake_tool.py <tool> [args...]
+
+Answers come from the scenario (BENCH_SCENARIO) and from the unit state
+the fake tools keep between hooks (BENCH_STATE): relation data set by this
+unit, leader settings and opened ports. Commands with side effects on the
+host (service restarts, package installs...) are appended to BENCH_EVENTS.
+"""
+
+import json
+import os
+import sys
+
+
+def _load(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+def _save(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.rename(tmp, path)
+
+
+def _event(tool, args):
+    with open(os.environ['BENCH_EVENTS'], 'a') as f:
+        f.write(json.dumps({'tool': tool, 'args': args}) + '\n')
+
+
+def _out(data):
+    sys.stdout.write(json.dumps(data) + '\n')
+
+
+def _opts(args, flags=('-r', '-l', '-s')):
+    """Splits args into ({flag: value}, positional), dropping --format."""
+    opts = {}
+    positional = []
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg in flags:
+            opts[arg] = args.pop(0)
+        elif arg.startswith('--format'):
+            continue
+        else:
+            positional.append(arg)
+    return opts, positional
+
+
+class Tools(object):
+
+    def __init__(self):
+        self.scenario = _load(os.environ['BENCH_SCENARIO'], {})
+        self.state_path = os.environ['BENCH_STATE']
+        self.state = _load(self.state_path,
+                           {'leader': {}, 'local': {}, 'ports': []})
+        self.unit = os.environ.get('JUJU_UNIT_NAME')
+
+    def save(self):
+        _save(self.state_path, self.state)
+
+    def relations(self):
+        return self.scenario.get('relations', {})
+
+    def relation_units(self, rid):
+        for name, rids in self.relations().items():
+            if rid in rids:
+                return rids[rid]
+        return {}
+
+    # Juju hook tools
+
+    def config_get(self, args):
+        _, positional = _opts(args)
+        # hook_bench.py merges the charm defaults into the scenario config.
+        config = self.scenario.get('config', {})
+        if positional and positional[0] != '--all':
+            _out(config.get(positional[0]))
+        else:
+            _out(config)
+
+    def relation_get(self, args):
+        opts, positional = _opts(args)
+        rid = opts.get('-r', os.environ.get('JUJU_RELATION_ID'))
+        attribute = positional[0] if positional else '-'
+        unit = (positional[1] if len(positional) > 1
+                else os.environ.get('JUJU_REMOTE_UNIT'))
+        if unit == self.unit:
+            settings = self.state['local'].get(rid, {})
+        else:
+            settings = self.relation_units(rid).get(unit, {})
+        _out(settings if attribute == '-' else settings.get(attribute))
+
+    def relation_set(self, args):
+        if '--help' in args:
+            sys.stdout.write('usage: relation-set [options] key=value ...\n'
+                             '    --file  (= -) file containing key-value '
+                             'pairs\n')
+            return
+        opts, positional = _opts(args, flags=('-r', '--file'))
+        rid = opts.get('-r', os.environ.get('JUJU_RELATION_ID'))
+        settings = {}
+        if '--file' in opts:
+            import yaml
+            with open(opts['--file']) as f:
+                settings.update(yaml.safe_load(f) or {})
+        for pair in positional:
+            key, value = pair.split('=', 1)
+            settings[key] = value
+        local = self.state['local'].setdefault(rid, {})
+        for key, value in settings.items():
+            if value in (None, ''):
+                local.pop(key, None)
+            else:
+                local[key] = value
+        self.save()
+        _event('relation-set', [rid, sorted(settings)])
+
+    def relation_ids(self, args):
+        _, positional = _opts(args)
+        name = positional[0] if positional else os.environ.get(
+            'JUJU_RELATION')
+        _out(sorted(self.relations().get(name, {})))
+
+    def relation_list(self, args):
+        opts, _ = _opts(args)
+        rid = opts.get('-r', os.environ.get('JUJU_RELATION_ID'))
+        _out(sorted(self.relation_units(rid)))
+
+    def leader_get(self, args):
+        _, positional = _opts(args)
+        attribute = positional[0] if positional else '-'
+        leader = self.state['leader']
+        _out(leader if attribute == '-' else leader.get(attribute))
+
+    def leader_set(self, args):
+        for pair in args:
+            key, value = pair.split('=', 1)
+            if value:
+                self.state['leader'][key] = value
+            else:
+                self.state['leader'].pop(key, None)
+        self.save()
+        _event('leader-set', sorted(pair.split('=')[0] for pair in args))
+
+    def is_leader(self, args):
+        _out(bool(self.scenario.get('leader', True)))
+
+    def unit_get(self, args):
+        _, positional = _opts(args)
+        address = self.scenario.get('private-address', '10.5.0.10')
+        _out(self.scenario.get(positional[0], address))
+
+    def network_get(self, args):
+        _, positional = _opts(args)
+        network = self.scenario.get('network', {})
+        binding = [a for a in positional if not a.startswith('-')]
+        address = network.get(binding[0] if binding else 'default',
+                              network.get('default',
+                                          self.scenario.get(
+                                              'private-address',
+                                              '10.5.0.10')))
+        sys.stdout.write(address + '\n')
+
+    def juju_log(self, args):
+        log = os.path.join(os.path.dirname(self.state_path), 'juju.log')
+        with open(log, 'a') as f:
+            f.write(' '.join(args) + '\n')
+
+    def status_get(self, args):
+        _out(self.state.get('status', {'status': 'unknown', 'message': ''}))
+
+    def status_set(self, args):
+        self.state['status'] = {'status': args[0],
+                                'message': ' '.join(args[1:])}
+        self.save()
+
+    def open_port(self, args):
+        if args[0] not in self.state['ports']:
+            self.state['ports'].append(args[0])
+            self.save()
+
+    def close_port(self, args):
+        if args[0] in self.state['ports']:
+            self.state['ports'].remove(args[0])
+            self.save()
+
+    def opened_ports(self, args):
+        _out(self.state['ports'])
+
+    # System commands
+
+    def systemctl(self, args):
+        if args and args[0] in ('is-active', 'is-enabled'):
+            sys.stdout.write('active\n' if args[0] == 'is-active'
+                             else 'enabled\n')
+            return
+        _event('systemctl', args)
+
+    def service(self, args):
+        if len(args) > 1 and args[1] == 'status':
+            sys.stdout.write('%s start/running\n' % args[0])
+            return
+        _event('service', args)
+
+    def heat_manage(self, args):
+        if args and args[0] == 'db_version':
+            sys.stdout.write('%s\n' % self.scenario.get('db-version', 0))
+            return
+        _event('heat-manage', args)
+
+    def crm_mon(self, args):
+        status = self.scenario.get('crm-mon')
+        if not status:
+            sys.exit(1)
+        sys.stdout.write(status)
+
+    def crm(self, args):
+        if args[:2] == ['resource', 'show']:
+            sys.stdout.write('resource %s is running on: %s\n' %
+                             (args[2], self.scenario.get('hostname',
+                                                         'juju-heat-0')))
+            return
+        _event('crm', args)
+
+    def dpkg(self, args):
+        if '--print-architecture' in args:
+            sys.stdout.write('amd64\n')
+            return
+        _event('dpkg', args)
+
+    def ip(self, args):
+        return
+
+    def systemd_detect_virt(self, args):
+        sys.stdout.write('none\n')
+        sys.exit(1)
+
+    def default(self, tool, args):
+        _event(tool, args)
+
+
+def main():
+    tool, args = os.path.basename(sys.argv[1]), sys.argv[2:]
+    tools = Tools()
+    handler = getattr(tools, tool.replace('-', '_'), None)
+    if handler is None:
+        tools.default(tool, args)
+    else:
+        handler(args)
+
+
+if __name__ == '__main__':
+    main()
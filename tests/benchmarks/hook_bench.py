@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Offline hook execution benchmark.
+
+Runs the charm's hooks against fake Juju hook tools and system commands
+(see fake_tool.py) in a throwaway sandbox (see hook_shim.py), driven by a
+scenario from scenarios/. For every hook it records the wall time, the
+subprocesses started per tool, the files written and the services
+restarted, and compares the results against baselines/<scenario>.json.
+
+Usage:
+
+    python tests/benchmarks/hook_bench.py [scenario...]
+    python tests/benchmarks/hook_bench.py --update-baselines
+
+Exits non-zero if any hook fails or regresses against its baseline.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(os.path.dirname(HERE))
+SCENARIOS = os.path.join(HERE, 'scenarios')
+BASELINES = os.path.join(HERE, 'baselines')
+
+# Hook tools and system commands replaced by fake_tool.py.
+TOOLS = [
+    'config-get', 'relation-get', 'relation-set', 'relation-ids',
+    'relation-list', 'leader-get', 'leader-set', 'is-leader', 'juju-log',
+    'network-get', 'unit-get', 'status-get', 'status-set',
+    'application-version-set', 'open-port', 'close-port', 'opened-ports',
+    'systemctl', 'service', 'apt-get', 'apt-key', 'apt-cache', 'dpkg',
+    'add-apt-repository', 'crm', 'crm_mon', 'heat-manage', 'a2ensite',
+    'a2dissite', 'a2enmod', 'a2dismod', 'apache2ctl', 'nc', 'ip', 'sysctl',
+    'update-rc.d', 'systemd-detect-virt',
+]
+
+# Charm files linked into the sandbox charm directory.
+CHARM_FILES = ['actions', 'actions.yaml', 'config.yaml', 'hardening.yaml',
+               'hooks', 'metadata.yaml', 'revision', 'templates']
+
+# Run when a scenario does not list its own hooks: a deployment coming up,
+# a steady-state config-changed, then teardown.
+DEFAULT_HOOKS = [
+    'install', 'leader-elected', 'config-changed', 'start',
+    'amqp-relation-joined', 'amqp-relation-changed',
+    'shared-db-relation-joined', 'shared-db-relation-changed',
+    'identity-service-relation-joined', 'identity-service-relation-changed',
+    'cluster-relation-joined', 'cluster-relation-changed',
+    'ha-relation-joined', 'ha-relation-changed', 'leader-settings-changed',
+    'update-status', 'config-changed', 'upgrade-charm',
+    'cluster-relation-departed', 'amqp-relation-broken',
+    'identity-service-relation-broken', 'shared-db-relation-broken', 'stop',
+]
+
+# Wall time regressions below this many seconds are ignored as noise.
+MIN_TIME_DELTA = 0.25
+
+
+def load_scenario(name):
+    path = name if os.path.exists(name) else os.path.join(
+        SCENARIOS, '%s.yaml' % name)
+    with open(path) as f:
+        scenario = yaml.safe_load(f)
+    scenario.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+    return scenario
+
+
+def make_sandbox(scenario, workdir, python):
+    """Creates the fake host filesystem, charm dir and tool wrappers."""
+    root = os.path.join(workdir, 'root')
+    charm = os.path.join(workdir, 'charm')
+    bindir = os.path.join(workdir, 'bin')
+    for d in ('etc/heat', 'etc/haproxy', 'etc/default',
+              'etc/apache2/sites-available',
+              'etc/apache2/mods-enabled', 'etc/apt/sources.list.d',
+              'etc/init', 'var/lib/dpkg', 'var/lib/juju', 'run/systemd/system',
+              'usr/lib/python2.7/dist-packages', 'root'):
+        os.makedirs(os.path.join(root, d))
+    os.makedirs(charm)
+    os.makedirs(bindir)
+
+    with open(os.path.join(root, 'etc/lsb-release'), 'w') as f:
+        f.write('DISTRIB_ID=Ubuntu\nDISTRIB_CODENAME=%s\n' %
+                scenario.get('series', 'xenial'))
+    with open(os.path.join(root, 'etc/default/haproxy'), 'w') as f:
+        f.write('ENABLED=0\n')
+    with open(os.path.join(root, 'etc/debian_version'), 'w') as f:
+        f.write('stretch/sid\n')
+    with open(os.path.join(root, 'etc/apt/sources.list'), 'w') as f:
+        f.write('deb http://archive.ubuntu.com/ubuntu %s main\n' %
+                scenario.get('series', 'xenial'))
+    with open(os.path.join(root, 'var/lib/dpkg/status'), 'w') as f:
+        for name, version in sorted(scenario.get('packages', {}).items()):
+            f.write('Package: %s\nStatus: install ok installed\n'
+                    'Version: %s\n\n' % (name, version))
+
+    migrations = os.path.join(root, 'usr/lib/python2.7/dist-packages/heat/'
+                              'db/sqlalchemy/migrate_repo/versions')
+    os.makedirs(migrations)
+    if scenario.get('db-head'):
+        open(os.path.join(migrations, '%03d_bench.py' %
+                          scenario['db-head']), 'w').close()
+
+    for name in CHARM_FILES:
+        os.symlink(os.path.join(REPO, name), os.path.join(charm, name))
+
+    for tool in TOOLS:
+        wrapper = os.path.join(bindir, tool)
+        with open(wrapper, 'w') as f:
+            f.write('#!/bin/sh\nexec "%s" "%s" %s "$@"\n' %
+                    (python, os.path.join(HERE, 'fake_tool.py'), tool))
+        os.chmod(wrapper, 0o755)
+
+    # Merge charm defaults once rather than in every config-get.
+    with open(os.path.join(REPO, 'config.yaml')) as f:
+        options = yaml.safe_load(f)['options']
+    config = dict((k, v.get('default')) for k, v in options.items())
+    config.update(scenario.get('config', {}))
+    scenario = dict(scenario, config=config)
+
+    scenario_path = os.path.join(workdir, 'scenario.json')
+    with open(scenario_path, 'w') as f:
+        json.dump(scenario, f)
+    return root, charm, bindir, scenario_path
+
+
+def hook_context(scenario, hook):
+    """Returns the JUJU_* relation environment for a relation hook."""
+    if '-relation-' not in hook:
+        return {}
+    name = hook.split('-relation-')[0]
+    rids = scenario.get('relations', {}).get(name, {})
+    if not rids:
+        return {'JUJU_RELATION': name}
+    rid = sorted(rids)[0]
+    env = {'JUJU_RELATION': name, 'JUJU_RELATION_ID': rid}
+    units = sorted(rids[rid])
+    if units:
+        env['JUJU_REMOTE_UNIT'] = units[0]
+    return env
+
+
+def summarise(events_path):
+    subprocesses = {}
+    written = set()
+    restarts = []
+    with open(events_path) as f:
+        for line in f:
+            event = json.loads(line)
+            if 'exec' in event:
+                tool = event['exec']
+                subprocesses[tool] = subprocesses.get(tool, 0) + 1
+            elif 'write' in event and event['write'] != os.devnull:
+                written.add(event['write'])
+            elif event.get('tool') in ('systemctl', 'service'):
+                args = event['args']
+                if event['tool'] == 'service':
+                    args = args[1:2] + args[:1]
+                if args and args[0] in ('restart', 'stop', 'start', 'reload'):
+                    # One systemctl call may restart several services.
+                    restarts.extend('%s %s' % (args[0], svc)
+                                    for svc in args[1:])
+    return subprocesses, sorted(written), restarts
+
+
+def run_scenario(scenario, python, keep=False):
+    workdir = tempfile.mkdtemp(prefix='heat-hook-bench-')
+    root, charm, bindir, scenario_path = make_sandbox(scenario, workdir,
+                                                      python)
+    results = []
+    seen = {}
+    try:
+        for hook in scenario.get('hooks', DEFAULT_HOOKS):
+            seen[hook] = seen.get(hook, 0) + 1
+            step = hook if seen[hook] == 1 else '%s#%d' % (hook, seen[hook])
+            # hooks/install only bootstraps python deps then runs this.
+            script = 'install.real' if hook == 'install' else hook
+            events = os.path.join(workdir, 'events-%02d.jsonl' % len(results))
+            open(events, 'w').close()
+            env = dict(os.environ)
+            env.update({
+                'PATH': bindir + os.pathsep + os.environ.get('PATH', ''),
+                'CHARM_DIR': charm,
+                'JUJU_CHARM_DIR': charm,
+                'JUJU_UNIT_NAME': scenario.get('unit', 'heat/0'),
+                'JUJU_HOOK_NAME': hook,
+                'JUJU_VERSION': str(scenario.get('juju-version', '2.3.7')),
+                'UNIT_STATE_DB': os.path.join(workdir, 'unit-state.db'),
+                'BENCH_ROOT': root,
+                'BENCH_REPO': REPO,
+                'BENCH_SCENARIO': scenario_path,
+                'BENCH_STATE': os.path.join(workdir, 'state.json'),
+                'BENCH_EVENTS': events,
+            })
+            env.update(hook_context(scenario, hook))
+            started = time.time()
+            proc = subprocess.Popen(
+                [python, os.path.join(HERE, 'hook_shim.py'),
+                 os.path.join(charm, 'hooks', script)],
+                cwd=charm, env=env, stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT)
+            output = proc.communicate()[0]
+            wall = time.time() - started
+            subprocesses, written, restarts = summarise(events)
+            results.append({
+                'step': step,
+                'exit': proc.returncode,
+                'wall': round(wall, 3),
+                'subprocesses': subprocesses,
+                'subprocess_total': sum(subprocesses.values()),
+                'files_written': written,
+                'restarts': restarts,
+            })
+            if proc.returncode:
+                sys.stderr.write('%s failed:\n%s\n' %
+                                 (step, output.decode('utf-8', 'replace')))
+    finally:
+        if keep:
+            sys.stderr.write('Sandbox kept in %s\n' % workdir)
+        else:
+            shutil.rmtree(workdir)
+    return results
+
+
+def compare(results, baseline, tolerance, timing=True):
+    """Returns a list of regressions of results against baseline."""
+    regressions = []
+    previous = dict((r['step'], r) for r in baseline)
+    for result in results:
+        step = result['step']
+        if result['exit']:
+            regressions.append('%s: exited %d' % (step, result['exit']))
+        base = previous.get(step)
+        if base is None:
+            continue
+        for tool, count in sorted(result['subprocesses'].items()):
+            if count > base['subprocesses'].get(tool, 0):
+                regressions.append('%s: %s run %d times (baseline %d)' %
+                                   (step, tool, count,
+                                    base['subprocesses'].get(tool, 0)))
+        new_files = set(result['files_written']) - set(base['files_written'])
+        if new_files:
+            regressions.append('%s: new files written: %s' %
+                               (step, ', '.join(sorted(new_files))))
+        new_restarts = set(result['restarts']) - set(base['restarts'])
+        if new_restarts:
+            regressions.append('%s: new restarts: %s' %
+                               (step, ', '.join(sorted(new_restarts))))
+        if (timing and result['wall'] > base['wall'] * (1 + tolerance) and
+                result['wall'] - base['wall'] > MIN_TIME_DELTA):
+            regressions.append('%s: took %.2fs (baseline %.2fs)' %
+                               (step, result['wall'], base['wall']))
+    return regressions
+
+
+def report(name, results):
+    print('%s' % name)
+    print('  %-40s %8s %6s %6s %8s' % ('hook', 'wall(s)', 'procs', 'files',
+                                       'restarts'))
+    for r in results:
+        print('  %-40s %8.3f %6d %6d %8d' % (
+            r['step'], r['wall'], r['subprocess_total'],
+            len(r['files_written']), len(r['restarts'])))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('scenarios', nargs='*',
+                        help='scenario names or paths (default: all)')
+    parser.add_argument('--python', default=sys.executable,
+                        help='interpreter used to run the hooks')
+    parser.add_argument('--baselines', default=BASELINES,
+                        help='directory holding <scenario>.json baselines')
+    parser.add_argument('--update-baselines', action='store_true',
+                        help='write the results as the new baselines')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='allowed relative wall time increase')
+    parser.add_argument('--no-timing', action='store_true',
+                        help='ignore wall time when comparing')
+    parser.add_argument('--output', help='write all results to this file')
+    parser.add_argument('--keep', action='store_true',
+                        help='keep the sandboxes for inspection')
+    args = parser.parse_args(argv)
+
+    names = args.scenarios or sorted(
+        os.path.splitext(f)[0] for f in os.listdir(SCENARIOS)
+        if f.endswith('.yaml'))
+    failed = False
+    output = {}
+    for name in names:
+        scenario = load_scenario(name)
+        results = run_scenario(scenario, args.python, keep=args.keep)
+        output[scenario['name']] = results
+        report(scenario['name'], results)
+
+        baseline_path = os.path.join(args.baselines,
+                                     '%s.json' % scenario['name'])
+        if args.update_baselines:
+            if not os.path.isdir(args.baselines):
+                os.makedirs(args.baselines)
+            with open(baseline_path, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True,
+                          separators=(',', ': '))
+                f.write('\n')
+            continue
+        baseline = []
+        if os.path.exists(baseline_path):
+            with open(baseline_path) as f:
+                baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance,
+                              timing=not args.no_timing)
+        for regression in regressions:
+            print('  REGRESSION %s' % regression)
+        failed = failed or bool(regressions)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True,
+                      separators=(',', ': '))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Runs a charm hook inside the benchmark sandbox:
+
+    hook_shim.py <path to hook>
+
+Host paths the charm reads and writes (/etc, /var/lib, /run...) are
+redirected under BENCH_ROOT, chown is a no-op, netifaces reports the
+scenario's interfaces, connections to loopback ports succeed as if the
+services fake_tool reports active were listening, and python-apt is
+replaced by a stand-in answering from the scenario's package list when it
+is not installed. Every subprocess started and every file opened for
+writing is appended to BENCH_EVENTS.
+"""
+
+import grp
+import json
+import os
+import pwd
+import runpy
+import subprocess
+import sys
+
+from distutils.version import LooseVersion
+
+import six
+
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+import io
+
+ROOT = os.environ['BENCH_ROOT']
+EVENTS = os.environ['BENCH_EVENTS']
+SANDBOXED = ('/etc/', '/var/', '/run/', '/root/', '/srv/', '/opt/',
+             '/usr/bin/', '/usr/sbin/', '/usr/local/', '/usr/share/',
+             '/usr/lib/')
+# Not redirected: the interpreter's own modules and the charm...
+PASSTHROUGH = [p.rstrip('/') + '/' for p in
+               set([os.path.dirname(os.__file__), os.environ['CHARM_DIR'],
+                    os.environ['BENCH_REPO']] + sys.path) if p]
+# ...unless they hold the packages the charm inspects.
+ALWAYS_SANDBOXED = ('/dist-packages/heat/',)
+
+
+def _event(event):
+    with _open(EVENTS, 'a') as f:
+        f.write(json.dumps(event) + '\n')
+
+
+def _remap(path):
+    if not isinstance(path, six.string_types) or not path.startswith('/'):
+        return path
+    path = os.path.normpath(path)
+    if path.startswith(ROOT + '/') or not path.startswith(SANDBOXED):
+        return path
+    if not any(s in path + '/' for s in ALWAYS_SANDBOXED):
+        for prefix in PASSTHROUGH:
+            if (path + '/').startswith(prefix):
+                return path
+    return ROOT + path
+
+
+def _unmap(path):
+    if path.startswith(ROOT + '/'):
+        return path[len(ROOT):]
+    charm_dir = os.environ['CHARM_DIR']
+    if path.startswith(charm_dir + '/'):
+        return '$CHARM_DIR' + path[len(charm_dir):]
+    return path
+
+
+_open = builtins.open
+_io_open = io.open
+_os_open = os.open
+
+
+def _wrap_open(real):
+    def wrapped(path, mode='r', *args, **kwargs):
+        mapped = _remap(path)
+        if isinstance(mapped, six.string_types) and set(mode) & set('wa+'):
+            _event({'write': _unmap(mapped)})
+        return real(mapped, mode, *args, **kwargs)
+    return wrapped
+
+
+def _wrapped_os_open(path, flags, *args, **kwargs):
+    mapped = _remap(path)
+    if flags & (os.O_TRUNC | os.O_APPEND):
+        _event({'write': _unmap(mapped)})
+    return _os_open(mapped, flags, *args, **kwargs)
+
+
+def _wrap_path_func(real, nargs=1):
+    def wrapped(*args, **kwargs):
+        args = [_remap(a) for a in args[:nargs]] + list(args[nargs:])
+        return real(*args, **kwargs)
+    return wrapped
+
+
+def _noop(*args, **kwargs):
+    return None
+
+
+def _wrap_lookup(real, fallback):
+    # Service users such as heat only exist on a real unit.
+    def wrapped(name):
+        try:
+            return real(name)
+        except KeyError:
+            return fallback()
+    return wrapped
+
+
+class _Popen(subprocess.Popen):
+
+    def __init__(self, args, *pargs, **kwargs):
+        argv = [args] if isinstance(args, six.string_types) else list(args)
+        _event({'exec': os.path.basename(argv[0].split()[0])})
+        super(_Popen, self).__init__(args, *pargs, **kwargs)
+
+
+def install_sandbox():
+    builtins.open = _wrap_open(_open)
+    io.open = _wrap_open(_io_open)
+    os.open = _wrapped_os_open
+    for name in ('stat', 'lstat', 'listdir', 'mkdir', 'makedirs', 'rmdir',
+                 'remove', 'unlink', 'chmod', 'access', 'utime', 'readlink',
+                 'statvfs'):
+        setattr(os, name, _wrap_path_func(getattr(os, name)))
+    for name in ('rename', 'symlink'):
+        setattr(os, name, _wrap_path_func(getattr(os, name), nargs=2))
+    os.chown = _noop
+    os.lchown = _noop
+    pwd.getpwnam = _wrap_lookup(pwd.getpwnam,
+                                lambda: pwd.getpwuid(os.getuid()))
+    grp.getgrnam = _wrap_lookup(grp.getgrnam,
+                                lambda: grp.getgrgid(os.getgid()))
+    subprocess.Popen = _Popen
+
+
+class _AptVersion(object):
+
+    def __init__(self, ver_str):
+        self.ver_str = ver_str
+
+
+class _AptPackage(object):
+
+    def __init__(self, name, version):
+        self.name = name
+        self.current_ver = _AptVersion(version) if version else None
+        self.version_list = [self.current_ver] if version else []
+
+
+class _AptConfig(dict):
+
+    def set(self, key, value):
+        self[key] = value
+
+
+class _AptPkg(object):
+    """Just enough of apt_pkg for the charm, backed by the scenario."""
+
+    config = _AptConfig()
+
+    def __init__(self, packages):
+        self.packages = packages
+
+    def init(self):
+        pass
+
+    def Cache(self, progress=None):
+        return dict((name, _AptPackage(name, version))
+                    for name, version in self.packages.items())
+
+    def DepCache(self, cache):
+        class DepCache(object):
+            def get_candidate_ver(self, pkg):
+                return pkg.current_ver
+        return DepCache()
+
+    @staticmethod
+    def upstream_version(version):
+        version = version.split(':', 1)[-1]
+        return version.rsplit('-', 1)[0]
+
+    @classmethod
+    def version_compare(cls, a, b):
+        a = LooseVersion(cls.upstream_version(a))
+        b = LooseVersion(cls.upstream_version(b))
+        return (a > b) - (a < b)
+
+
+def install_apt(packages):
+    try:
+        import apt_pkg  # noqa
+        return
+    except ImportError:
+        pass
+    import types
+    fake = _AptPkg(packages)
+    apt = types.ModuleType('apt')
+    apt.apt_pkg = fake
+    sys.modules['apt'] = apt
+    sys.modules['apt_pkg'] = fake
+
+
+def install_netifaces(scenario):
+    """Replaces netifaces so address lookups see the scenario's unit."""
+    import types
+    netifaces = types.ModuleType('netifaces')
+    netifaces.AF_LINK, netifaces.AF_INET, netifaces.AF_INET6 = 17, 2, 10
+    interfaces = scenario.get('interfaces') or {
+        'eth0': {'mac': '52:54:00:00:00:01',
+                 'inet': ['%s/255.255.255.0' %
+                          scenario.get('private-address', '10.5.0.10')]}}
+    addresses = {'lo': {netifaces.AF_INET: [{'addr': '127.0.0.1',
+                                             'netmask': '255.0.0.0'}]}}
+    for name, iface in interfaces.items():
+        entry = addresses[name] = {
+            netifaces.AF_LINK: [{'addr': iface.get('mac', '')}]}
+        for family, key in ((netifaces.AF_INET, 'inet'),
+                            (netifaces.AF_INET6, 'inet6')):
+            for cidr in iface.get(key, []):
+                addr, netmask = cidr.split('/')
+                entry.setdefault(family, []).append(
+                    {'addr': addr, 'netmask': netmask})
+    netifaces.interfaces = lambda: sorted(addresses)
+    netifaces.ifaddresses = lambda name: addresses[name]
+    sys.modules['netifaces'] = netifaces
+
+
+def install_sockets():
+    """Makes connections to loopback ports succeed without a listener."""
+    import socket
+    real = socket.create_connection
+
+    class Connection(object):
+        def close(self):
+            pass
+
+    def create_connection(address, *args, **kwargs):
+        if address[0] in ('127.0.0.1', '::1', 'localhost'):
+            return Connection()
+        return real(address, *args, **kwargs)
+    socket.create_connection = create_connection
+
+
+def main():
+    hook = sys.argv[1]
+    with _open(os.environ['BENCH_SCENARIO']) as f:
+        scenario = json.load(f)
+    install_apt(scenario.get('packages', {}))
+    install_netifaces(scenario)
+    install_sockets()
+    install_sandbox()
+    sys.path.insert(0, os.path.dirname(hook))
+    sys.argv = [hook]
+    runpy.run_path(hook, run_name='__main__')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,531 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Load harness for the charm's haproxy and apache frontends.
+
+Starts HTTP stand-ins for heat-api and heat-api-cfn on the ports the
+charm configures them to listen on, puts haproxy (and with --tls apache)
+in front of them using the haproxy.cfg and openstack_https_frontend the
+charm renders, and drives a concurrent request mix through the public
+ports. Reports latency percentiles, queueing and error rates per API.
+
+The stand-ins model a heat API service: --workers processes, each serving
+up to --worker-concurrency requests at a time with --latency ms of work.
+Requests beyond that wait for a free slot; that wait is reported as
+worker queueing, next to the haproxy queue from its stats.
+
+Usage:
+
+    python tests/benchmarks/load_bench.py --workers 4 --clients 64
+    python tests/benchmarks/load_bench.py --tls --maxconn 2000 \\
+        --server-timeout 90000
+
+haproxy and apache2 are started from PATH, unprivileged, with their
+runtime files in a temporary directory. --no-haproxy loads the stand-ins
+(or apache) directly.
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from collections import OrderedDict
+from distutils.spawn import find_executable
+
+from six.moves import BaseHTTPServer, http_client, socketserver
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import render_bench  # noqa: E402
+
+from heat_context import API_PORTS  # noqa: E402
+from heat_utils import (  # noqa: E402
+    HAPROXY_CONF,
+    HTTPS_APACHE_24_CONF,
+)
+
+# haproxy service name for each API, as in HeatHAProxyContext.
+SERVICES = OrderedDict([('heat_api', 'heat-api'),
+                        ('heat_cfn_api', 'heat-api-cfn')])
+
+# (service, path, weight): mostly stack and event polling, as done by
+# clients waiting on stack operations.
+DEFAULT_MIX = [
+    ('heat_api', '/v1/%(tenant)s/stacks', 50),
+    ('heat_api', '/v1/%(tenant)s/stacks/stack-%(n)d/events', 35),
+    ('heat_api', '/v1/%(tenant)s/stacks/stack-%(n)d/resources', 10),
+    ('heat_cfn_api', '/v1/?Action=DescribeStacks', 5),
+]
+
+APACHE_MODULES = ['mpm_event', 'authz_core', 'access_compat', 'ssl',
+                  'socache_shmcb', 'proxy', 'proxy_http', 'headers']
+STAT_PORT = 8888
+STAT_PASSWORD = 'statpass'
+
+
+def ports(haproxy, tls):
+    """Returns {service: (public, apache, api)} ports.
+
+    Every layer in front of the API takes the next port 10 below the
+    public one, as determine_apache_port and determine_api_port do.
+    """
+    result = OrderedDict()
+    for service, name in SERVICES.items():
+        public = API_PORTS[name]
+        apache = public - 10 * int(haproxy)
+        result[service] = (public, apache, apache - 10 * int(tls))
+    return result
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        queued = time.time()
+        with server.slots:
+            waited = time.time() - queued
+            time.sleep(max(0, random.gauss(server.latency, server.jitter)))
+        body = json.dumps({'path': self.path}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Queue-Time', '%.6f' % waited)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+def start_stand_in(port, workers, concurrency, latency, jitter):
+    """Forks the worker processes of one API stand-in, sharing a socket."""
+    server = StandInServer(('127.0.0.1', port), StandInHandler)
+    server.latency = latency / 1000.0
+    server.jitter = jitter / 1000.0
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            random.seed()
+            server.slots = threading.Semaphore(concurrency)
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    server.server_close()
+    return pids
+
+
+def _has_ipv6():
+    try:
+        s = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+        s.bind(('::1', 0))
+        s.close()
+        return True
+    except (socket.error, AttributeError):
+        return False
+
+
+def render_haproxy(workdir, layout, args):
+    """Renders haproxy.cfg from the charm template for this host."""
+    ctxt = render_bench.synthetic_context(rabbit_hosts=1, backends=0,
+                                          config_flags=0)
+    ctxt.update({
+        'local_host': '127.0.0.1',
+        'stat_port': str(STAT_PORT),
+        'stat_password': STAT_PASSWORD,
+        'service_ports': OrderedDict(
+            (service, [public, apache])
+            for service, (public, apache, _) in layout.items()),
+        'frontends': {'127.0.0.1': {'network': '127.0.0.0/8',
+                                    'backends': {'heat-0': '127.0.0.1'}}},
+        'default_backend': '127.0.0.1',
+        'haproxy_queue_timeout': args.queue_timeout,
+        'haproxy_connect_timeout': args.connect_timeout,
+        'haproxy_client_timeout': args.client_timeout,
+        'haproxy_server_timeout': args.server_timeout,
+    })
+    config = render_bench.renderer(args.release, ctxt).render(HAPROXY_CONF)
+
+    # Run unprivileged: no syslog, user switch or system stats socket.
+    lines = []
+    for line in config.splitlines():
+        words = line.split()
+        if words[:1] in (['log'], ['user'], ['group']):
+            continue
+        if words[:1] == ['bind'] and words[1].startswith(':::') and \
+                not _has_ipv6():
+            continue
+        if words[:2] == ['stats', 'socket']:
+            line = '    stats socket %s mode 600 level admin' % (
+                os.path.join(workdir, 'haproxy.sock'))
+        elif words[:1] == ['maxconn'] and args.maxconn:
+            line = '    maxconn %d' % args.maxconn
+        lines.append(line)
+    path = os.path.join(workdir, 'haproxy.cfg')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+
+def render_apache(workdir, layout, args):
+    """Renders the charm's https frontend and a main config around it."""
+    ssl_dir = os.path.join(workdir, 'ssl')
+    os.makedirs(os.path.join(ssl_dir, 'heat'))
+    cert = os.path.join(ssl_dir, 'heat', 'cert_localhost')
+    key = os.path.join(ssl_dir, 'heat', 'key_localhost')
+    subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048',
+                           '-nodes', '-days', '1', '-subj', '/CN=localhost',
+                           '-keyout', key, '-out', cert],
+                          stdout=open(os.devnull, 'w'),
+                          stderr=subprocess.STDOUT)
+
+    ctxt = render_bench.synthetic_context(rabbit_hosts=1, backends=0,
+                                          config_flags=0)
+    ctxt.update({
+        'namespace': 'heat',
+        'endpoints': [('127.0.0.1', 'localhost', apache, api)
+                      for _, apache, api in layout.values()],
+        'ext_ports': [apache for _, apache, _ in layout.values()],
+    })
+    site = render_bench.renderer(args.release, ctxt).render(
+        HTTPS_APACHE_24_CONF)
+    # The stand-ins only listen on IPv4 loopback.
+    site = site.replace('/etc/apache2/ssl/', ssl_dir + '/').replace(
+        'http://localhost:', 'http://127.0.0.1:')
+    site_path = os.path.join(workdir, 'openstack_https_frontend.conf')
+    with open(site_path, 'w') as f:
+        f.write(site)
+
+    path = os.path.join(workdir, 'apache2.conf')
+    with open(path, 'w') as f:
+        f.write('ServerRoot %s\n' % workdir)
+        f.write('Define APACHE_RUN_DIR %s\n' % workdir)
+        f.write('DefaultRuntimeDir %s\n' % workdir)
+        f.write('PidFile %s\n' % os.path.join(workdir, 'apache2.pid'))
+        f.write('ErrorLog %s\n' % os.path.join(workdir, 'apache2.log'))
+        f.write('ServerName localhost\n')
+        for module in APACHE_MODULES:
+            f.write('LoadModule %s_module %s/mod_%s.so\n' %
+                    (module, args.apache_modules, module))
+        f.write('Include %s\n' % site_path)
+    return path
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except socket.error:
+            time.sleep(0.05)
+    raise RuntimeError('nothing listening on port %d' % port)
+
+
+class Client(threading.Thread):
+    """Sends requests from the mix until the deadline."""
+
+    def __init__(self, layout, mix, deadline, tls, keepalive, timeout,
+                 seed):
+        super(Client, self).__init__()
+        self.daemon = True
+        self.layout = layout
+        self.mix = mix
+        self.deadline = deadline
+        self.tls = tls
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.samples = []
+
+    def connection(self, port):
+        if self.tls:
+            return http_client.HTTPSConnection(
+                '127.0.0.1', port, timeout=self.timeout,
+                context=ssl._create_unverified_context())
+        return http_client.HTTPConnection('127.0.0.1', port,
+                                          timeout=self.timeout)
+
+    def pick(self):
+        total = sum(weight for _, _, weight in self.mix)
+        n = self.random.uniform(0, total)
+        for service, path, weight in self.mix:
+            n -= weight
+            if n <= 0:
+                break
+        return service, path % {'tenant': 'tenant-%d' % self.random.randint(
+            0, 9), 'n': self.random.randint(0, 99)}
+
+    def run(self):
+        connections = {}
+        while time.time() < self.deadline:
+            service, path = self.pick()
+            port = self.layout[service]
+            start = time.time()
+            sample = {'service': service, 'status': None, 'queue': None}
+            try:
+                conn = connections.get(service) or self.connection(port)
+                conn.request('GET', path)
+                response = conn.getresponse()
+                response.read()
+                sample['status'] = response.status
+                queue = response.getheader('X-Queue-Time')
+                if queue:
+                    sample['queue'] = float(queue)
+                if self.keepalive:
+                    connections[service] = conn
+                else:
+                    conn.close()
+            except (socket.error, http_client.HTTPException,
+                    ssl.SSLError) as e:
+                sample['error'] = e.__class__.__name__
+                connections.pop(service, None)
+            sample['latency'] = time.time() - start
+            self.samples.append(sample)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def haproxy_stats():
+    """Returns {backend: stats row} from the haproxy stats page."""
+    conn = http_client.HTTPConnection('127.0.0.1', STAT_PORT, timeout=5)
+    auth = base64.b64encode(
+        ('admin:%s' % STAT_PASSWORD).encode('utf-8')).decode('ascii')
+    conn.request('GET', '/;csv', headers={'Authorization': 'Basic ' + auth})
+    body = conn.getresponse().read().decode('utf-8')
+    conn.close()
+    lines = body.splitlines()
+    header = lines[0].lstrip('# ').split(',')
+    stats = {}
+    for line in lines[1:]:
+        row = dict(zip(header, line.split(',')))
+        if row.get('svname') == 'BACKEND':
+            stats[row['pxname']] = row
+    return stats
+
+
+def summarise(samples, duration, stats):
+    results = OrderedDict()
+    for service in list(SERVICES) + ['all']:
+        mine = [s for s in samples
+                if service == 'all' or s['service'] == service]
+        if not mine:
+            continue
+        latency = [s['latency'] * 1000 for s in mine]
+        queue = [s['queue'] * 1000 for s in mine if s['queue'] is not None]
+        errors = [s for s in mine
+                  if 'error' in s or (s['status'] or 0) >= 500]
+        result = OrderedDict([
+            ('requests', len(mine)),
+            ('rps', len(mine) / duration),
+            ('p50_ms', percentile(latency, 0.5)),
+            ('p90_ms', percentile(latency, 0.9)),
+            ('p99_ms', percentile(latency, 0.99)),
+            ('max_ms', max(latency)),
+            ('worker_queue_p50_ms', percentile(queue, 0.5)),
+            ('worker_queue_p99_ms', percentile(queue, 0.99)),
+            ('error_rate', float(len(errors)) / len(mine)),
+        ])
+        backends = [row for name, row in stats.items()
+                    if service == 'all' or name.startswith(service + '_')]
+        if backends:
+            result['haproxy_qmax'] = max(int(row.get('qmax') or 0)
+                                         for row in backends)
+            result['haproxy_qtime_ms'] = max(int(row.get('qtime') or 0)
+                                             for row in backends)
+        results[service] = result
+    return results
+
+
+def report(results):
+    print('  %-14s %8s %8s %8s %8s %8s %9s %9s %7s %6s' % (
+        'api', 'requests', 'rps', 'p50(ms)', 'p99(ms)', 'max(ms)',
+        'wq50(ms)', 'wq99(ms)', 'errors', 'qmax'))
+    for service, r in results.items():
+        print('  %-14s %8d %8.1f %8.1f %8.1f %8.1f %9s %9s %6.2f%% %6s' % (
+            service, r['requests'], r['rps'], r['p50_ms'], r['p99_ms'],
+            r['max_ms'],
+            '-' if r['worker_queue_p50_ms'] is None
+            else '%.1f' % r['worker_queue_p50_ms'],
+            '-' if r['worker_queue_p99_ms'] is None
+            else '%.1f' % r['worker_queue_p99_ms'],
+            r['error_rate'] * 100, r.get('haproxy_qmax', '-')))
+
+
+def _stop(procs, pids):
+    for proc in procs:
+        if proc.poll() is None:
+            proc.terminate()
+            proc.wait()
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        except OSError:
+            pass
+
+
+def run(args):
+    haproxy = not args.no_haproxy
+    layout = ports(haproxy, args.tls)
+    workdir = tempfile.mkdtemp(prefix='heat-load-bench-')
+    procs = []
+    pids = []
+    try:
+        for service, (_, _, api) in layout.items():
+            pids.extend(start_stand_in(api, args.workers,
+                                       args.worker_concurrency,
+                                       args.latency, args.jitter))
+        if args.tls:
+            conf = render_apache(workdir, layout, args)
+            procs.append(subprocess.Popen([args.apache, '-f', conf, '-d',
+                                           workdir, '-DFOREGROUND']))
+        if haproxy:
+            conf = render_haproxy(workdir, layout, args)
+            procs.append(subprocess.Popen([args.haproxy, '-f', conf,
+                                           '-db']))
+        for public, apache, api in layout.values():
+            for port in set([public, apache, api]):
+                wait_for_port(port)
+
+        targets = dict((service, public)
+                       for service, (public, _, _) in layout.items())
+        deadline = time.time() + args.duration
+        clients = [Client(targets, DEFAULT_MIX, deadline, args.tls,
+                          args.keepalive, args.client_request_timeout,
+                          seed=n)
+                   for n in range(args.clients)]
+        start = time.time()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        duration = time.time() - start
+        stats = haproxy_stats() if haproxy else {}
+    finally:
+        _stop(procs, pids)
+        if args.keep:
+            print('Kept %s' % workdir)
+        else:
+            shutil.rmtree(workdir)
+
+    samples = []
+    for client in clients:
+        samples.extend(client.samples)
+    return summarise(samples, duration, stats)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, default=4,
+                        help='worker processes per API (heat.conf workers)')
+    parser.add_argument('--worker-concurrency', type=int, default=10,
+                        help='requests one worker serves at a time')
+    parser.add_argument('--latency', type=float, default=20,
+                        help='mean time a request takes in a worker (ms)')
+    parser.add_argument('--jitter', type=float, default=5,
+                        help='standard deviation of --latency (ms)')
+    parser.add_argument('--maxconn', type=int,
+                        help='haproxy global maxconn (default: as rendered)')
+    parser.add_argument('--queue-timeout', type=int,
+                        help='haproxy-queue-timeout (ms)')
+    parser.add_argument('--connect-timeout', type=int,
+                        help='haproxy-connect-timeout (ms)')
+    parser.add_argument('--client-timeout', type=int,
+                        help='haproxy-client-timeout (ms)')
+    parser.add_argument('--server-timeout', type=int,
+                        help='haproxy-server-timeout (ms)')
+    parser.add_argument('--tls', action='store_true',
+                        help='put the apache https frontend behind haproxy')
+    parser.add_argument('--no-haproxy', action='store_true',
+                        help='send requests to apache or the stand-ins')
+    parser.add_argument('--clients', type=int, default=32,
+                        help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds to send requests for')
+    parser.add_argument('--keepalive', action='store_true',
+                        help='reuse client connections between requests')
+    parser.add_argument('--client-request-timeout', type=float, default=60,
+                        help='client side request timeout (s)')
+    parser.add_argument('--release', default=render_bench.RELEASES[-1],
+                        choices=render_bench.RELEASES,
+                        help='release whose templates are rendered')
+    parser.add_argument('--haproxy', default=find_executable('haproxy'),
+                        help='haproxy binary')
+    parser.add_argument('--apache', default=find_executable('apache2'),
+                        help='apache2 binary')
+    parser.add_argument('--apache-modules',
+                        default='/usr/lib/apache2/modules',
+                        help='directory holding the apache modules')
+    parser.add_argument('--max-error-rate', type=float, default=0.01,
+                        help='fail above this error rate')
+    parser.add_argument('--max-p99', type=float,
+                        help='fail above this p99 latency (ms)')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--keep', action='store_true',
+                        help='keep the rendered configs and logs')
+    args = parser.parse_args(argv)
+    if not args.no_haproxy and not args.haproxy:
+        parser.error('haproxy not found; pass --haproxy or --no-haproxy')
+    if args.tls and not args.apache:
+        parser.error('apache2 not found; pass --apache')
+
+    # OSConfigRenderer logs through juju-log, which is not available here.
+    render_bench.templating.log = lambda *args, **kwargs: None
+
+    results = run(args)
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'settings': vars(args), 'results': results}, f,
+                      indent=2, separators=(',', ': '))
+
+    overall = results['all']
+    failed = overall['error_rate'] > args.max_error_rate
+    if args.max_p99 is not None and overall['p99_ms'] > args.max_p99:
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
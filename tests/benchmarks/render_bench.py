@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Config rendering benchmark.
+
+Renders every file in heat_utils.CONFIG_FILES through OSConfigRenderer for
+every OpenStack release from icehouse to the newest known codename, using
+synthetic contexts of increasing size (rabbit hosts, haproxy backends and
+config-flags). For every file it reports the first render (template
+loading and compilation included), the median of the following renders,
+the peak RSS growth while rendering and the bytes produced.
+
+The output of the golden size is compared against golden/<release>/<file>.
+
+Usage:
+
+    python tests/benchmarks/render_bench.py [--release R] [--size S]
+    python tests/benchmarks/render_bench.py --update-golden
+
+Exits non-zero if any output differs from its golden copy.
+"""
+
+import argparse
+import io
+import json
+import os
+import resource
+import sys
+import time
+
+from collections import OrderedDict
+
+import six
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(os.path.dirname(HERE))
+GOLDEN = os.path.join(HERE, 'golden')
+TEMPLATES = os.path.join(REPO, 'templates')
+
+sys.path.insert(0, os.path.join(REPO, 'hooks'))
+
+from charmhelpers.contrib.openstack import (  # noqa: E402
+    context,
+    templating,
+)
+from charmhelpers.contrib.openstack.utils import (  # noqa: E402
+    OPENSTACK_CODENAMES,
+)
+
+import heat_utils  # noqa: E402
+from heat_context import API_PORTS  # noqa: E402
+
+FIRST_RELEASE = 'icehouse'
+RELEASES = list(OPENSTACK_CODENAMES.values())
+RELEASES = RELEASES[RELEASES.index(FIRST_RELEASE):]
+
+# Number of rabbit hosts, haproxy backends and config-flags per size.
+SIZES = OrderedDict([
+    ('small', {'rabbit_hosts': 3, 'backends': 3, 'config_flags': 3}),
+    ('medium', {'rabbit_hosts': 20, 'backends': 20, 'config_flags': 50}),
+    ('large', {'rabbit_hosts': 100, 'backends': 100, 'config_flags': 400}),
+])
+GOLDEN_SIZE = 'small'
+
+
+class StaticContext(context.OSContextGenerator):
+    """Context generator returning a fixed context."""
+    interfaces = []
+
+    def __init__(self, ctxt):
+        self.ctxt = ctxt
+
+    def __call__(self):
+        return self.ctxt
+
+
+def synthetic_context(rabbit_hosts, backends, config_flags):
+    """Returns one context satisfying every template in CONFIG_FILES.
+
+    Values follow what the charm's context generators produce for a
+    clustered unit with the given number of rabbit hosts, haproxy backends
+    and config-flags.
+    """
+    address = '10.5.0.10'
+    service_ports = OrderedDict()
+    endpoints = []
+    for name, port in sorted(API_PORTS.items()):
+        service = 'heat_api' if name == 'heat-api' else 'heat_cfn_api'
+        service_ports[service] = [port, port - 10]
+        endpoints.append((address, address, port, port - 10))
+    unit_backends = OrderedDict(
+        ('heat-%d' % i, '10.5.%d.%d' % (i // 250, 10 + i % 250))
+        for i in range(backends))
+    return {
+        # heat.conf
+        'use_syslog': False,
+        'debug': False,
+        'verbose': False,
+        'instance_user': 'ec2-user',
+        'encryption_key': 'e1c5c2a3b4f64b0d',
+        'heat_domain_admin_passwd': 'domainpass',
+        'workers': 4,
+        'engine_role': True,
+        'bind_host': '0.0.0.0',
+        'use_internal_endpoints': True,
+        'user_config_flags': OrderedDict(
+            ('flag_%03d' % i, 'value-%d' % i) for i in range(config_flags)),
+        # shared-db
+        'database_type': 'mysql',
+        'database_host': '10.5.100.2',
+        'database_user': 'heat',
+        'database_password': 'dbpass',
+        'database': 'heat',
+        # amqp
+        'rabbitmq_user': 'heat',
+        'rabbitmq_virtual_host': 'openstack',
+        'rabbitmq_password': 'rabbitpass',
+        'rabbitmq_hosts': ','.join('10.5.1.%d' % (i + 20)
+                                   for i in range(rabbit_hosts)),
+        'rabbitmq_ha_queues': True,
+        # identity-service
+        'service_protocol': 'http',
+        'service_host': '10.5.0.40',
+        'service_port': '5000',
+        'service_admin_prefix': 'v2.0',
+        'auth_protocol': 'http',
+        'auth_host': '10.5.0.40',
+        'auth_port': '35357',
+        'api_version': '3',
+        'admin_tenant_name': 'services',
+        'admin_user': 'heat',
+        'admin_password': 'keystonepass',
+        'admin_domain_name': 'service_domain',
+        'signing_dir': '/var/cache/heat',
+        'region': 'RegionOne',
+        'keystone_ec2_url': 'http://10.5.0.40:5000/v2.0/ec2tokens',
+        # memcache
+        'use_memcache': True,
+        'memcache_server': '::1',
+        'memcache_port': '11211',
+        'memcache_server_formatted': '[::1]',
+        'memcache_url': 'inet6:[::1]:11211',
+        'memcache_memory': 256,
+        'memcache_connections': 1024,
+        'memcache_threads': 4,
+        'memcache_pool_maxsize': 10,
+        # haproxy
+        'local_host': '127.0.0.1',
+        'stat_port': '8888',
+        'stat_password': 'statpass',
+        'service_ports': service_ports,
+        'api_listen_port': API_PORTS['heat-api'] - 20,
+        'api_cfn_listen_port': API_PORTS['heat-api-cfn'] - 20,
+        'frontends': {address: {'network': '%s/24' % address,
+                                'backends': unit_backends}},
+        'default_backend': address,
+        # apache
+        'namespace': 'heat',
+        'endpoints': endpoints,
+        'ext_ports': sorted(API_PORTS.values()),
+        'mpm_server_limit': 8,
+        'mpm_threads_per_child': 25,
+        'mpm_max_request_workers': 200,
+        'mpm_min_spare_threads': 25,
+        'mpm_max_spare_threads': 75,
+        'keepalive_timeout': 10,
+        'keepalive_max_requests': 1000,
+        'ssl_session_cache_size': 1024000,
+        'ssl_session_cache_timeout': 600,
+        'ssl_stapling': False,
+        'proxy_pool_max': 25,
+        'proxy_pool_ttl': 60,
+        'http2': True,
+    }
+
+
+def renderer(release, ctxt):
+    configs = templating.OSConfigRenderer(templates_dir=TEMPLATES,
+                                          openstack_release=release)
+    for config_file in heat_utils.CONFIG_FILES:
+        configs.register(config_file, [StaticContext(ctxt)])
+    return configs
+
+
+def _measure(release, ctxt, config_file, iterations):
+    """Renders config_file and returns its measurements.
+
+    Runs in a forked child so that each file starts from the same memory
+    and template cache state.
+    """
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    configs = renderer(release, ctxt)
+    start = time.time()
+    output = configs.render(config_file)
+    first = time.time() - start
+    times = []
+    for _ in range(iterations):
+        start = time.time()
+        configs.render(config_file)
+        times.append(time.time() - start)
+    times.sort()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if not isinstance(output, six.text_type):
+        output = output.decode('utf-8')
+    return {
+        'first': first,
+        'median': times[len(times) // 2] if times else first,
+        'rss_kb': rss_after - rss_before,
+        'bytes': len(output.encode('utf-8')),
+        'output': output,
+    }
+
+
+def measure(release, ctxt, config_file, iterations):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        code = 0
+        try:
+            result = _measure(release, ctxt, config_file, iterations)
+        except Exception as e:
+            result = {'error': '%s: %s' % (e.__class__.__name__, e)}
+            code = 1
+        with os.fdopen(write_fd, 'w') as f:
+            json.dump(result, f)
+        os._exit(code)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        result = json.load(f)
+    os.waitpid(pid, 0)
+    return result
+
+
+def golden_path(golden, release, config_file):
+    return os.path.join(golden, release, os.path.basename(config_file))
+
+
+def check_golden(golden, release, config_file, output, update=False):
+    """Returns a description of the difference from the golden copy."""
+    path = golden_path(golden, release, config_file)
+    if update:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(output)
+        return None
+    if not os.path.exists(path):
+        return '%s: no golden copy' % path
+    with io.open(path, encoding='utf-8') as f:
+        expected = f.read()
+    if output == expected:
+        return None
+    out_lines = output.splitlines()
+    exp_lines = expected.splitlines()
+    for n, (got, want) in enumerate(zip(out_lines, exp_lines)):
+        if got != want:
+            return '%s:%d: %r != %r' % (path, n + 1, got, want)
+    return '%s: %d lines, golden copy has %d' % (path, len(out_lines),
+                                                 len(exp_lines))
+
+
+def report(results):
+    print('  %-10s %-7s %-30s %9s %9s %8s %8s' % (
+        'release', 'size', 'file', 'first(ms)', 'warm(ms)', 'rss(KiB)',
+        'bytes'))
+    for r in results:
+        if 'error' in r:
+            print('  %-10s %-7s %-30s %s' % (r['release'], r['size'],
+                                             os.path.basename(r['file']),
+                                             r['error']))
+            continue
+        print('  %-10s %-7s %-30s %9.2f %9.3f %8d %8d' % (
+            r['release'], r['size'], os.path.basename(r['file']),
+            r['first'] * 1000,
+            r['median'] * 1000, r['rss_kb'], r['bytes']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--release', action='append', choices=RELEASES,
+                        help='release to render (default: all)')
+    parser.add_argument('--size', action='append', choices=list(SIZES),
+                        help='context size to render (default: all)')
+    parser.add_argument('--iterations', type=int, default=20,
+                        help='renders timed after the first one')
+    parser.add_argument('--golden', default=GOLDEN,
+                        help='directory holding <release>/<file> copies')
+    parser.add_argument('--update-golden', action='store_true',
+                        help='write the outputs as the new golden copies')
+    parser.add_argument('--output', help='write all results to this file')
+    args = parser.parse_args(argv)
+
+    # OSConfigRenderer logs through juju-log, which is not available here.
+    templating.log = lambda *args, **kwargs: None
+
+    results = []
+    failures = []
+    for release in args.release or RELEASES:
+        for size in args.size or list(SIZES):
+            ctxt = synthetic_context(**SIZES[size])
+            for config_file in heat_utils.CONFIG_FILES:
+                result = measure(release, ctxt, config_file, args.iterations)
+                result.update(release=release, size=size,
+                              file=config_file)
+                output = result.pop('output', None)
+                if 'error' in result:
+                    failures.append('%s %s: %s' % (release, config_file,
+                                                   result['error']))
+                elif size == GOLDEN_SIZE:
+                    failure = check_golden(args.golden, release, config_file,
+                                           output, update=args.update_golden)
+                    if failure:
+                        failures.append(failure)
+                results.append(result)
+    report(results)
+    for failure in failures:
+        print('  FAILED %s' % failure)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True,
+                      separators=(',', ': '))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
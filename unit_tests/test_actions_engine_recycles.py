@@ -0,0 +1,52 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import engine_recycles
+
+from test_utils import (
+    CharmTestCase
+)
+
+TO_PATCH = [
+    'action_set',
+    'kv',
+]
+
+
+class TestEngineRecyclesActions(CharmTestCase):
+
+    def setUp(self):
+        super(TestEngineRecyclesActions, self).setUp(engine_recycles,
+                                                     TO_PATCH)
+
+    def test_engine_recycles(self):
+        self.kv.return_value.get.return_value = [
+            {'time': 1476871200, 'reason': 'rss', 'rss_before': 3500,
+             'max_rss_before': 3000, 'rss_after': 400},
+            {'time': 1476957600, 'reason': 'schedule', 'rss_before': 900,
+             'max_rss_before': 500, 'rss_after': 400},
+        ]
+        engine_recycles.engine_recycles()
+        self.action_set.assert_called_once_with({
+            'count': 2,
+            'recycles': '2016-10-19T10:00:00Z rss: 3500MB before (largest '
+                        'process 3000MB), 400MB after\n'
+                        '2016-10-20T10:00:00Z schedule: 900MB before '
+                        '(largest process 500MB), 400MB after'})
+
+    def test_engine_recycles_none(self):
+        self.kv.return_value.get.return_value = []
+        engine_recycles.engine_recycles()
+        self.action_set.assert_called_once_with({'count': 0,
+                                                 'recycles': ''})
@@ -29,7 +29,8 @@ with patch('charmhelpers.contrib.hardening.harden.harden') as mock_dec:
     mock_dec.side_effect = (lambda *dargs, **dkwargs: lambda f:
                             lambda *args, **kwargs: f(*args, **kwargs))
     with patch('heat_utils.register_configs') as register_configs:
-        import openstack_upgrade
+        with patch('heat_utils.restart_map'):
+            import openstack_upgrade
 
 from test_utils import (
     CharmTestCase
@@ -38,6 +39,8 @@ from test_utils import (
 TO_PATCH = [
     'config_changed',
     'do_openstack_upgrade',
+    'get_configs',
+    'restart_pending_services',
 ]
 
 
@@ -62,6 +65,7 @@ class TestHeatUpgradeActions(CharmTestCase):
 
         self.assertTrue(self.do_openstack_upgrade.called)
         self.assertTrue(self.config_changed.called)
+        self.assertTrue(self.restart_pending_services.called)
 
     @patch('charmhelpers.contrib.openstack.utils.juju_log')
     @patch('charmhelpers.contrib.openstack.utils.config')
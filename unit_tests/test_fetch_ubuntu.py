@@ -0,0 +1,194 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from mock import patch, call, MagicMock
+from test_utils import CharmTestCase
+
+from charmhelpers.core import unitdata
+from charmhelpers.fetch import ubuntu
+
+TO_PATCH = [
+    'log',
+    'time',
+]
+
+
+def locked():
+    return IOError(errno.EAGAIN, 'Resource temporarily unavailable')
+
+
+class DpkgLockTests(CharmTestCase):
+
+    def setUp(self):
+        super(DpkgLockTests, self).setUp(ubuntu, TO_PATCH)
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.lock = os.path.join(tmp, 'lock')
+        open(self.lock, 'w').close()
+        locks = patch.object(ubuntu, 'DPKG_LOCKS',
+                             (self.lock, os.path.join(tmp, 'missing')))
+        locks.start()
+        self.addCleanup(locks.stop)
+        self.time.time.return_value = 1000
+
+    def test_wait_for_dpkg_lock_free(self):
+        self.assertEqual(ubuntu._wait_for_dpkg_lock(), 0)
+        self.assertFalse(self.time.sleep.called)
+
+    @patch('fcntl.lockf')
+    def test_wait_for_dpkg_lock_held(self, lockf):
+        # Held twice, then taken and released.
+        lockf.side_effect = [locked(), locked(), None, None]
+        self.time.time.side_effect = [1000, 1000, 1001, 1001]
+        self.assertEqual(ubuntu._wait_for_dpkg_lock(), 1)
+        self.assertEqual(self.time.sleep.call_args_list,
+                         [call(ubuntu.DPKG_LOCK_POLL)] * 2)
+
+    @patch('fcntl.lockf')
+    def test_wait_for_dpkg_lock_timeout(self, lockf):
+        lockf.side_effect = locked()
+        self.time.time.side_effect = [1000, 1000, 1005, 1010, 1010]
+        self.assertEqual(ubuntu._wait_for_dpkg_lock(timeout=10), 10)
+        self.assertEqual(self.time.sleep.call_count, 2)
+        self.assertTrue(any(c[1].get('level') == ubuntu.WARNING
+                            for c in self.log.call_args_list))
+
+    @patch.object(ubuntu, '_wait_for_dpkg_lock')
+    @patch('subprocess.check_call')
+    def test_lock_timeout_shared_by_retries(self, check_call, wait):
+        check_call.side_effect = [
+            subprocess.CalledProcessError(ubuntu.APT_NO_LOCK, 'apt-get'),
+            subprocess.CalledProcessError(ubuntu.APT_NO_LOCK, 'apt-get'),
+            0]
+        self.time.time.side_effect = [1000, 1000, 1200, 1400]
+        ubuntu._run_with_retries(['apt-get', 'install'],
+                                 retry_exitcodes=(1, ubuntu.APT_NO_LOCK),
+                                 wait_for_lock=True)
+        self.assertEqual(wait.call_args_list,
+                         [call(300), call(100), call(0)])
+        # Lock failures go straight back to waiting on the lock.
+        self.assertFalse(self.time.sleep.called)
+
+    @patch.object(ubuntu, '_wait_for_dpkg_lock')
+    @patch('subprocess.check_call')
+    def test_lock_retries_bounded(self, check_call, wait):
+        check_call.side_effect = subprocess.CalledProcessError(
+            ubuntu.APT_NO_LOCK, 'apt-get')
+        with self.assertRaises(subprocess.CalledProcessError):
+            ubuntu._run_with_retries(['apt-get', 'install'],
+                                     retry_exitcodes=(1, ubuntu.APT_NO_LOCK),
+                                     wait_for_lock=True)
+        self.assertEqual(check_call.call_count, ubuntu.CMD_RETRY_COUNT + 1)
+
+    @patch.object(ubuntu, '_retry_delay')
+    @patch('subprocess.check_call')
+    def test_backoff(self, check_call, retry_delay):
+        check_call.side_effect = [subprocess.CalledProcessError(1, 'apt'),
+                                  subprocess.CalledProcessError(1, 'apt'),
+                                  0]
+        retry_delay.side_effect = [0.5, 1.5]
+        ubuntu._run_with_retries(['apt-get', 'update'])
+        self.assertEqual(retry_delay.call_args_list, [call(1), call(2)])
+        self.assertEqual(self.time.sleep.call_args_list,
+                         [call(0.5), call(1.5)])
+
+    def test_retry_delay(self):
+        for retry, (low, high) in enumerate([(0.5, 1), (1, 2), (2, 4),
+                                             (4, 8), (5, 10), (5, 10)], 1):
+            delay = ubuntu._retry_delay(retry)
+            self.assertTrue(low <= delay <= high, (retry, delay))
+
+
+class InstalledVersionTests(CharmTestCase):
+
+    def setUp(self):
+        super(InstalledVersionTests, self).setUp(ubuntu, ['apt_cache'])
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.db = unitdata.Storage(os.path.join(tmp, 'state.db'))
+        self.addCleanup(self.db.close)
+        kv = patch.object(unitdata, 'kv', return_value=self.db)
+        kv.start()
+        self.addCleanup(kv.stop)
+
+        self.status = os.path.join(tmp, 'status')
+        with open(self.status, 'w') as f:
+            f.write('Package: heat-common\n')
+        os.utime(self.status, (1000, 1000))
+        status = patch.object(ubuntu, 'DPKG_STATUS', self.status)
+        status.start()
+        self.addCleanup(status.stop)
+
+        apt_pkg = MagicMock()
+        apt_pkg.upstream_version.side_effect = lambda v: v.split('-')[0]
+        modules = patch.dict(sys.modules, {'apt_pkg': apt_pkg})
+        modules.start()
+        self.addCleanup(modules.stop)
+
+        self.packages = {'heat-common': self.package('1:9.0.0-0ubuntu1'),
+                         'heat-engine': self.package(None)}
+        self.apt_cache.side_effect = lambda: dict(self.packages)
+
+    def package(self, version):
+        pkg = MagicMock()
+        if version is None:
+            pkg.current_ver = None
+        else:
+            pkg.current_ver.ver_str = version
+        return pkg
+
+    def test_installed_version(self):
+        self.assertEqual(ubuntu.get_installed_version('heat-common'),
+                         {'version': '1:9.0.0-0ubuntu1',
+                          'upstream': '1:9.0.0'})
+        self.assertEqual(ubuntu.get_upstream_version('heat-common'),
+                         '1:9.0.0')
+        self.apt_cache.assert_called_once_with()
+
+    def test_not_installed(self):
+        self.assertEqual(ubuntu.get_installed_version('heat-engine'),
+                         {'version': None, 'upstream': None})
+        self.assertIsNone(ubuntu.get_upstream_version('heat-engine'))
+        self.apt_cache.assert_called_once_with()
+
+    def test_unknown_package(self):
+        self.assertRaises(KeyError, ubuntu.get_installed_version, 'heat-x')
+        self.assertIsNone(ubuntu.get_upstream_version('heat-x'))
+        self.apt_cache.assert_called_once_with()
+
+    def test_invalidated_when_dpkg_status_mtime_changes(self):
+        ubuntu.get_installed_version('heat-common')
+        self.packages['heat-common'] = self.package('1:10.0.0-0ubuntu1')
+        os.utime(self.status, (1010, 1010))
+        self.assertEqual(ubuntu.get_upstream_version('heat-common'),
+                         '1:10.0.0')
+        self.assertEqual(self.apt_cache.call_count, 2)
+
+    def test_invalidated_when_dpkg_status_size_changes(self):
+        ubuntu.get_installed_version('heat-engine')
+        self.packages['heat-engine'] = self.package('1:9.0.0-0ubuntu1')
+        with open(self.status, 'a') as f:
+            f.write('Package: heat-engine\n')
+        # Rewritten within the same mtime granularity.
+        os.utime(self.status, (1000, 1000))
+        self.assertEqual(ubuntu.get_upstream_version('heat-engine'),
+                         '1:9.0.0')
+        self.assertEqual(self.apt_cache.call_count, 2)
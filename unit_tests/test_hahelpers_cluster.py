@@ -0,0 +1,153 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import subprocess
+
+from mock import patch
+from test_utils import CharmTestCase
+
+from charmhelpers.core import decorators, hookenv
+from charmhelpers.contrib.hahelpers import cluster
+
+TO_PATCH = [
+    'get_unit_hostname',
+    'juju_is_leader',
+    'log',
+    'relation_get',
+    'relation_ids',
+    'relation_list',
+    'subprocess',
+]
+
+CRM_MON = b"""<?xml version="1.0"?>
+<crm_mon version="1.1.14">
+  <summary>
+    <current_dc present="true" version="1.1.14" name="juju-heat-0"
+                id="1000" with_quorum="true"/>
+  </summary>
+  <nodes>
+    <node name="juju-heat-0" id="1000" online="true"/>
+    <node name="juju-heat-1" id="1001" online="true"/>
+  </nodes>
+  <resources>
+    <group id="grp_heat_vips" number_resources="1">
+      <resource id="res_heat_eth0_vip" role="Started" active="true"
+                nodes_running_on="1">
+        <node name="juju-heat-1" id="1001" cached="false"/>
+      </resource>
+    </group>
+    <clone id="cl_res_heat_haproxy" multi_state="false" unique="false">
+      <resource id="res_heat_haproxy" role="Started" nodes_running_on="1">
+        <node name="juju-heat-0" id="1000" cached="false"/>
+      </resource>
+      <resource id="res_heat_haproxy" role="Started" nodes_running_on="1">
+        <node name="juju-heat-1" id="1001" cached="false"/>
+      </resource>
+    </clone>
+    <resource id="res_heat_stopped" role="Stopped" active="false"
+              nodes_running_on="0"/>
+  </resources>
+</crm_mon>
+"""
+
+CRM_MON_NO_DC = b"""<?xml version="1.0"?>
+<crm_mon version="1.1.14">
+  <summary><current_dc present="false"/></summary>
+  <resources/>
+</crm_mon>
+"""
+
+
+class ClusterStateTests(CharmTestCase):
+
+    def setUp(self):
+        super(ClusterStateTests, self).setUp(cluster, TO_PATCH)
+        hookenv.cache.clear()
+        self.addCleanup(hookenv.cache.clear)
+        for name in ('log', 'time'):
+            patcher = patch.object(decorators, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.subprocess.CalledProcessError = subprocess.CalledProcessError
+        self.subprocess.STDOUT = subprocess.STDOUT
+        self.subprocess.check_output.return_value = CRM_MON
+        self.get_unit_hostname.return_value = 'juju-heat-1'
+
+    def crm_mon_calls(self):
+        return [c for c in self.subprocess.check_output.call_args_list
+                if c[0][0][0] == 'crm_mon']
+
+    def test_crm_mon_parsed(self):
+        crm = cluster.ClusterState().crm
+        self.assertEqual(crm['dc'], 'juju-heat-0')
+        self.assertEqual(crm['resources'], {
+            'grp_heat_vips': set(['juju-heat-1']),
+            'res_heat_eth0_vip': set(['juju-heat-1']),
+            'cl_res_heat_haproxy': set(['juju-heat-0', 'juju-heat-1']),
+            'res_heat_haproxy': set(['juju-heat-0', 'juju-heat-1']),
+            'res_heat_stopped': set(),
+        })
+
+    def test_crm_mon_read_once_per_hook(self):
+        self.assertTrue(cluster.is_crm_leader('grp_heat_vips'))
+        self.assertTrue(cluster.is_crm_leader('res_heat_haproxy'))
+        self.assertFalse(cluster.is_crm_dc())
+        self.assertEqual(len(self.crm_mon_calls()), 1)
+
+    def test_is_crm_leader(self):
+        self.get_unit_hostname.return_value = 'juju-heat-0'
+        self.assertFalse(cluster.is_crm_leader('grp_heat_vips'))
+        self.assertFalse(cluster.is_crm_leader('res_unknown'))
+        self.assertTrue(cluster.is_crm_leader(cluster.DC_RESOURCE_NAME))
+
+    def test_stopped_resource_retried_with_fresh_state(self):
+        with self.assertRaises(cluster.CRMResourceNotFound):
+            cluster.is_crm_leader('res_heat_stopped')
+        self.assertEqual(len(self.crm_mon_calls()), 6)
+
+    def test_no_dc_retried_with_fresh_state(self):
+        self.subprocess.check_output.side_effect = [CRM_MON_NO_DC, CRM_MON]
+        self.get_unit_hostname.return_value = 'juju-heat-0'
+        self.assertTrue(cluster.is_crm_leader(cluster.DC_RESOURCE_NAME))
+        self.assertEqual(len(self.crm_mon_calls()), 2)
+
+    def test_crm_fallback_without_crm_mon(self):
+        self.subprocess.check_output.side_effect = [
+            OSError(2, 'No such file or directory'),
+            b'resource grp_heat_vips is running on: juju-heat-1\n']
+        self.assertTrue(cluster.is_crm_leader('grp_heat_vips'))
+        self.assertEqual(
+            self.subprocess.check_output.call_args_list[1][0][0],
+            ['crm', 'resource', 'show', 'grp_heat_vips'])
+
+    def test_unparseable_crm_mon_falls_back(self):
+        self.subprocess.check_output.side_effect = [
+            b'<crm_mon', b'resource grp_heat_vips is NOT running\n',
+            b'resource grp_heat_vips is running on: juju-heat-1\n']
+        self.assertTrue(cluster.is_crm_leader('grp_heat_vips'))
+
+    def test_leadership_and_relations_looked_up_once(self):
+        self.juju_is_leader.return_value = True
+        self.relation_ids.side_effect = lambda name: ['%s:1' % name]
+        self.relation_list.return_value = ['heat/1', 'heat/2']
+        self.relation_get.side_effect = \
+            lambda key, rid, unit: 'yes' if unit == 'heat/2' else None
+        for _ in range(2):
+            self.assertTrue(cluster.is_elected_leader('grp_heat_vips'))
+            self.assertTrue(cluster.is_clustered())
+            self.assertEqual(cluster.peer_units(), ['heat/1', 'heat/2'])
+        self.assertEqual(self.juju_is_leader.call_count, 1)
+        self.assertEqual(self.relation_get.call_count, 2)
+        self.assertEqual(self.relation_ids.call_count, 2)
+        self.assertFalse(self.subprocess.check_output.called)
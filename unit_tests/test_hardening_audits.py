@@ -0,0 +1,338 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from mock import patch
+from test_utils import CharmTestCase
+
+from charmhelpers.core import unitdata
+from charmhelpers.contrib.hardening import audits
+from charmhelpers.contrib.hardening.audits import file as file_audits
+
+TO_PATCH = [
+    'log',
+    '_settings_fingerprint',
+]
+
+
+class FakeAudit(audits.BaseAudit):
+    """Audit of a list of paths, compliant unless told otherwise."""
+
+    def __init__(self, paths, compliant=True):
+        super(FakeAudit, self).__init__()
+        self.paths = paths
+        self.result = compliant
+        self.runs = 0
+
+    def resources(self):
+        return self.paths
+
+    def ensure_compliance(self):
+        self.runs += 1
+        if not self.result:
+            self.compliant = False
+
+
+class UnknownAudit(FakeAudit):
+
+    def resources(self):
+        return None
+
+
+class AuditsTestCase(CharmTestCase):
+
+    def setUp(self):
+        super(AuditsTestCase, self).setUp(audits, TO_PATCH)
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.db = unitdata.Storage(os.path.join(self.tmp, 'state.db'))
+        self.addCleanup(self.db.close)
+        kv = patch.object(unitdata, 'kv', return_value=self.db)
+        kv.start()
+        self.addCleanup(kv.stop)
+        self._settings_fingerprint.return_value = 'settings'
+
+    def path(self, name):
+        path = os.path.join(self.tmp, name)
+        if not os.path.exists(path):
+            open(path, 'w').close()
+        return path
+
+    def change(self, path):
+        st = os.lstat(path)
+        os.utime(path, (st.st_atime, st.st_mtime + 10))
+
+
+class MemoTests(AuditsTestCase):
+
+    def test_fingerprint(self):
+        a = self.path('a')
+        fp = audits.fingerprint([a])
+        self.assertEqual(audits.fingerprint([a]), fp)
+        self.change(a)
+        self.assertNotEqual(audits.fingerprint([a]), fp)
+        self.assertNotEqual(audits.fingerprint([self.path('missing')]),
+                            audits.fingerprint([a]))
+
+    def test_fingerprint_recursive(self):
+        d = os.path.join(self.tmp, 'd')
+        os.mkdir(d)
+        fp = audits.fingerprint([d], recursive=True)
+        self.change(self.path('d/f'))
+        self.assertNotEqual(audits.fingerprint([d], recursive=True), fp)
+
+    def test_compliant_run_memoized(self):
+        audit = FakeAudit([self.path('a')])
+        audits.run_audits('os', [audit])
+        self.assertTrue(audits.stack_unchanged('os'))
+        audits.run_audits('os', [audit])
+        self.assertEqual(audit.runs, 1)
+
+    def test_changed_resources_rerun(self):
+        a = self.path('a')
+        audit = FakeAudit([a])
+        audits.run_audits('os', [audit])
+        self.change(a)
+        self.assertFalse(audits.stack_unchanged('os'))
+        audits.run_audits('os', [audit])
+        self.assertEqual(audit.runs, 2)
+
+    def test_non_compliant_run_not_memoized(self):
+        bad = FakeAudit([self.path('a')], compliant=False)
+        good = FakeAudit([self.path('b')])
+        audits.run_audits('os', [bad, good])
+        self.assertFalse(audits.stack_unchanged('os'))
+        memo = self.db.get(audits.MEMO_KEY % 'os')
+        self.assertEqual(list(memo['audits']),
+                         ['FakeAudit:%s' % good.paths[0]])
+
+        # Nothing changed, the non-compliant audit still runs again and
+        # keeps warning.
+        audits.run_audits('os', [bad, good])
+        self.assertEqual((bad.runs, good.runs), (2, 1))
+
+    def test_compliant_after_fix_memoized(self):
+        audit = FakeAudit([self.path('a')], compliant=False)
+        audits.run_audits('os', [audit])
+        audit.result = True
+        audits.run_audits('os', [audit])
+        self.assertTrue(audits.stack_unchanged('os'))
+
+    def test_unknown_resources_never_skipped(self):
+        audit = UnknownAudit([self.path('a')])
+        audits.run_audits('os', [audit])
+        self.assertFalse(audits.stack_unchanged('os'))
+        audits.run_audits('os', [audit])
+        self.assertEqual(audit.runs, 2)
+
+    def test_settings_change(self):
+        audit = FakeAudit([self.path('a')])
+        audits.run_audits('os', [audit])
+        self._settings_fingerprint.return_value = 'other'
+        self.assertFalse(audits.stack_unchanged('os'))
+        audits.run_audits('os', [audit])
+        self.assertEqual(audit.runs, 2)
+
+    @patch('time.time')
+    def test_memo_max_age(self, _time):
+        _time.return_value = 1000
+        audits.run_audits('os', [FakeAudit([self.path('a')])])
+        _time.return_value = 1000 + audits.MEMO_MAX_AGE + 1
+        self.assertFalse(audits.stack_unchanged('os'))
+
+    @patch.object(file_audits, 'log')
+    def test_audit_only_check_keeps_warning(self, log):
+        path = self.path('sshd_config')
+        with open(path, 'w') as f:
+            f.write('PermitRootLogin yes\n')
+        audit = file_audits.FileContentAudit(
+            path, {'pass': ['^PermitRootLogin no$']})
+        audits.run_audits('ssh', [audit])
+        self.assertFalse(audit.compliant)
+        self.assertFalse(audits.stack_unchanged('ssh'))
+        log.reset_mock()
+        audits.run_audits('ssh', [audit])
+        self.assertTrue(any('expected to pass' in c[0][0]
+                            for c in log.call_args_list))
+
+
+class OrderedAudit(FakeAudit):
+    """Records the order and thread audits are run in."""
+
+    def __init__(self, name, paths, log, parallel=False):
+        super(OrderedAudit, self).__init__(paths)
+        self.name = name
+        self.log = log
+        self.parallel_check = parallel
+
+    def ensure_compliance(self):
+        self.log.append((self.name, threading.current_thread().name,
+                         audits.COMPLY_LOCK._is_owned()))
+
+
+class UnknownOrderedAudit(OrderedAudit):
+
+    def resources(self):
+        return None
+
+
+class ExecuteAuditsTests(AuditsTestCase):
+
+    def order(self, run):
+        return [name for name, _, _ in run]
+
+    def test_original_order_kept(self):
+        run = []
+        checks = [OrderedAudit('a', ['/etc/a'], run),
+                  OrderedAudit('b', ['/etc/b'], run),
+                  UnknownOrderedAudit('x', None, run),
+                  OrderedAudit('a2', ['/etc/a'], run),
+                  OrderedAudit('c', ['/etc/c'], run)]
+        elapsed = audits.execute_audits(checks)
+        self.assertEqual(self.order(run), ['a', 'b', 'x', 'a2', 'c'])
+        self.assertEqual(len(elapsed), 5)
+
+    def test_exclusive_audits_not_moved_last(self):
+        run = []
+        checks = [OrderedAudit('a', ['/etc/a'], run, parallel=True),
+                  OrderedAudit('b', ['/etc/b'], run, parallel=True),
+                  UnknownOrderedAudit('x', None, run),
+                  OrderedAudit('c', ['/etc/c'], run, parallel=True),
+                  OrderedAudit('d', ['/etc/d'], run, parallel=True)]
+        audits.execute_audits(checks)
+        order = self.order(run)
+        self.assertEqual(sorted(order[:2]), ['a', 'b'])
+        self.assertEqual(order[2], 'x')
+        self.assertEqual(sorted(order[3:]), ['c', 'd'])
+
+    def test_independent_checks_threaded(self):
+        run = []
+        checks = [OrderedAudit('a', ['/etc/a'], run, parallel=True),
+                  OrderedAudit('b', ['/etc/b'], run, parallel=True),
+                  OrderedAudit('t', ['/etc/t'], run)]
+        audits.execute_audits(checks)
+        threads = dict((name, thread) for name, thread, _ in run)
+        main = threading.current_thread().name
+        self.assertNotEqual(threads['a'], main)
+        self.assertNotEqual(threads['b'], main)
+        self.assertEqual(threads['t'], main)
+
+    def test_overlapping_checks_in_order(self):
+        run = []
+        checks = [OrderedAudit('dir', ['/etc/ssh'], run, parallel=True),
+                  OrderedAudit('other', ['/etc/x'], run, parallel=True),
+                  OrderedAudit('file', ['/etc/ssh/sshd_config'], run,
+                               parallel=True)]
+        audits.execute_audits(checks)
+        order = self.order(run)
+        self.assertLess(order.index('dir'), order.index('file'))
+        threads = dict((name, thread) for name, thread, _ in run)
+        self.assertEqual(threads['dir'], threads['file'])
+
+    def test_comply_lock(self):
+        run = []
+        checks = [OrderedAudit('a', ['/etc/a'], run, parallel=True),
+                  OrderedAudit('b', ['/etc/b'], run, parallel=True),
+                  OrderedAudit('t', ['/etc/t'], run),
+                  UnknownOrderedAudit('x', None, run)]
+        audits.execute_audits(checks)
+        locked = dict((name, owned) for name, _, owned in run)
+        self.assertEqual(locked, {'a': False, 'b': False, 't': True,
+                                  'x': True})
+
+    def test_mutations_serialised(self):
+        state = {'active': 0, 'max': 0}
+        started = threading.Event()
+
+        class Mutating(FakeAudit):
+            parallel_check = True
+
+            def ensure_compliance(self):
+                started.set()
+                with audits.COMPLY_LOCK:
+                    state['active'] += 1
+                    state['max'] = max(state['max'], state['active'])
+                    time.sleep(0.05)
+                    state['active'] -= 1
+
+        audits.execute_audits([Mutating(['/etc/%d' % i]) for i in range(4)])
+        self.assertTrue(started.is_set())
+        self.assertEqual(state['max'], 1)
+
+
+class ContentMatchesTests(AuditsTestCase):
+
+    def setUp(self):
+        super(ContentMatchesTests, self).setUp()
+        file_log = patch.object(file_audits, 'log')
+        file_log.start()
+        self.addCleanup(file_log.stop)
+        self.addCleanup(file_audits._CONTENT_MATCHES.clear)
+        file_audits._CONTENT_MATCHES.clear()
+        self.conf = self.path('sshd_config')
+        self.write('PermitRootLogin no\n', 1000)
+
+    def write(self, content, mtime=None):
+        with open(self.conf, 'w') as f:
+            f.write(content)
+        if mtime is not None:
+            os.utime(self.conf, (mtime, mtime))
+
+    def audit(self):
+        return file_audits.FileContentAudit(
+            self.conf, {'pass': ['^PermitRootLogin no$'],
+                        'fail': ['^PasswordAuthentication yes$']})
+
+    def test_matches_stored_in_unitdata(self):
+        audits.run_audits('ssh', [self.audit()])
+        st = os.stat(self.conf)
+        self.assertEqual(
+            self.db.get(file_audits.CONTENT_MATCHES_KEY),
+            {self.conf: {'size': st.st_size, 'mtime': st.st_mtime,
+                         'matches': [[['^PasswordAuthentication yes$',
+                                       '^PermitRootLogin no$'],
+                                      ['^PermitRootLogin no$']]]}})
+
+    def test_matches_reused_across_hooks(self):
+        audits.run_audits('ssh', [self.audit()])
+        # A new hook, with the same size and mtime: the stored result is
+        # used without reading the file.
+        file_audits._CONTENT_MATCHES.clear()
+        self.db.unset(audits.MEMO_KEY % 'ssh')
+        self.write('PermitRootLogin on\n', 1000)
+        audit = self.audit()
+        audits.run_audits('ssh', [audit])
+        self.assertTrue(audit.compliant)
+
+    def test_changed_file_read_again(self):
+        audits.run_audits('ssh', [self.audit()])
+        file_audits._CONTENT_MATCHES.clear()
+        self.write('PermitRootLogin on\n', 1010)
+        audit = self.audit()
+        audits.run_audits('ssh', [audit])
+        self.assertFalse(audit.compliant)
+        stored = self.db.get(file_audits.CONTENT_MATCHES_KEY)[self.conf]
+        self.assertEqual(stored['mtime'], 1010)
+        self.assertEqual(stored['matches'][0][1], [])
+
+    def test_missing_file_dropped(self):
+        audits.run_audits('ssh', [self.audit()])
+        os.remove(self.conf)
+        file_audits._save_content_matches([self.conf])
+        self.assertEqual(self.db.get(file_audits.CONTENT_MATCHES_KEY), {})
@@ -0,0 +1,189 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import sys
+import tempfile
+
+from mock import patch, MagicMock
+from test_utils import CharmTestCase
+
+# python-apt is not installed as part of test-requirements but is imported by
+# the hardening audits so create a fake import.
+sys.modules.setdefault('apt', MagicMock())
+
+from charmhelpers.core import unitdata  # noqa: E402
+from charmhelpers.contrib.hardening.host.checks import (  # noqa: E402
+    suid_sgid,
+)
+
+# _pruned_mounts itself, before it is patched.
+pruned_mounts = suid_sgid._pruned_mounts
+
+TO_PATCH = [
+    'log',
+    '_pruned_mounts',
+]
+
+
+class SuidSgidScanTests(CharmTestCase):
+
+    def setUp(self):
+        super(SuidSgidScanTests, self).setUp(suid_sgid, TO_PATCH)
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.db = unitdata.Storage(os.path.join(self.root, 'state.db'))
+        self.addCleanup(self.db.close)
+        kv = patch.object(unitdata, 'kv', return_value=self.db)
+        kv.start()
+        self.addCleanup(kv.stop)
+        self._pruned_mounts.return_value = set()
+
+        self.tree = os.path.join(self.root, 'tree')
+        self.bin = self.path('usr', 'bin')
+        self.lib = self.path('usr', 'lib', 'x')
+        os.makedirs(self.bin)
+        os.makedirs(self.lib)
+        self.sudo = self.file(self.bin, 'sudo', 0o4755)
+        self.wall = self.file(self.lib, 'wall', 0o2755)
+        self.file(self.bin, 'ls', 0o755)
+
+    def path(self, *parts):
+        return os.path.join(self.tree, *parts)
+
+    def file(self, directory, name, mode):
+        path = os.path.join(directory, name)
+        open(path, 'w').close()
+        os.chmod(path, mode)
+        return path
+
+    def touch_dir(self, path):
+        """Moves a directory's mtime forward, as a change in it would."""
+        mtime = os.lstat(path).st_mtime + 10
+        os.utime(path, (mtime, mtime))
+
+    def test_finds_suid_sgid_files(self):
+        self.assertEqual(suid_sgid.find_paths_with_suid_sgid(self.tree),
+                         set([self.sudo, self.wall]))
+
+    def test_index_in_unitdata(self):
+        suid_sgid.find_paths_with_suid_sgid(self.tree + '/')
+        index = self.db.get(suid_sgid.SUID_SGID_INDEX_KEY)
+        self.assertEqual(index['root'], self.tree)
+        self.assertEqual(sorted(index), ['root', 'scanned'])
+        records = self.db.getrange(suid_sgid.SUID_SGID_DIR_PREFIX, strip=True)
+        self.assertEqual(sorted(records), sorted([
+            self.tree, self.path('usr'), self.bin, self.path('usr', 'lib'),
+            self.lib]))
+        st = os.lstat(self.sudo)
+        self.assertEqual(records[self.bin]['suid'],
+                         {'sudo': [st.st_dev, st.st_ino, st.st_mode]})
+        self.assertEqual(records[self.path('usr')]['dirs'], ['bin', 'lib'])
+
+    def test_only_changed_directories_written(self):
+        suid_sgid.find_paths_with_suid_sgid(self.tree)
+        self.file(self.lib, 'newgrp', 0o2755)
+        self.touch_dir(self.lib)
+        with patch.object(self.db, 'set', side_effect=self.db.set) as _set:
+            suid_sgid.find_paths_with_suid_sgid(self.tree)
+        self.assertEqual(
+            sorted(c[0][0] for c in _set.call_args_list),
+            sorted([suid_sgid.SUID_SGID_DIR_PREFIX + self.lib,
+                    suid_sgid.SUID_SGID_INDEX_KEY]))
+
+    def test_removed_directory_unset(self):
+        suid_sgid.find_paths_with_suid_sgid(self.tree)
+        shutil.rmtree(self.path('usr', 'lib'))
+        self.assertEqual(suid_sgid.find_paths_with_suid_sgid(self.tree),
+                         set([self.sudo]))
+        records = self.db.getrange(suid_sgid.SUID_SGID_DIR_PREFIX, strip=True)
+        self.assertEqual(sorted(records),
+                         sorted([self.tree, self.path('usr'), self.bin]))
+
+    def test_unchanged_directories_not_listed(self):
+        suid_sgid.find_paths_with_suid_sgid(self.tree)
+        with patch.object(suid_sgid, '_list_dir') as list_dir:
+            self.assertEqual(
+                suid_sgid.find_paths_with_suid_sgid(self.tree),
+                set([self.sudo, self.wall]))
+        self.assertFalse(list_dir.called)
+
+    def test_changed_directory_listed(self):
+        suid_sgid.find_paths_with_suid_sgid(self.tree)
+        new_dir = self.path('usr', 'lib', 'y')
+        os.mkdir(new_dir)
+        newgrp = self.file(new_dir, 'newgrp', 0o4755)
+        self.touch_dir(self.path('usr', 'lib'))
+        with patch.object(suid_sgid, '_list_dir',
+                          side_effect=suid_sgid._list_dir) as list_dir:
+            self.assertEqual(
+                suid_sgid.find_paths_with_suid_sgid(self.tree),
+                set([self.sudo, self.wall, newgrp]))
+        self.assertEqual(sorted(c[0][0] for c in list_dir.call_args_list),
+                         [self.path('usr', 'lib'), new_dir])
+
+    def test_known_file_rechecked(self):
+        suid_sgid.find_paths_with_suid_sgid(self.tree)
+        mtime = os.lstat(self.bin).st_mtime
+        os.chmod(self.sudo, 0o755)
+        os.utime(self.bin, (mtime, mtime))
+        self.assertEqual(suid_sgid.find_paths_with_suid_sgid(self.tree),
+                         set([self.wall]))
+
+    def test_replaced_file_rechecked(self):
+        suid_sgid.find_paths_with_suid_sgid(self.tree)
+        mtime = os.lstat(self.bin).st_mtime
+        replacement = self.file(self.bin, 'sudo.new', 0o4755)
+        os.rename(replacement, self.sudo)
+        os.utime(self.bin, (mtime, mtime))
+        with patch.object(suid_sgid, '_list_dir',
+                          side_effect=suid_sgid._list_dir) as list_dir:
+            self.assertEqual(suid_sgid.find_paths_with_suid_sgid(self.tree),
+                             set([self.sudo, self.wall]))
+        list_dir.assert_called_once_with(self.bin)
+        records = self.db.getrange(suid_sgid.SUID_SGID_DIR_PREFIX, strip=True)
+        self.assertEqual(records[self.bin]['suid']['sudo'][1],
+                         os.lstat(self.sudo).st_ino)
+
+    @patch('time.time')
+    def test_stale_index_rescanned(self, _time):
+        _time.return_value = 1000
+        suid_sgid.find_paths_with_suid_sgid(self.tree)
+        _time.return_value = 1000 + suid_sgid.FULL_SCAN_INTERVAL + 1
+        with patch.object(suid_sgid, '_list_dir',
+                          side_effect=suid_sgid._list_dir) as list_dir:
+            suid_sgid.find_paths_with_suid_sgid(self.tree)
+        self.assertEqual(list_dir.call_count, 5)
+        self.assertEqual(
+            self.db.get(suid_sgid.SUID_SGID_INDEX_KEY)['scanned'],
+            1000 + suid_sgid.FULL_SCAN_INTERVAL + 1)
+
+    def test_pruned_mounts_skipped(self):
+        self._pruned_mounts.return_value = set([self.path('usr', 'lib')])
+        self.assertEqual(suid_sgid.find_paths_with_suid_sgid(self.tree),
+                         set([self.sudo]))
+
+    def test_pruned_mounts(self):
+        mounts = os.path.join(self.root, 'mounts')
+        with open(mounts, 'w') as f:
+            f.write('sysfs /sys sysfs rw 0 0\n'
+                    '/dev/vda1 / ext4 rw 0 0\n'
+                    'server:/x /mnt/my\\040share nfs4 rw 0 0\n')
+        self.assertEqual(pruned_mounts(mounts),
+                         set(['/proc', '/sys', '/mnt/my share']))
+
+    def test_unknown_audit_never_memoized(self):
+        audit = suid_sgid.UnknownSUIDSGIDAudit([self.sudo])
+        self.assertIsNone(audit.resources())
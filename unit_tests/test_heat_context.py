@@ -12,8 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import sys
+
+from distutils.version import LooseVersion
+
+import jinja2
+
 import heat_context
-from mock import patch
+from charmhelpers.core import hookenv
+from mock import MagicMock, call, patch
 from test_utils import CharmTestCase
 
 TO_PATCH = [
@@ -21,6 +29,14 @@ TO_PATCH = [
     'generate_ec2_tokens',
     'config',
     'leader_get',
+    'get_upstream_version',
+    'https',
+    'get_total_ram',
+    'get_relation_ip',
+    'relation_ids',
+    'related_units',
+    'relation_get',
+    'log',
 ]
 
 
@@ -28,6 +44,7 @@ class TestHeatContext(CharmTestCase):
 
     def setUp(self):
         super(TestHeatContext, self).setUp(heat_context, TO_PATCH)
+        hookenv.cache.clear()
 
     def test_encryption_configuration(self):
         self.get_encryption_key.return_value = 'key'
@@ -66,3 +83,256 @@ class TestHeatContext(CharmTestCase):
 
         self.assertEqual(
             heat_context.HeatIdentityServiceContext()(), final_result)
+
+    @patch('os.path.exists')
+    def test_apache_supports_http2(self, exists):
+        exists.return_value = True
+        self.assertTrue(heat_context.apache_supports_http2())
+        exists.assert_called_with('/etc/apache2/mods-available/http2.load')
+        exists.return_value = False
+        self.assertFalse(heat_context.apache_supports_http2())
+        self.assertFalse(self.get_upstream_version.called)
+
+    @patch('subprocess.check_call')
+    @patch('os.path.exists')
+    def test_apache_ssl_enable_modules_no_http2(self, exists, check_call):
+        # e.g. apache 2.4.18 on xenial, which has no mod_http2.
+        exists.side_effect = lambda path: not path.endswith(
+            ('/socache_shmcb.load', '/http2.load'))
+        heat_context.HeatApacheSSLContext().enable_modules()
+        check_call.assert_called_once_with(['a2enmod', 'socache_shmcb'])
+
+    @patch.object(heat_context, 'apache_supports_http2')
+    @patch('subprocess.check_call')
+    @patch('os.path.exists')
+    def test_apache_ssl_enable_modules(self, exists, check_call, http2):
+        http2.return_value = True
+        exists.side_effect = lambda path: not path.endswith(
+            ('/socache_shmcb.load', '/http2.load'))
+        heat_context.HeatApacheSSLContext().enable_modules()
+        check_call.assert_called_once_with(['a2enmod', 'socache_shmcb',
+                                            'http2'])
+
+    @patch.object(heat_context, 'apache_supports_http2')
+    @patch('subprocess.check_call')
+    @patch('os.path.exists')
+    def test_apache_ssl_enable_modules_enabled(self, exists, check_call,
+                                               http2):
+        http2.return_value = False
+        exists.return_value = True
+        heat_context.HeatApacheSSLContext().enable_modules()
+        self.assertFalse(check_call.called)
+        exists.assert_has_calls([call('/etc/apache2/mods-enabled/ssl.load')])
+
+    @patch.object(heat_context, 'apache_supports_http2')
+    @patch('multiprocessing.cpu_count')
+    @patch('charmhelpers.contrib.openstack.context.WorkerConfigContext'
+           '.__call__')
+    def test_apache_tuning_small_unit(self, workers, cpu_count, http2):
+        self.https.return_value = True
+        workers.return_value = {'workers': 2}
+        cpu_count.return_value = 1
+        http2.return_value = False
+        self.config.return_value = None
+        ctxt = heat_context.HeatApacheTuningContext()()
+        self.assertEqual(ctxt['mpm_server_limit'], 6)
+        self.assertEqual(ctxt['mpm_max_request_workers'], 150)
+        self.assertEqual(ctxt['mpm_max_spare_threads'], 75)
+        self.assertEqual(ctxt['proxy_pool_max'], 25)
+        self.assertFalse(ctxt['ssl_stapling'])
+        self.assertFalse(ctxt['http2'])
+
+    @patch.object(heat_context, 'apache_supports_http2')
+    @patch('multiprocessing.cpu_count')
+    @patch('charmhelpers.contrib.openstack.context.WorkerConfigContext'
+           '.__call__')
+    def test_apache_tuning_sized_from_workers(self, workers, cpu_count,
+                                              http2):
+        self.https.return_value = True
+        workers.return_value = {'workers': 16}
+        cpu_count.return_value = 8
+        http2.return_value = True
+        self.config.return_value = None
+        ctxt = heat_context.HeatApacheTuningContext()()
+        # 16 workers for each of the 2 APIs, 25 requests each.
+        self.assertEqual(ctxt['mpm_max_request_workers'], 800)
+        self.assertEqual(ctxt['mpm_server_limit'], 32)
+        self.assertEqual(ctxt['mpm_max_spare_threads'], 200)
+        self.assertTrue(ctxt['http2'])
+
+    @patch.object(heat_context, 'apache_supports_http2')
+    @patch('multiprocessing.cpu_count')
+    @patch('charmhelpers.contrib.openstack.context.WorkerConfigContext'
+           '.__call__')
+    def test_apache_tuning_configured(self, workers, cpu_count, http2):
+        self.https.return_value = True
+        workers.return_value = {'workers': 2}
+        cpu_count.return_value = 1
+        http2.return_value = False
+        config = {'apache-max-request-workers': 410,
+                  'ssl-ocsp-stapling': True}
+        self.config.side_effect = lambda key: config.get(key)
+        ctxt = heat_context.HeatApacheTuningContext()()
+        # Rounded up to whole apache processes.
+        self.assertEqual(ctxt['mpm_max_request_workers'], 425)
+        self.assertEqual(ctxt['mpm_server_limit'], 17)
+        self.assertTrue(ctxt['ssl_stapling'])
+
+    def test_apache_tuning_without_https(self):
+        self.https.return_value = False
+        self.assertEqual(heat_context.HeatApacheTuningContext()(), {})
+
+    def test_memcache_server_url(self):
+        self.assertEqual(heat_context.memcache_server_url('10.5.0.1', 11211),
+                         '10.5.0.1:11211')
+        self.assertEqual(heat_context.memcache_server_url('fd00::1', 11211),
+                         'inet6:[fd00::1]:11211')
+
+    @patch('charmhelpers.contrib.openstack.context.MemcacheContext'
+           '.__call__')
+    def test_memcache_disabled(self, memcache):
+        memcache.return_value = {'use_memcache': False}
+        self.assertEqual(heat_context.HeatMemcacheContext()(),
+                         {'use_memcache': False})
+
+    @patch('charmhelpers.contrib.openstack.context.WorkerConfigContext'
+           '.__call__')
+    @patch('charmhelpers.contrib.openstack.context.MemcacheContext'
+           '.__call__')
+    def test_memcache_local(self, memcache, workers):
+        memcache.return_value = {
+            'use_memcache': True, 'memcache_server': '::1',
+            'memcache_server_formatted': '[::1]', 'memcache_port': '11211',
+            'memcache_url': 'inet6:[::1]:11211'}
+        workers.return_value = {'workers': 8}
+        self.config.return_value = False
+        self.get_total_ram.return_value = 16 * 1024 ** 3
+        ctxt = heat_context.HeatMemcacheContext()()
+        self.assertEqual(ctxt['memcache_url'], 'inet6:[::1]:11211')
+        self.assertEqual(ctxt['memcache_server'], '::1')
+        self.assertEqual(ctxt['memcache_memory'], 256)
+        self.assertEqual(ctxt['memcache_connections'], 1024)
+        self.assertEqual(ctxt['memcache_threads'], 4)
+        self.assertEqual(ctxt['memcache_pool_maxsize'], 10)
+        self.assertFalse('memcache_peer_pool' in ctxt)
+        self.assertFalse(self.get_relation_ip.called)
+
+    @patch('charmhelpers.contrib.openstack.context.WorkerConfigContext'
+           '.__call__')
+    @patch('charmhelpers.contrib.openstack.context.MemcacheContext'
+           '.__call__')
+    def test_memcache_peer_pool(self, memcache, workers):
+        memcache.return_value = {
+            'use_memcache': True, 'memcache_server': '::1',
+            'memcache_server_formatted': '[::1]', 'memcache_port': '11211',
+            'memcache_url': 'inet6:[::1]:11211'}
+        workers.return_value = {'workers': 48}
+        self.config.side_effect = lambda key: key == 'memcache-peer-pool'
+        self.get_total_ram.return_value = 512 * 1024 ** 3
+        self.get_relation_ip.return_value = '10.5.0.11'
+        self.relation_ids.return_value = ['cluster:1']
+        self.related_units.return_value = ['heat/2', 'heat/0', 'heat/3']
+        addresses = {'heat/0': '10.5.0.10', 'heat/2': '10.5.0.12'}
+        self.relation_get.side_effect = \
+            lambda attribute, rid, unit: addresses.get(unit)
+        ctxt = heat_context.HeatMemcacheContext()()
+        self.get_relation_ip.assert_called_with('cluster')
+        # The same order on every unit, whichever unit renders it.
+        self.assertEqual(ctxt['memcache_url'],
+                         '10.5.0.10:11211,10.5.0.11:11211,10.5.0.12:11211')
+        self.assertEqual(ctxt['memcache_server'], '10.5.0.11')
+        self.assertTrue(ctxt['memcache_peer_pool'])
+        self.assertEqual(ctxt['memcache_memory'], 1024)
+        # 48 workers for 2 APIs on 3 units, 10 connections each, doubled.
+        self.assertEqual(ctxt['memcache_connections'], 5760)
+        self.assertEqual(ctxt['memcache_threads'], 16)
+
+    def test_service_cpu_affinity_none(self):
+        self.config.return_value = None
+        self.assertEqual(heat_context.service_cpu_affinity(), {})
+
+    @patch('multiprocessing.cpu_count')
+    def test_service_cpu_affinity_auto(self, cpu_count):
+        self.config.return_value = 'auto'
+        cpu_count.return_value = 2
+        self.assertEqual(heat_context.service_cpu_affinity(), {})
+        cpu_count.return_value = 4
+        self.assertEqual(heat_context.service_cpu_affinity(),
+                         {'api': '0', 'engine': '1-3'})
+        cpu_count.return_value = 16
+        self.assertEqual(heat_context.service_cpu_affinity(),
+                         {'api': '0-3', 'engine': '4-15'})
+
+    def test_service_cpu_affinity_explicit(self):
+        self.config.return_value = 'api=0,1 engine=2-7'
+        self.assertEqual(heat_context.service_cpu_affinity(),
+                         {'api': '0,1', 'engine': '2-7'})
+        self.config.return_value = 'api=0-1 workers=2-7'
+        self.assertEqual(heat_context.service_cpu_affinity(), {})
+        self.assertTrue(self.log.called)
+
+    def test_systemd_supports_memory_max(self):
+        apt_pkg = MagicMock()
+        apt_pkg.version_compare.side_effect = \
+            lambda a, b: cmp(LooseVersion(a), LooseVersion(b))
+        with patch.dict(sys.modules, {'apt_pkg': apt_pkg}):
+            self.get_upstream_version.return_value = '237'
+            self.assertTrue(heat_context.systemd_supports_memory_max())
+            self.get_upstream_version.return_value = '229'
+            self.assertFalse(heat_context.systemd_supports_memory_max())
+            self.get_upstream_version.return_value = None
+            self.assertFalse(heat_context.systemd_supports_memory_max())
+        self.get_upstream_version.assert_called_with('systemd')
+
+    def render_overrides(self, ctxt):
+        templates = os.path.join(os.path.dirname(__file__), '..',
+                                 'templates')
+        env = jinja2.Environment(loader=jinja2.FileSystemLoader(templates))
+        rendered = env.get_template('heat-overrides.conf').render(ctxt)
+        return [line for line in rendered.split('\n')
+                if line and not line.startswith('#')]
+
+    @patch.object(heat_context, 'systemd_supports_memory_max')
+    def test_service_overrides_rendered_memory_max(self, memory_max):
+        memory_max.return_value = True
+        self.test_config.set('service-memory-max', 50)
+        self.config.side_effect = self.test_config.get
+        self.get_total_ram.return_value = 8000
+        ctxt = heat_context.HeatServiceOverridesContext('heat-engine')()
+        self.assertEqual(self.render_overrides(ctxt), [
+            '[Service]', 'LimitNOFILE=65536', 'TasksMax=infinity',
+            'MemoryHigh=3600', 'MemoryMax=4000'])
+
+    @patch.object(heat_context, 'systemd_supports_memory_max')
+    def test_service_overrides_rendered_memory_limit(self, memory_max):
+        # e.g. systemd 229 on xenial.
+        memory_max.return_value = False
+        self.test_config.set('service-memory-max', 50)
+        self.config.side_effect = self.test_config.get
+        self.get_total_ram.return_value = 8000
+        ctxt = heat_context.HeatServiceOverridesContext('heat-engine')()
+        self.assertEqual(self.render_overrides(ctxt), [
+            '[Service]', 'LimitNOFILE=65536', 'TasksMax=infinity',
+            'MemoryLimit=4000'])
+
+        self.test_config.set('service-memory-max', 0)
+        ctxt = heat_context.HeatServiceOverridesContext('heat-engine')()
+        self.assertEqual(self.render_overrides(ctxt), [
+            '[Service]', 'LimitNOFILE=65536', 'TasksMax=infinity'])
+
+    @patch.object(heat_context, 'systemd_supports_memory_max')
+    def test_service_overrides_context(self, memory_max):
+        memory_max.return_value = True
+        self.test_config.set('service-cpu-affinity', 'api=0 engine=1-3')
+        self.test_config.set('service-memory-max', 50)
+        self.test_config.set('heat-engine-nice', 5)
+        self.config.side_effect = self.test_config.get
+        self.get_total_ram.return_value = 8000
+        self.assertEqual(
+            heat_context.HeatServiceOverridesContext('heat-engine')(),
+            {'service': 'heat-engine', 'nofile': 65536,
+             'tasks_max': 'infinity', 'cpu_affinity': '1-3', 'nice': 5,
+             'memory_max': 4000, 'memory_high': 3600})
+        ctxt = heat_context.HeatServiceOverridesContext('heat-api')()
+        self.assertEqual(ctxt['cpu_affinity'], '0')
+        self.assertEqual(ctxt['nice'], 0)
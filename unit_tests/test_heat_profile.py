@@ -0,0 +1,42 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import unittest
+
+import heat_profile
+
+
+class ImportTimerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(sys.modules.pop, 'wave', None)
+        self.addCleanup(sys.modules.pop, 'chunk', None)
+        sys.modules.pop('wave', None)
+        sys.modules.pop('chunk', None)
+
+    def test_records_direct_imports(self):
+        with heat_profile.ImportTimer() as timer:
+            import wave  # noqa: F401
+            import os  # noqa: F401
+        # wave imports chunk, which is counted in wave's time.
+        self.assertEqual(sorted(timer.times), ['wave'])
+        self.assertEqual(timer.total(), timer.times['wave'])
+
+    def test_stopped(self):
+        timer = heat_profile.ImportTimer()
+        timer.start()
+        timer.stop()
+        import wave  # noqa: F401
+        self.assertEqual(timer.times, {})
@@ -0,0 +1,145 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+from test_utils import CharmTestCase
+
+import heat_recycle
+
+# engine_rss itself, before it is patched.
+engine_rss = heat_recycle.engine_rss
+
+TO_PATCH = [
+    'engine_rss',
+    'kv',
+    'migration_until_path',
+    'service_restart',
+    'service_running',
+    'time',
+]
+
+
+class FakeKV(dict):
+
+    def set(self, key, value):
+        self[key] = value
+
+    def flush(self):
+        pass
+
+
+class HeatRecycleTests(CharmTestCase):
+
+    def setUp(self):
+        super(HeatRecycleTests, self).setUp(heat_recycle, TO_PATCH)
+        self.db = FakeKV()
+        self.kv.return_value = self.db
+        self.time.time.return_value = 100000
+        self.service_running.return_value = True
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.migration_until = os.path.join(tmp, 'migration-until')
+        self.migration_until_path.return_value = self.migration_until
+
+    def _proc(self, processes):
+        proc = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, proc)
+        os.mkdir(os.path.join(proc, 'self'))
+        for pid, (cmdline, rss_kb) in processes.items():
+            os.mkdir(os.path.join(proc, pid))
+            with open(os.path.join(proc, pid, 'cmdline'), 'w') as f:
+                f.write('\0'.join(cmdline) + '\0')
+            with open(os.path.join(proc, pid, 'status'), 'w') as f:
+                f.write('Name:\tpython\nVmRSS:\t  %d kB\n' % rss_kb)
+        return proc
+
+    def test_engine_rss(self):
+        proc = self._proc({
+            '100': (['/usr/bin/python', '/usr/bin/heat-engine',
+                     '--config-file=/etc/heat/heat.conf'], 204800),
+            '101': (['/usr/bin/python', '/usr/bin/heat-engine'], 102400),
+            '200': (['/usr/bin/python', '/usr/bin/heat-api'], 409600),
+        })
+        self.assertEqual(engine_rss(proc), {100: 200, 101: 100})
+
+    def test_recycle_reason(self):
+        rss = {100: 2100, 101: 300}
+        self.assertEqual(
+            heat_recycle.recycle_reason(rss, 2048, 0, 0, 3600), 'rss')
+        self.assertEqual(
+            heat_recycle.recycle_reason(rss, 4096, 1, 0, 3600), 'schedule')
+        self.assertIsNone(
+            heat_recycle.recycle_reason(rss, 4096, 2, 0, 3600))
+        self.assertIsNone(heat_recycle.recycle_reason({}, 2048, 0, 0, 0))
+
+    def test_recycle_first_run(self):
+        self.engine_rss.return_value = {100: 300}
+        self.assertIsNone(heat_recycle.recycle(0, 24))
+        self.assertEqual(self.db[heat_recycle.RECYCLED_AT_KEY], 100000)
+        self.assertFalse(self.service_restart.called)
+
+    def test_recycle_rss(self):
+        self.db[heat_recycle.RECYCLED_AT_KEY] = 90000
+        self.engine_rss.side_effect = [{100: 3000, 101: 500}, {102: 400}]
+        event = heat_recycle.recycle(2048, 0)
+        self.service_restart.assert_called_once_with('heat-engine')
+        self.time.sleep.assert_called_once_with(heat_recycle.SETTLE_TIME)
+        self.assertEqual(event, {'time': 100000, 'reason': 'rss',
+                                 'rss_before': 3500, 'max_rss_before': 3000,
+                                 'rss_after': 400})
+        self.assertEqual(self.db[heat_recycle.RECYCLES_KEY], [event])
+        self.assertEqual(self.db[heat_recycle.RECYCLED_AT_KEY], 100000)
+
+    def test_recycle_keeps_latest(self):
+        self.db[heat_recycle.RECYCLED_AT_KEY] = 0
+        self.db[heat_recycle.RECYCLES_KEY] = [
+            {'time': i} for i in range(heat_recycle.MAX_RECYCLES)]
+        self.engine_rss.return_value = {100: 300}
+        event = heat_recycle.recycle(0, 24)
+        recycles = self.db[heat_recycle.RECYCLES_KEY]
+        self.assertEqual(len(recycles), heat_recycle.MAX_RECYCLES)
+        self.assertEqual(recycles[0], {'time': 1})
+        self.assertEqual(recycles[-1], event)
+
+    def test_recycle_not_due(self):
+        self.db[heat_recycle.RECYCLED_AT_KEY] = 90000
+        self.engine_rss.return_value = {100: 300}
+        self.assertIsNone(heat_recycle.recycle(2048, 24))
+        self.assertFalse(self.service_restart.called)
+
+    def test_recycle_engine_stopped(self):
+        self.service_running.return_value = False
+        self.db[heat_recycle.RECYCLED_AT_KEY] = 0
+        self.engine_rss.return_value = {100: 3000}
+        self.assertIsNone(heat_recycle.recycle(2048, 24))
+        self.assertFalse(self.service_restart.called)
+        self.assertFalse(self.engine_rss.called)
+        self.service_running.assert_called_once_with('heat-engine')
+
+    def test_recycle_during_migration(self):
+        with open(self.migration_until, 'w') as f:
+            f.write('100001.0')
+        self.db[heat_recycle.RECYCLED_AT_KEY] = 0
+        self.engine_rss.return_value = {100: 3000}
+        self.assertIsNone(heat_recycle.recycle(2048, 24))
+        self.assertFalse(self.service_restart.called)
+
+        # The migration window has ended, e.g. the leader died mid-way.
+        with open(self.migration_until, 'w') as f:
+            f.write('100000.0')
+        self.assertEqual(heat_recycle.recycle(2048, 24)['reason'], 'rss')
+        self.service_restart.assert_called_once_with('heat-engine')
@@ -48,63 +48,92 @@ TO_PATCH = [
     'relation_set',
     'related_units',
     # charmhelpers.core.host
-    'apt_install',
-    'apt_update',
     'restart_on_change',
     # charmhelpers.contrib.openstack.utils
     'configure_installation_source',
     'openstack_upgrade_available',
-    'determine_packages',
     'charm_dir',
     'sync_db_with_multi_ipv6_addresses',
-    # charmhelpers.contrib.openstack.ha.utils
-    'update_dns_ha_resource_params',
     # charmhelpers.contrib.hahelpers.cluster_utils
     # heat_utils
     'restart_map',
     'register_configs',
     'do_openstack_upgrade',
+    'install_packages',
+    'configure_service_overrides',
+    'configure_sysctl',
+    'configure_engine_recycling',
+    'configure_role',
+    'record_migration_state',
+    'restart_deferred_services',
+    'role',
+    'serves_api',
+    'kv',
     # other
-    'execd_preinstall',
     'log',
     'migrate_database',
     'is_elected_leader',
     'relation_ids',
     'relation_get',
     'local_unit',
-    'get_hacluster_config',
-    'get_iface_for_address',
     'get_relation_ip',
-    'get_netmask_for_address',
 ]
 
+# Imported by the hooks which use them, so patched where they are defined.
+HOOK_IMPORTS = {
+    'execd_preinstall': 'charmhelpers.payload.execd',
+    'get_hacluster_config': 'charmhelpers.contrib.hahelpers.cluster',
+    'get_iface_for_address': 'charmhelpers.contrib.network.ip',
+    'get_netmask_for_address': 'charmhelpers.contrib.network.ip',
+    'update_dns_ha_resource_params': 'charmhelpers.contrib.openstack.ha.utils',
+}
+
 
 class HeatRelationTests(CharmTestCase):
 
     def setUp(self):
         super(HeatRelationTests, self).setUp(relations, TO_PATCH)
+        for name, module in HOOK_IMPORTS.items():
+            _m = patch('{}.{}'.format(module, name))
+            setattr(self, name, _m.start())
+            self.addCleanup(_m.stop)
+        # Hooks register the configs on first use; start each test afresh.
+        self.addCleanup(setattr, relations, 'CONFIGS', None)
         self.config.side_effect = self.test_config.get
         self.charm_dir.return_value = '/var/lib/juju/charms/heat/charm'
+        self.role.return_value = 'all'
+        self.serves_api.return_value = True
+
+    def test_install_hook_engine(self):
+        self.serves_api.return_value = False
+        relations.install()
+        self.assertTrue(self.install_packages.called)
+        self.assertFalse(self.open_port.called)
+        self.kv.return_value.set.assert_called_with('heat:role',
+                                                    self.role.return_value)
 
     def test_install_hook(self):
         repo = 'cloud:precise-havana'
-        self.determine_packages.return_value = [
-            'python-keystoneclient', 'uuid', 'heat-api',
-            'heat-api-cfn', 'heat-engine']
         self.test_config.set('openstack-origin', repo)
         relations.install()
         self.configure_installation_source.assert_called_with(repo)
-        self.assertTrue(self.apt_update.called)
-        self.apt_install.assert_called_with(['python-keystoneclient',
-                                             'uuid', 'heat-api',
-                                             'heat-api-cfn',
-                                             'heat-engine'], fatal=True)
+        self.assertTrue(self.install_packages.called)
         self.assertTrue(self.execd_preinstall.called)
 
     @patch.object(relations, 'configure_https')
     def test_config_changed_no_upgrade(self, mock_configure_https):
         self.openstack_upgrade_available.return_value = False
         relations.config_changed()
+        self.assertTrue(self.restart_deferred_services.called)
+
+    def test_leader_settings_changed(self):
+        relations.leader_settings_changed()
+        self.record_migration_state.assert_called_once_with()
+        self.assertTrue(self.restart_deferred_services.called)
+
+    def test_update_status_restarts_deferred_services(self):
+        relations.update_status()
+        self.assertTrue(self.restart_deferred_services.called)
 
     @patch.object(relations, 'configure_https')
     def test_config_changed_with_upgrade(self, mock_configure_https):
@@ -190,7 +219,7 @@ class HeatRelationTests(CharmTestCase):
         relations.relation_broken()
         self.assertTrue(configs.write_all.called)
 
-    @patch.object(relations, 'canonical_url')
+    @patch('charmhelpers.contrib.openstack.ip.canonical_url')
     def test_identity_service_joined(self, _canonical_url):
         "It properly requests unclustered endpoint via identity-service"
         _canonical_url.return_value = 'http://heatnode1'
@@ -210,7 +239,20 @@ class HeatRelationTests(CharmTestCase):
         }
         self.relation_set.assert_called_with(**expected)
 
-    @patch.object(relations, 'canonical_url')
+    @patch('charmhelpers.contrib.openstack.ip.canonical_url')
+    def test_identity_service_joined_engine(self, _canonical_url):
+        _canonical_url.return_value = 'http://heat.example.com'
+        self.serves_api.return_value = False
+        relations.identity_joined()
+        self.assertFalse(self.relation_set.called)
+
+        for t in ('admin', 'internal', 'public'):
+            self.test_config.set('os-{}-hostname'.format(t),
+                                 'heat.example.com')
+        relations.identity_joined()
+        self.assertTrue(self.relation_set.called)
+
+    @patch('charmhelpers.contrib.openstack.ip.canonical_url')
     def test_identity_service_joined_with_relation_id(self, _canonical_url):
         _canonical_url.return_value = 'http://heatnode1'
         relations.identity_joined(rid='identity-service:0')
@@ -263,6 +305,35 @@ class HeatRelationTests(CharmTestCase):
         relations.identity_changed()
         self.assertTrue(configs.write_all.called)
 
+    @patch.object(relations, 'identity_joined')
+    @patch('charmhelpers.contrib.hardening.audits.apache.apache_reloaded')
+    @patch.object(relations, 'service_reload')
+    @patch('subprocess.check_call')
+    @patch.object(relations, 'CONFIGS')
+    def test_configure_https(self, configs, check_call, service_reload,
+                             apache_reloaded, identity_joined):
+        configs.complete_contexts.return_value = ['https']
+        self.relation_ids.return_value = []
+        relations.configure_https()
+        check_call.assert_called_with(['a2ensite',
+                                       'openstack_https_frontend'])
+        service_reload.assert_called_with('apache2', restart_on_failure=True)
+        self.assertTrue(apache_reloaded.called)
+
+    @patch.object(relations, 'identity_joined')
+    @patch.object(relations, 'service_reload')
+    @patch('subprocess.check_call')
+    @patch.object(relations, 'CONFIGS')
+    def test_configure_https_engine(self, configs, check_call,
+                                    service_reload, identity_joined):
+        self.serves_api.return_value = False
+        self.relation_ids.return_value = ['identity-service:0']
+        relations.configure_https()
+        self.assertTrue(configs.write_all.called)
+        self.assertFalse(check_call.called)
+        self.assertFalse(service_reload.called)
+        identity_joined.assert_called_with(rid='identity-service:0')
+
     @patch.object(relations, 'CONFIGS')
     def test_identity_changed_incomplete(self, configs):
         configs.complete_contexts.return_value = []
@@ -290,6 +361,13 @@ class HeatRelationTests(CharmTestCase):
         relations.db_changed()
         self.assertFalse(self.migrate_database.called)
 
+    @patch.object(relations, 'CONFIGS')
+    def test_ha_joined_engine(self, configs):
+        self.serves_api.return_value = False
+        relations.ha_joined()
+        self.assertFalse(self.get_hacluster_config.called)
+        self.assertFalse(self.relation_set.called)
+
     @patch.object(relations, 'CONFIGS')
     def test_ha_joined(self, configs):
         self.get_hacluster_config.return_value = {
@@ -351,3 +429,41 @@ class HeatRelationTests(CharmTestCase):
         relations.ha_joined()
         self.assertTrue(self.update_dns_ha_resource_params.called)
         self.relation_set.assert_called_with(**args)
+
+    @patch.object(relations, 'os_application_version_set')
+    @patch.object(relations, 'set_os_workload_status')
+    @patch.object(relations, 'hooks')
+    @patch.object(relations, 'kv')
+    def test_main_buffers_unit_state(self, kv, hooks, workload_status,
+                                     version_set):
+        kv.return_value.get.return_value = None
+        relations.main()
+        self.assertTrue(kv.return_value.write_back.called)
+        self.assertTrue(hooks.execute.called)
+        self.assertTrue(workload_status.called)
+        key, profile = kv.return_value.set.call_args[0]
+        self.assertEqual(key, relations.HOOK_PROFILE_KEY)
+        timings = list(profile.values())[0]
+        self.assertEqual(sorted(timings),
+                         ['hook', 'import', 'imports', 'status'])
+
+    @patch.object(relations, 'kv')
+    def test_record_hook_profile(self, kv):
+        kv.return_value.get.return_value = {'install': {'hook': 1.0}}
+        relations.record_hook_profile(
+            'leader-elected', {'hook': 0.12345},
+            {'charmhelpers.core.host': 0.01234})
+        kv.return_value.set.assert_called_with(relations.HOOK_PROFILE_KEY, {
+            'install': {'hook': 1.0},
+            'leader-elected': {
+                'hook': 0.123,
+                'imports': {'charmhelpers.core.host': 0.012},
+            },
+        })
+
+    def test_configs_registered_on_first_use(self):
+        self.assertIsNone(relations.CONFIGS)
+        configs = relations.get_configs()
+        self.assertEqual(configs, self.register_configs.return_value)
+        self.assertEqual(relations.get_configs(), configs)
+        self.register_configs.assert_called_once_with()
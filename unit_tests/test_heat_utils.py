@@ -12,12 +12,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import yaml
+
 from collections import OrderedDict
 from mock import patch, MagicMock, call
 from test_utils import CharmTestCase
 
 from charmhelpers.core import hookenv
 
+# python-apt is not installed as part of test-requirements but is imported by
+# the hardening checks sysctl_settings() reads, so create a fake import.
+sys.modules.setdefault('apt', MagicMock())
+
 _conf = hookenv.config
 hookenv.config = MagicMock()
 
@@ -33,12 +44,41 @@ TO_PATCH = [
     'configure_installation_source',
     'apt_install',
     'apt_update',
+    'apt_update_if_changed',
     'apt_upgrade',
+    'filter_installed_packages',
+    'plan_packages',
     'check_call',
+    'call',
+    'Popen',
+    'service_running',
+    'determine_api_port',
     'service_start',
     'service_stop',
+    'leader_get',
+    'leader_set',
+    'is_elected_leader',
+    'migration_until_path',
+    'db_version',
+    'db_head_version',
+    'kv',
     'token_cache_pkgs',
     'enable_memcache',
+    'api_worker_count',
+    'create_sysctl',
+    'read_sysctl_conf',
+    'init_is_systemd',
+    'path_hash',
+    'render',
+    'HeatServiceOverridesContext',
+    'service_pause',
+    'service_resume',
+    'open_port',
+    'close_port',
+    'charm_dir',
+    'local_unit',
+    'relation_ids',
+    'related_units',
 ]
 
 
@@ -52,6 +92,12 @@ RESTART_MAP = OrderedDict([
     ('/etc/apache2/sites-available/openstack_https_frontend.conf',
      ['apache2']),
     ('/etc/memcached.conf', ['memcached']),
+    ('/etc/systemd/system/heat-api.service.d/heat-overrides.conf',
+     ['heat-api']),
+    ('/etc/systemd/system/heat-api-cfn.service.d/heat-overrides.conf',
+     ['heat-api-cfn']),
+    ('/etc/systemd/system/heat-engine.service.d/heat-overrides.conf',
+     ['heat-engine']),
 ])
 
 
@@ -60,6 +106,12 @@ class HeatUtilsTests(CharmTestCase):
     def setUp(self):
         super(HeatUtilsTests, self).setUp(utils, TO_PATCH)
         self.config.side_effect = self.test_config.get
+        self.init_is_systemd.return_value = True
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.migration_until = os.path.join(tmp, 'migration-until')
+        self.migration_until_path.return_value = self.migration_until
+        self.filter_installed_packages.return_value = []
 
     @patch('charmhelpers.contrib.openstack.context.SubordinateConfigContext')
     def test_determine_packages(self, subcontext):
@@ -77,21 +129,163 @@ class HeatUtilsTests(CharmTestCase):
                       utils.BASE_SERVICES))
         self.assertEqual(ex, pkgs)
 
+    @patch('charmhelpers.contrib.openstack.context.SubordinateConfigContext')
+    def test_determine_packages_roles(self, subcontext):
+        self.token_cache_pkgs.return_value = ['memcached']
+        self.test_config.set('role', 'api')
+        self.assertEqual(sorted(utils.determine_packages()),
+                         sorted(utils.BASE_PACKAGES +
+                                ['memcached', 'heat-api', 'heat-api-cfn']))
+        self.test_config.set('role', 'engine')
+        self.assertEqual(sorted(utils.determine_packages()),
+                         ['heat-engine', 'python-keystoneclient',
+                          'python-six', 'python-swiftclient', 'uuid'])
+
     def test_restart_map(self):
         self.assertEqual(RESTART_MAP, utils.restart_map())
 
+    def test_restart_map_engine(self):
+        self.test_config.set('role', 'engine')
+        self.assertEqual(utils.restart_map(), OrderedDict([
+            ('/etc/heat/heat.conf', ['heat-engine']),
+            ('/etc/systemd/system/heat-engine.service.d/heat-overrides.conf',
+             ['heat-engine']),
+        ]))
+
+    def test_restart_map_api(self):
+        self.test_config.set('role', 'api')
+        _map = utils.restart_map()
+        self.assertEqual(_map['/etc/heat/heat.conf'],
+                         ['heat-api', 'heat-api-cfn'])
+        self.assertEqual(_map['/etc/haproxy/haproxy.cfg'], ['haproxy'])
+        self.assertFalse(
+            '/etc/systemd/system/heat-engine.service.d/heat-overrides.conf'
+            in _map)
+
+    def test_role_invalid(self):
+        self.test_config.set('role', 'worker')
+        self.assertEqual(utils.role(), 'all')
+        self.assertEqual(utils.assess_role(None)[0], 'blocked')
+
+    def test_assess_role(self):
+        self.assertEqual(utils.assess_role(None)[0], 'active')
+        self.test_config.set('role', 'engine')
+        self.assertEqual(utils.assess_role(None)[0], 'blocked')
+        for t in ('admin', 'internal', 'public'):
+            self.test_config.set('os-{}-hostname'.format(t),
+                                 'heat.example.com')
+        self.assertEqual(utils.assess_role(None)[0], 'active')
+
+    @patch.object(utils, 'install_packages')
+    def test_configure_role_unchanged(self, install_packages):
+        self.kv.return_value.get.return_value = 'all'
+        utils.configure_role()
+        self.assertFalse(install_packages.called)
+        self.assertFalse(self.service_pause.called)
+        self.assertFalse(self.open_port.called)
+        self.assertFalse(self.close_port.called)
+
+    @patch.object(utils, 'install_packages')
+    def test_configure_role(self, install_packages):
+        self.kv.return_value.get.return_value = 'all'
+        self.test_config.set('role', 'engine')
+        utils.configure_role()
+        self.assertTrue(install_packages.called)
+        self.service_pause.assert_has_calls([
+            call('heat-api'), call('heat-api-cfn'), call('haproxy'),
+            call('apache2'), call('memcached')])
+        self.assertFalse(self.service_resume.called)
+        self.kv.return_value.set.assert_called_with('heat:role', 'engine')
+        self.assertEqual(self.close_port.call_args_list,
+                         [call(8000), call(8004)])
+        self.assertFalse(self.open_port.called)
+
+        self.service_pause.reset_mock()
+        self.close_port.reset_mock()
+        self.kv.return_value.get.return_value = 'engine'
+        self.test_config.set('role', 'api')
+        utils.configure_role()
+        self.service_pause.assert_called_once_with('heat-engine')
+        self.service_resume.assert_has_calls([
+            call('heat-api'), call('heat-api-cfn'), call('haproxy'),
+            call('apache2')])
+        self.assertEqual(self.open_port.call_args_list,
+                         [call(8000), call(8004)])
+        self.assertFalse(self.close_port.called)
+
+        # api to all keeps the APIs, and their ports, as they are.
+        self.open_port.reset_mock()
+        self.kv.return_value.get.return_value = 'api'
+        self.test_config.set('role', 'all')
+        utils.configure_role()
+        self.assertFalse(self.open_port.called)
+        self.assertFalse(self.close_port.called)
+
+    @patch.object(utils, 'install_packages')
+    def test_configure_role_engine_to_api(self, install_packages):
+        self.kv.return_value.get.return_value = 'engine'
+        self.test_config.set('role', 'api')
+        utils.configure_role()
+        self.filter_installed_packages.assert_called_once_with(
+            utils.CHARM_SERVICES)
+        # The token cache stays up alongside the APIs.
+        self.service_pause.assert_called_once_with('heat-engine')
+        self.assertEqual(self.service_resume.call_args_list, [
+            call('heat-api'), call('heat-api-cfn'), call('haproxy'),
+            call('apache2')])
+        self.kv.return_value.set.assert_called_with('heat:role', 'api')
+
+    @patch.object(utils, 'install_packages')
+    def test_configure_role_skips_missing_services(self, install_packages):
+        # No token cache on this release, so memcached is not installed.
+        self.kv.return_value.get.return_value = 'all'
+        self.test_config.set('role', 'engine')
+        self.filter_installed_packages.return_value = ['memcached']
+        utils.configure_role()
+        self.assertEqual(self.service_pause.call_args_list, [
+            call('heat-api'), call('heat-api-cfn'), call('haproxy'),
+            call('apache2')])
+
     def test_openstack_upgrade(self):
         self.config.side_effect = None
         self.config.return_value = 'cloud:precise-havana'
         self.get_os_codename_install_source.return_value = 'havana'
+        self.plan_packages.return_value = (['heat-api'], [])
         configs = MagicMock()
         utils.do_openstack_upgrade(configs)
-        self.assertTrue(self.apt_update.called)
+        self.assertTrue(self.apt_update_if_changed.called)
         self.assertTrue(self.apt_upgrade.called)
         self.assertTrue(self.apt_install.called)
         configs.set_release.assert_called_with(openstack_release='havana')
         self.assertTrue(configs.write_all.called)
 
+    @patch.object(utils, 'migrate_database')
+    def test_openstack_upgrade_follower(self, migrate_database):
+        self.config.side_effect = None
+        self.config.return_value = 'cloud:precise-havana'
+        self.get_os_codename_install_source.return_value = 'havana'
+        self.plan_packages.return_value = (['heat-api'], [])
+        self.is_elected_leader.return_value = False
+        utils.do_openstack_upgrade(MagicMock())
+        self.assertFalse(migrate_database.called)
+        self.assertFalse(self.leader_set.called)
+
+        self.is_elected_leader.return_value = True
+        utils.do_openstack_upgrade(MagicMock())
+        migrate_database.assert_called_once_with()
+
+    def test_install_packages(self):
+        self.plan_packages.return_value = (['heat-api'], ['heat-engine'])
+        utils.install_packages()
+        self.assertTrue(self.apt_update_if_changed.called)
+        self.apt_install.assert_called_with(['heat-api', 'heat-engine'],
+                                            fatal=True)
+
+    def test_install_packages_up_to_date(self):
+        self.plan_packages.return_value = ([], [])
+        utils.install_packages()
+        self.assertFalse(self.apt_install.called)
+
     def test_api_ports(self):
         cfn = utils.api_port('heat-api-cfn')
         self.assertEqual(cfn, 8000)
@@ -99,10 +293,372 @@ class HeatUtilsTests(CharmTestCase):
         self.assertEqual(cfn, 8004)
 
     def test_migrate_database(self):
-        utils.migrate_database()
+        self.db_version.side_effect = [72, 73]
+        self.db_head_version.return_value = 73
+        self.assertTrue(utils.migrate_database())
         self.assertTrue(self.log.called)
         self.check_call.assert_called_with(['heat-manage', 'db_sync'])
         expected = [call('heat-api'), call('heat-api-cfn'),
                     call('heat-engine'), call('apache2')]
         self.service_stop.assert_has_calls(expected, any_order=True)
         self.service_start.assert_has_calls(expected, any_order=True)
+        self.assertEqual(self.leader_set.call_args_list[-1],
+                         call({'heat-db-migration': '',
+                               'heat-db-version': 73}))
+        # The copy for heat_recycle is removed once the migration is over,
+        # and unitdata is left for the end of the hook.
+        self.assertFalse(os.path.exists(self.migration_until))
+        self.assertFalse(self.kv.return_value.checkpoint.called)
+
+    def test_migrate_database_current(self):
+        self.db_version.return_value = 73
+        self.db_head_version.return_value = 73
+        self.assertFalse(utils.migrate_database())
+        self.assertFalse(self.check_call.called)
+        self.assertFalse(self.service_stop.called)
+        self.assertFalse(self.leader_set.called)
+
+    def test_migrate_database_online(self):
+        self.test_config.set('database-migration-mode', 'online')
+        self.db_version.return_value = None
+        self.db_head_version.return_value = 73
+        utils.migrate_database()
+        self.check_call.assert_called_with(['heat-manage', 'db_sync'])
+        self.service_stop.assert_called_once_with('heat-engine')
+        self.service_start.assert_called_once_with('heat-engine')
+
+    def test_record_migration_state(self):
+        self.leader_get.return_value = '1000.0'
+        utils.record_migration_state()
+        self.leader_get.assert_called_with('heat-db-migration')
+        with open(self.migration_until) as f:
+            self.assertEqual(float(f.read()),
+                             1000.0 + utils.DB_MIGRATION_TIMEOUT)
+        self.assertFalse(self.kv.called)
+        utils.record_migration_state('')
+        self.assertFalse(os.path.exists(self.migration_until))
+        utils.record_migration_state('')
+
+    @patch.object(utils, 'queue_restart')
+    @patch('time.time')
+    def test_deferred_restart(self, _time, queue_restart):
+        _time.return_value = 1000.0
+        self.leader_get.return_value = '900.0'
+        db = MagicMock()
+        db.get.return_value = []
+        self.kv.return_value = db
+        utils.deferred_restart('heat-engine')
+        self.assertFalse(queue_restart.called)
+        db.set.assert_called_with('heat:deferred-restarts', ['heat-engine'])
+
+        self.leader_get.return_value = ''
+        utils.deferred_restart('heat-api')
+        queue_restart.assert_called_with('heat-api')
+
+    @patch.object(utils, 'restart_services')
+    def test_restart_deferred_services(self, restart_services):
+        self.leader_get.return_value = ''
+        db = MagicMock()
+        db.get.return_value = ['heat-engine', 'heat-api']
+        self.kv.return_value = db
+        utils.restart_deferred_services()
+        restart_services.assert_called_once_with(['heat-engine', 'heat-api'])
+        db.unset.assert_called_with('heat:deferred-restarts')
+
+    @patch.object(utils, 'restart_services')
+    @patch('time.time')
+    def test_restart_deferred_services_expired_migration(self, _time,
+                                                         restart_services):
+        # The leader never cleared its marker, e.g. it died mid-migration.
+        _time.return_value = 1000.0 + utils.DB_MIGRATION_TIMEOUT
+        self.leader_get.return_value = '1000.0'
+        db = MagicMock()
+        db.get.return_value = ['heat-engine']
+        self.kv.return_value = db
+        utils.restart_deferred_services()
+        restart_services.assert_called_once_with(['heat-engine'])
+        db.unset.assert_called_with('heat:deferred-restarts')
+
+    @patch.object(utils, 'restart_services')
+    @patch('time.time')
+    def test_restart_deferred_services_during_migration(self, _time,
+                                                        restart_services):
+        _time.return_value = 1000.0 + utils.DB_MIGRATION_TIMEOUT - 1
+        self.leader_get.return_value = '1000.0'
+        db = MagicMock()
+        db.get.return_value = ['heat-engine']
+        self.kv.return_value = db
+        utils.restart_deferred_services()
+        self.assertFalse(restart_services.called)
+        self.assertFalse(db.unset.called)
+
+    @patch.object(utils, 'restart_services')
+    def test_restart_deferred_services_none_pending(self, restart_services):
+        db = MagicMock()
+        db.get.return_value = []
+        self.kv.return_value = db
+        utils.restart_deferred_services()
+        self.assertFalse(self.leader_get.called)
+        self.assertFalse(restart_services.called)
+
+    @patch.object(utils, 'restart_services')
+    @patch.object(utils, 'atexit')
+    def test_queue_restart(self, atexit, restart_services):
+        utils.queue_restart('heat-api')
+        utils.queue_restart('heat-engine')
+        utils.queue_restart('heat-api')
+        atexit.assert_called_once_with(utils.restart_pending_services)
+        utils.restart_pending_services()
+        restart_services.assert_called_once_with(['heat-api', 'heat-engine'])
+        utils.restart_pending_services()
+        self.assertEqual(restart_services.call_count, 1)
+
+    @patch('socket.create_connection')
+    def test_service_ready(self, create_connection):
+        self.service_running.return_value = True
+        self.determine_api_port.return_value = 8994
+        self.assertTrue(utils.service_ready('heat-engine'))
+        self.assertFalse(create_connection.called)
+        self.assertTrue(utils.service_ready('heat-api'))
+        create_connection.assert_called_once_with(('127.0.0.1', 8994),
+                                                  timeout=1)
+        self.determine_api_port.assert_called_once_with(
+            8004, singlenode_mode=True)
+
+        create_connection.side_effect = socket.error
+        self.assertFalse(utils.service_ready('heat-api'))
+        self.service_running.return_value = False
+        self.assertFalse(utils.service_ready('heat-engine'))
+
+    @patch('time.sleep')
+    @patch.object(utils, 'service_ready')
+    def test_wait_for_services(self, service_ready, sleep):
+        ready = {'heat-api': [False, True], 'heat-engine': [True]}
+        service_ready.side_effect = lambda svc: ready[svc].pop(0)
+        self.assertEqual(
+            utils.wait_for_services(['heat-api', 'heat-engine']), [])
+        sleep.assert_called_once_with(utils.RESTART_POLL_INTERVAL)
+
+    @patch('time.sleep')
+    @patch('time.time')
+    @patch.object(utils, 'service_ready')
+    def test_wait_for_services_timeout(self, service_ready, _time, sleep):
+        _time.side_effect = [1000, 1060, 1120]
+        service_ready.side_effect = lambda svc: svc != 'heat-api'
+        self.assertEqual(
+            utils.wait_for_services(['heat-api', 'heat-engine']),
+            ['heat-api'])
+        self.assertEqual(sleep.call_count, 1)
+
+    @patch.object(utils, 'wait_for_services')
+    def test_restart_services(self, wait_for_services):
+        db = MagicMock()
+        db.get.return_value = []
+        self.kv.return_value = db
+        wait_for_services.return_value = []
+        self.assertEqual(utils.restart_services(['heat-api', 'heat-engine']),
+                         [])
+        self.call.assert_called_once_with(['systemctl', 'restart',
+                                           'heat-api', 'heat-engine'])
+        wait_for_services.assert_called_once_with(['heat-api',
+                                                   'heat-engine'])
+        db.unset.assert_called_once_with(utils.RESTART_FAILURES_KEY)
+
+    @patch.object(utils, 'wait_for_services')
+    def test_restart_services_upstart(self, wait_for_services):
+        self.init_is_systemd.return_value = False
+        wait_for_services.return_value = []
+        utils.restart_services(['heat-api', 'heat-engine'])
+        self.Popen.assert_has_calls([
+            call(['service', 'heat-api', 'restart']),
+            call(['service', 'heat-engine', 'restart']),
+        ], any_order=True)
+        self.assertEqual(self.Popen.return_value.wait.call_count, 2)
+        self.assertFalse(self.call.called)
+
+    @patch.object(utils, 'wait_for_services')
+    def test_restart_services_not_ready(self, wait_for_services):
+        db = MagicMock()
+        db.get.return_value = ['heat-api-cfn', 'heat-engine']
+        self.kv.return_value = db
+        wait_for_services.return_value = ['heat-api']
+        self.assertEqual(utils.restart_services(['heat-api', 'heat-engine']),
+                         ['heat-api', 'heat-api-cfn'])
+        db.set.assert_called_once_with(utils.RESTART_FAILURES_KEY,
+                                       ['heat-api', 'heat-api-cfn'])
+
+    @patch.object(utils, 'service_ready')
+    def test_assess_restarts(self, service_ready):
+        db = MagicMock()
+        db.get.return_value = []
+        self.kv.return_value = db
+        self.assertEqual(utils.assess_restarts()[0], 'active')
+        self.assertFalse(db.unset.called)
+
+        db.get.return_value = ['heat-api', 'heat-engine']
+        service_ready.side_effect = lambda svc: svc == 'heat-engine'
+        self.assertEqual(utils.assess_restarts(), (
+            'blocked', 'Services not ready after restart: heat-api'))
+        db.set.assert_called_once_with(utils.RESTART_FAILURES_KEY,
+                                       ['heat-api'])
+
+        service_ready.side_effect = None
+        service_ready.return_value = True
+        self.assertEqual(utils.assess_restarts()[0], 'active')
+        db.unset.assert_called_once_with(utils.RESTART_FAILURES_KEY)
+
+    @patch.object(utils, 'assess_restarts')
+    def test_assess_charm_status(self, assess_restarts):
+        assess_restarts.return_value = ('blocked', 'not ready')
+        self.assertEqual(utils.assess_charm_status(None),
+                         ('blocked', 'not ready'))
+        self.test_config.set('role', 'bogus')
+        self.assertEqual(utils.assess_charm_status(None)[1],
+                         'Invalid role bogus, expected one of all, api, '
+                         'engine')
+
+    def test_sysctl_settings_default(self):
+        self.assertEqual(utils.sysctl_settings(), {})
+
+    def test_sysctl_settings_api_high_concurrency(self):
+        self.test_config.set('sysctl-profile', 'api-high-concurrency')
+        self.api_worker_count.return_value = 4
+        self.assertEqual(utils.sysctl_settings(), {
+            'net.core.somaxconn': '20000',
+            'net.ipv4.tcp_max_syn_backlog': '20000',
+            'net.ipv4.ip_local_port_range': '32768 65535',
+            'net.ipv4.tcp_tw_reuse': '1',
+            'net.ipv4.tcp_fin_timeout': '30',
+        })
+        self.api_worker_count.return_value = 1024
+        settings = utils.sysctl_settings()
+        self.assertEqual(settings['net.ipv4.ip_local_port_range'],
+                         '10240 65535')
+        self.assertEqual(settings['net.ipv4.ip_local_reserved_ports'],
+                         '11211')
+
+    def test_sysctl_settings_hardened(self):
+        self.test_config.set('sysctl-profile', 'api-high-concurrency')
+        self.test_config.set('harden', 'os ssh')
+        self.api_worker_count.return_value = 4
+        settings = utils.sysctl_settings()
+        self.assertFalse('net.ipv4.tcp_tw_reuse' in settings)
+        self.assertEqual(settings['net.core.somaxconn'], '20000')
+
+        self.test_config.set('sysctl-profile',
+                             '{net.ipv4.tcp_syncookies: 0, vm.swappiness: 1}')
+        self.assertEqual(utils.sysctl_settings(), {'vm.swappiness': '1'})
+
+    def test_sysctl_settings_invalid(self):
+        self.test_config.set('sysctl-profile', 'fast')
+        self.assertEqual(utils.sysctl_settings(), None)
+
+    def test_configure_sysctl(self):
+        self.test_config.set('sysctl-profile', '{net.core.somaxconn: 8192}')
+        self.read_sysctl_conf.return_value = {}
+        utils.configure_sysctl()
+        settings, path = self.create_sysctl.call_args[0]
+        self.assertEqual(yaml.safe_load(settings),
+                         {'net.core.somaxconn': '8192'})
+        self.assertEqual(path, utils.SYSCTL_CONF)
+
+    def test_configure_sysctl_unchanged(self):
+        self.test_config.set('sysctl-profile', '{net.core.somaxconn: 8192}')
+        self.read_sysctl_conf.return_value = {'net.core.somaxconn': '8192'}
+        utils.configure_sysctl()
+        self.assertFalse(self.create_sysctl.called)
+
+    @patch('os.remove')
+    def test_configure_sysctl_back_to_default(self, remove):
+        self.read_sysctl_conf.return_value = {'net.core.somaxconn': '8192'}
+        utils.configure_sysctl()
+        remove.assert_called_once_with(utils.SYSCTL_CONF)
+        self.assertFalse(self.create_sysctl.called)
+
+    def test_service_override_files_upstart(self):
+        self.init_is_systemd.return_value = False
+        self.assertEqual(utils.service_override_files(), OrderedDict([
+            ('heat-api', '/etc/init/heat-api.override'),
+            ('heat-api-cfn', '/etc/init/heat-api-cfn.override'),
+            ('heat-engine', '/etc/init/heat-engine.override'),
+        ]))
+
+    def test_configure_service_overrides(self):
+        self.path_hash.side_effect = ['a', 'a', 'b', 'b', 'c', 'd']
+        self.HeatServiceOverridesContext.side_effect = (
+            lambda svc: lambda: {'service': svc})
+        utils.configure_service_overrides()
+        self.render.assert_has_calls([
+            call('heat-overrides.conf',
+                 '/etc/systemd/system/heat-api.service.d/heat-overrides.conf',
+                 {'service': 'heat-api'}, perms=0o644),
+            call('heat-overrides.conf',
+                 '/etc/systemd/system/heat-api-cfn.service.d/'
+                 'heat-overrides.conf',
+                 {'service': 'heat-api-cfn'}, perms=0o644),
+            call('heat-overrides.conf',
+                 '/etc/systemd/system/heat-engine.service.d/'
+                 'heat-overrides.conf',
+                 {'service': 'heat-engine'}, perms=0o644),
+        ])
+        self.check_call.assert_called_once_with(['systemctl',
+                                                 'daemon-reload'])
+
+    def test_configure_service_overrides_unchanged(self):
+        self.path_hash.return_value = 'a'
+        utils.configure_service_overrides()
+        self.assertEqual(self.render.call_count, 3)
+        self.assertFalse(self.check_call.called)
+
+    def test_configure_service_overrides_upstart(self):
+        self.init_is_systemd.return_value = False
+        self.path_hash.side_effect = [None, 'a', None, 'b', None, 'c']
+        utils.configure_service_overrides()
+        self.render.assert_any_call(
+            'heat.override', '/etc/init/heat-engine.override',
+            self.HeatServiceOverridesContext.return_value.return_value,
+            perms=0o644)
+        self.assertFalse(self.check_call.called)
+
+    def test_engine_recycle_minute(self):
+        self.local_unit.return_value = 'heat/10'
+        self.relation_ids.return_value = ['cluster:1']
+        self.related_units.return_value = ['heat/2', 'heat/9']
+        self.assertEqual(utils.engine_recycle_minute(), 40)
+        self.local_unit.return_value = 'heat/2'
+        self.assertEqual(utils.engine_recycle_minute(), 0)
+
+    def test_engine_recycle_minute_single_unit(self):
+        self.local_unit.return_value = 'heat/3'
+        self.relation_ids.return_value = []
+        self.assertEqual(utils.engine_recycle_minute(), 0)
+
+    def test_configure_engine_recycling(self):
+        self.test_config.set('engine-recycle-rss', 2048)
+        self.charm_dir.return_value = '/var/lib/juju/agents/unit-heat-0/charm'
+        self.local_unit.return_value = 'heat/0'
+        self.relation_ids.return_value = []
+        utils.configure_engine_recycling()
+        self.render.assert_called_once_with(
+            'heat-engine-recycle', utils.ENGINE_RECYCLE_CRON,
+            {'charm_dir': '/var/lib/juju/agents/unit-heat-0/charm',
+             'minute': 0, 'rss_limit': 2048, 'interval': 0},
+            perms=0o644)
+
+    @patch('os.remove')
+    @patch('os.path.exists')
+    def test_configure_engine_recycling_disabled(self, exists, remove):
+        exists.return_value = True
+        utils.configure_engine_recycling()
+        self.assertFalse(self.render.called)
+        remove.assert_called_once_with(utils.ENGINE_RECYCLE_CRON)
+
+    @patch('os.remove')
+    @patch('os.path.exists')
+    def test_configure_engine_recycling_api_role(self, exists, remove):
+        self.test_config.set('engine-recycle-interval', 24)
+        self.test_config.set('role', 'api')
+        exists.return_value = False
+        utils.configure_engine_recycling()
+        self.assertFalse(self.render.called)
+        self.assertFalse(remove.called)
@@ -0,0 +1,107 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+from mock import patch, MagicMock
+from test_utils import CharmTestCase
+
+from charmhelpers.core import hookenv, unitdata
+
+TO_PATCH = [
+    'local_unit',
+    'log',
+    'subprocess',
+]
+
+
+class RelationSetTests(CharmTestCase):
+
+    def setUp(self):
+        super(RelationSetTests, self).setUp(hookenv, TO_PATCH)
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.db = unitdata.Storage(os.path.join(tmp, 'state.db'))
+        self.addCleanup(self.db.close)
+        kv = patch.object(unitdata, 'kv', return_value=self.db)
+        kv.start()
+        self.addCleanup(kv.stop)
+        env = patch.dict(os.environ, {'JUJU_VERSION': '2.9.42',
+                                      'JUJU_RELATION_ID': 'cluster:1'})
+        env.start()
+        self.addCleanup(env.stop)
+        self.local_unit.return_value = 'heat/0'
+        self.subprocess.check_output.return_value = 'usage: --file'
+
+    def sets(self):
+        return self.subprocess.check_call.call_count
+
+    def test_unchanged_settings_skipped(self):
+        hookenv.relation_set(relation_settings={'a': 1, 'b': 'x'})
+        hookenv.relation_set(relation_settings={'b': 'x'}, a=1)
+        self.assertEqual(self.sets(), 1)
+        hookenv.relation_set(relation_settings={'a': 2, 'b': 'x'})
+        self.assertEqual(self.sets(), 2)
+
+    def test_fingerprints_per_relation(self):
+        hookenv.relation_set(relation_settings={'a': 1})
+        hookenv.relation_set(relation_id='cluster:2',
+                             relation_settings={'a': 1})
+        hookenv.relation_set(relation_id='cluster:1',
+                             relation_settings={'a': 1})
+        self.assertEqual(self.sets(), 2)
+
+    def test_overlapping_set_replayed(self):
+        hookenv.relation_set(relation_settings={'a': 1, 'b': 1})
+        hookenv.relation_set(relation_settings={'b': 2})
+        # b was overwritten, so the first set is no longer in effect.
+        hookenv.relation_set(relation_settings={'a': 1, 'b': 1})
+        self.assertEqual(self.sets(), 3)
+        self.assertEqual(
+            list(self.db.get(hookenv.RELATION_SET_KEY % 'cluster:1')),
+            ['["a", "b"]'])
+
+    def test_failed_set_not_recorded(self):
+        self.subprocess.check_call.side_effect = Exception('failed')
+        with self.assertRaises(Exception):
+            hookenv.relation_set(relation_settings={'a': 1})
+        self.assertIsNone(self.db.get(hookenv.RELATION_SET_KEY % 'cluster:1'))
+
+    def test_no_relation_id_never_skipped(self):
+        with patch.dict(os.environ):
+            del os.environ['JUJU_RELATION_ID']
+            hookenv.relation_set(relation_settings={'a': 1})
+            hookenv.relation_set(relation_settings={'a': 1})
+        self.assertEqual(self.sets(), 2)
+
+    def test_file_support_probed_once_per_version(self):
+        hookenv.relation_set(relation_settings={'a': 1})
+        hookenv.relation_set(relation_settings={'a': 2})
+        self.assertEqual(self.subprocess.check_output.call_count, 1)
+        with patch.dict(os.environ, {'JUJU_VERSION': '3.1.0'}):
+            hookenv.relation_set(relation_settings={'a': 3})
+        self.assertEqual(self.subprocess.check_output.call_count, 2)
+
+    def test_forgotten_on_relation_broken(self):
+        hookenv.relation_set(relation_settings={'a': 1})
+        hooks = hookenv.Hooks()
+        broken = MagicMock()
+        hooks.register('cluster-relation-broken', broken)
+        hooks.execute(['hooks/cluster-relation-broken'])
+        self.assertTrue(broken.called)
+        self.assertIsNone(self.db.get(hookenv.RELATION_SET_KEY % 'cluster:1'))
+        hookenv.relation_set(relation_settings={'a': 1})
+        self.assertEqual(self.sets(), 2)
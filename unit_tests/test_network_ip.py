@@ -0,0 +1,238 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+
+import netaddr
+import netifaces
+from mock import patch
+from test_utils import CharmTestCase
+
+from charmhelpers.core import hookenv, unitdata
+from charmhelpers.contrib.network import ip
+
+TO_PATCH = [
+    'log',
+    'subprocess',
+]
+
+IFADDRESSES = {
+    'lo': {
+        netifaces.AF_INET: [{'addr': '127.0.0.1', 'netmask': '255.0.0.0'}],
+        netifaces.AF_INET6: [{'addr': '::1', 'netmask': 'ffff::/128'}],
+    },
+    'eth0': {
+        netifaces.AF_INET: [{'addr': '10.5.0.10', 'netmask': '255.255.255.0',
+                             'broadcast': '10.5.0.255'},
+                            {'addr': '10.6.0.10', 'netmask': '255.255.0.0'}],
+        netifaces.AF_INET6: [
+            {'addr': 'fe80::f816:3eff:fe01:203%eth0',
+             'netmask': 'ffff:ffff:ffff:ffff::/64'},
+            {'addr': '2001:db8:1::f816:3eff:fe01:203',
+             'netmask': 'ffff:ffff:ffff:ffff::/64'},
+            {'addr': '2001:db8:1::99',
+             'netmask': 'ffff:ffff:ffff:ffff::/64'},
+        ],
+    },
+    'eth1': {
+        netifaces.AF_INET: [{'addr': '10.5.0.20', 'netmask': '255.255.0.0'}],
+    },
+    'tun0': {
+        netifaces.AF_INET: [{'addr': '172.16.0.1', 'peer': '172.16.0.2'}],
+    },
+}
+
+IP_ADDR_SHOW = b"""\
+1: lo    inet6 ::1/128 scope host \\       valid_lft forever
+2: eth0    inet6 2001:db8:1::f816:3eff:fe01:203/64 scope global dynamic \\\
+       valid_lft 86394sec preferred_lft 14394sec
+2: eth0    inet6 2001:db8:1::99/64 scope global temporary dynamic \\\
+       valid_lft 86394sec preferred_lft 14394sec
+2: eth0    inet6 fe80::f816:3eff:fe01:203/64 scope link \\\
+       valid_lft forever preferred_lft forever
+"""
+
+
+class AddressTableTests(CharmTestCase):
+
+    def setUp(self):
+        super(AddressTableTests, self).setUp(ip, TO_PATCH)
+        hookenv.cache.clear()
+        self.addCleanup(hookenv.cache.clear)
+        for name, fake in (
+                ('interfaces', lambda: ['lo', 'eth0', 'eth1', 'tun0']),
+                ('ifaddresses', lambda iface: IFADDRESSES[iface])):
+            patcher = patch.object(netifaces, name, side_effect=fake)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.subprocess.check_output.return_value = IP_ADDR_SHOW
+
+    def test_built_once_per_hook(self):
+        ip.get_address_in_network('10.5.0.0/24')
+        ip.get_iface_for_address('10.5.0.1')
+        ip.get_iface_addr('eth0')
+        self.assertEqual(self.interfaces.call_count, 1)
+        self.assertEqual(self.ifaddresses.call_count, 4)
+        hookenv.flush('address_table')
+        ip.get_address_in_network('10.5.0.0/24')
+        self.assertEqual(self.interfaces.call_count, 2)
+
+    def test_address_in_network(self):
+        table = ip.AddressTable()
+        self.assertEqual(
+            table.address_in_network(netaddr.IPNetwork('10.5.0.0/24')),
+            '10.5.0.10')
+        # eth1's /16 does not fit in a /24, but does in a /8.
+        self.assertEqual(
+            table.address_in_network(netaddr.IPNetwork('10.0.0.0/8')),
+            '10.5.0.10')
+        self.assertEqual(
+            table.address_in_network(netaddr.IPNetwork('10.6.0.0/16')),
+            '10.6.0.10')
+        self.assertEqual(
+            table.address_in_network(netaddr.IPNetwork('2001:db8::/32')),
+            '2001:db8:1:0:f816:3eff:fe01:203')
+        self.assertIsNone(
+            table.address_in_network(netaddr.IPNetwork('192.168.0.0/16')))
+        self.assertIsNone(
+            table.address_in_network(netaddr.IPNetwork('10.5.0.128/25')))
+
+    def test_get_address_in_network(self):
+        self.assertEqual(
+            ip.get_address_in_network('192.168.0.0/16 10.5.0.0/16'),
+            '10.5.0.10')
+        self.assertEqual(
+            ip.get_address_in_network('192.168.0.0/16', fallback='x'), 'x')
+        self.assertRaises(ValueError, ip.get_address_in_network,
+                          '192.168.0.0/16', fatal=True)
+
+    def test_network_for_address_first_interface_wins(self):
+        # 10.5.0.1 is in both eth0's /24 and eth1's /16.
+        iface, network, addr = ip.AddressTable().network_for_address(
+            netaddr.IPAddress('10.5.0.1'))
+        self.assertEqual(iface, 'eth0')
+        self.assertEqual(str(network.cidr), '10.5.0.0/24')
+        self.assertEqual(ip.get_iface_for_address('10.5.1.1'), 'eth1')
+        self.assertEqual(ip.get_netmask_for_address('10.5.1.1'),
+                         '255.255.0.0')
+
+    def test_only_first_ipv4_address_bindable(self):
+        self.assertIsNone(ip.get_iface_for_address('10.6.1.1'))
+        self.assertIsNone(ip.get_iface_for_address('192.168.1.1'))
+
+    def test_ipv6_lookups(self):
+        self.assertEqual(ip.get_iface_for_address('2001:db8:1::1'), 'eth0')
+        self.assertEqual(ip.get_netmask_for_address('2001:db8:1::1'), '64')
+        self.assertEqual(ip.resolve_network_cidr('2001:db8:1::1'),
+                         '2001:db8:1::/64')
+        self.assertIsNone(ip.get_iface_for_address('fe80::1'))
+
+    def test_resolve_network_cidr(self):
+        self.assertEqual(ip.resolve_network_cidr('10.5.1.7'), '10.5.0.0/16')
+
+    def test_addresses_without_netmask_skipped(self):
+        self.assertIsNone(ip.get_iface_for_address('172.16.0.1'))
+        self.assertEqual(ip.get_iface_from_addr('172.16.0.1'), 'tun0')
+
+    def test_get_iface_addr(self):
+        self.assertEqual(ip.get_iface_addr('eth0'),
+                         ['10.5.0.10', '10.6.0.10'])
+        self.assertEqual(ip.get_iface_addr('eth0', exc_list=['10.5.0.10']),
+                         ['10.6.0.10'])
+
+    def test_ipv6_flags_read_once(self):
+        table = ip.AddressTable()
+        self.assertEqual(
+            table.ipv6_flags['2001:db8:1::99'],
+            ('eth0', set(['scope', 'global', 'temporary', 'dynamic'])))
+        table.ipv6_flags
+        self.subprocess.check_output.assert_called_once_with(
+            ['ip', '-o', '-6', 'addr', 'show'])
+
+    def test_get_ipv6_addr_skips_temporary(self):
+        self.assertEqual(ip.get_ipv6_addr(iface='eth0'),
+                         ['2001:db8:1::f816:3eff:fe01:203'])
+
+
+class DNSCacheTests(CharmTestCase):
+
+    def setUp(self):
+        super(DNSCacheTests, self).setUp(ip, TO_PATCH + [
+            '_import_dns',
+            '_ns_lookup',
+            'socket',
+            'time',
+        ])
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.db = unitdata.Storage(os.path.join(self.tmp, 'state.db'))
+        self.addCleanup(self.db.close)
+        kv = patch.object(unitdata, 'kv', return_value=self.db)
+        kv.start()
+        self.addCleanup(kv.stop)
+        self.time.time.return_value = 1000
+        self.answers = {'heat-0': ('10.0.0.1', 600),
+                        'heat-1': ('10.0.0.2', 30)}
+        self._ns_lookup.side_effect = \
+            lambda name, rtype: self.answers.get(name, (None, 60))
+        self.socket.gethostbyname.side_effect = Exception('not found')
+
+    def looked_up(self):
+        return sorted(c[0][0] for c in self._ns_lookup.call_args_list)
+
+    def test_get_host_ip(self):
+        self.assertEqual(ip.get_host_ip('heat-0'), '10.0.0.1')
+        self.assertEqual(ip.get_host_ip('heat-1'), '10.0.0.2')
+        self.assertEqual(self.looked_up(), ['heat-0', 'heat-1'])
+
+    def test_answers_cached_for_their_ttl(self):
+        ip.get_host_ip('heat-0')
+        ip.get_host_ip('heat-1')
+        self._ns_lookup.reset_mock()
+        self.time.time.return_value = 1029
+        self.assertEqual(ip.get_host_ip('heat-0'), '10.0.0.1')
+        self.assertEqual(ip.get_host_ip('heat-1'), '10.0.0.2')
+        self.assertEqual(self.looked_up(), [])
+        self.time.time.return_value = 1030
+        ip.get_host_ip('heat-0')
+        ip.get_host_ip('heat-1')
+        self.assertEqual(self.looked_up(), ['heat-1'])
+        self.assertEqual(
+            self.db.get(ip.DNS_CACHE_KEY % ('host', 'heat-1')),
+            {'answer': '10.0.0.2', 'expires': 1060})
+
+    def test_system_resolver_fallback(self):
+        self.socket.gethostbyname.side_effect = None
+        self.socket.gethostbyname.return_value = '10.0.0.3'
+        self.assertEqual(ip.get_host_ip('heat-2'), '10.0.0.3')
+        self.assertEqual(
+            self.db.get(ip.DNS_CACHE_KEY % ('host', 'heat-2'))['expires'],
+            1000 + ip.DNS_DEFAULT_TTL)
+
+    def test_failures_cached_briefly(self):
+        self.answers['heat-2'] = (None, 3600)
+        self.assertEqual(ip.get_host_ip('heat-2', fallback='x'), 'x')
+        self.assertEqual(
+            self.db.get(ip.DNS_CACHE_KEY % ('host', 'heat-2')),
+            {'answer': None, 'expires': 1000 + ip.DNS_NEGATIVE_TTL})
+        self._ns_lookup.reset_mock()
+        self.assertEqual(ip.get_host_ip('heat-2', fallback='y'), 'y')
+        self.assertEqual(self.looked_up(), [])
+        self.assertTrue(self.log.called)
+
+    def test_get_host_ip_for_ip(self):
+        self.assertEqual(ip.get_host_ip('10.0.0.9'), '10.0.0.9')
+        self.assertFalse(self._ns_lookup.called)
@@ -0,0 +1,103 @@
+# Copyright 2016 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from charmhelpers.core import unitdata
+
+
+class WriteBackTests(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.path = os.path.join(tmp, 'unit-state.db')
+        self.db = unitdata.Storage(self.path)
+        self.addCleanup(self.db.close)
+
+    def committed(self, key):
+        """Returns key as another process would see it."""
+        other = unitdata.Storage(self.path)
+        try:
+            return other.get(key)
+        finally:
+            other.close()
+
+    def test_writes_buffered_until_exit(self):
+        self.db.set('kept', 1)
+        self.db.flush()
+        with self.db.write_back():
+            self.db.set('a', 1)
+            self.db.unset('kept')
+            self.db.flush()
+            self.assertEqual(self.db.get('a'), 1)
+            self.assertIsNone(self.db.get('kept'))
+            self.assertIsNone(self.committed('a'))
+            self.assertEqual(self.committed('kept'), 1)
+        self.assertEqual(self.committed('a'), 1)
+        self.assertIsNone(self.committed('kept'))
+
+    def test_rolled_back_on_exception(self):
+        self.db.set('a', 1)
+        self.db.flush()
+        with self.assertRaises(ValueError):
+            with self.db.write_back():
+                self.db.set('a', 2)
+                self.db.set('b', 1)
+                raise ValueError()
+        self.assertEqual(self.db.get('a'), 1)
+        self.assertIsNone(self.db.get('b'))
+        self.assertEqual(self.committed('a'), 1)
+
+    def test_failed_exit_rolled_back(self):
+        with self.assertRaises(SystemExit):
+            with self.db.write_back():
+                self.db.set('a', 1)
+                raise SystemExit(1)
+        self.assertIsNone(self.committed('a'))
+
+    def test_clean_exit_committed(self):
+        with self.assertRaises(SystemExit):
+            with self.db.write_back():
+                self.db.set('a', 1)
+                raise SystemExit(0)
+        self.assertEqual(self.committed('a'), 1)
+
+    def test_checkpoint(self):
+        with self.assertRaises(ValueError):
+            with self.db.write_back():
+                self.db.set('a', 1)
+                self.db.checkpoint()
+                self.assertEqual(self.committed('a'), 1)
+                self.db.set('b', 1)
+                raise ValueError()
+        self.assertEqual(self.committed('a'), 1)
+        self.assertIsNone(self.committed('b'))
+
+    def test_nested_scope_commits_once(self):
+        with self.db.write_back():
+            with self.db.write_back():
+                self.db.set('a', 1)
+            self.assertIsNone(self.committed('a'))
+        self.assertEqual(self.committed('a'), 1)
+
+    def test_getrange_sees_buffered_writes(self):
+        with self.db.write_back():
+            self.db.set('heat:a', 1)
+            self.db.set('heat:b', 2)
+            self.assertEqual(self.db.getrange('heat:', strip=True),
+                             {'a': 1, 'b': 2})